@@ -0,0 +1,949 @@
+"""Offline benchmarks for the Stock Watcher Bot.
+
+Everything runs against local stand-ins, so no Telegram token or Alpha Vantage
+quota is needed.
+
+Usage:
+    python benchmarks.py fanout [--latency 0.05] [--sizes 1 5 10 30 60]
+    python benchmarks.py quota [--per-minute 5] [--per-day 25]
+    python benchmarks.py batch [--latency 0.05] [--sizes 10 50 100 300]
+    python benchmarks.py indicators [--symbols 10000] [--weeks 260]
+    python benchmarks.py watchlist [--users 100000] [--per-user 10] [--universe 5000]
+    python benchmarks.py stress [--users 5000] [--ops 50] [--threads 4] [--universe 200]
+    python benchmarks.py startup [--symbols 30] [--latency 0.05]
+    python benchmarks.py load [--users 200] [--actions 10] [--latency 0.05] [--note-rate 0.05]
+    python benchmarks.py webhook [--users 200] [--actions 10] [--workers 1 4]
+    python benchmarks.py send [--users 300] [--max-alerts 3] [--rate 25]
+    python benchmarks.py history [--symbols 1000] [--years 30]
+"""
+import argparse
+import asyncio
+import functools
+import itertools
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from collections import Counter
+from datetime import date, timedelta
+from typing import List
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+from telegram import Bot, Update
+from telegram.error import RetryAfter
+from telegram.request import BaseRequest
+
+import stockwatch
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256  # the default backlog of 5 drops bursts of connects
+
+
+def fake_price(symbol: str) -> float:
+    """Deterministic pseudo price for a symbol"""
+    return 50 + zlib.crc32(symbol.encode()) % 400
+
+
+class FakeAlphaVantage:
+    """Local HTTP server answering GLOBAL_QUOTE and TIME_SERIES_WEEKLY queries
+
+    A note_rate share of requests gets the rate limit 'Note' Alpha Vantage
+    sends instead of data when calls come too fast.
+    """
+
+    NOTE = ("Thank you for using Alpha Vantage! Our standard API rate limit is 25 requests per day. "
+            "Please subscribe to any of the premium plans to instantly remove all daily rate limits.")
+
+    def __init__(self, latency: float = 0.05, weeks: int = 260, note_rate: float = 0.0):
+        self.latency = latency
+        self.weeks = weeks
+        self.note_rate = note_rate
+        self.requests = 0
+        self.notes = 0
+        self._rng = random.Random(0)
+        self._lock = threading.Lock()
+        self._server = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_port}/query"
+
+    def response_for(self, params: dict) -> dict:
+        function = params.get('function', [''])[0]
+        symbol = params.get('symbol', [''])[0]
+        price = fake_price(symbol)
+        if function == 'GLOBAL_QUOTE':
+            return {'Global Quote': {'01. symbol': symbol, '05. price': f"{price:.4f}"}}
+        if function == 'REALTIME_BULK_QUOTES':
+            return {'endpoint': 'Realtime Bulk Quotes', 'data': [
+                {'symbol': s, 'close': f"{fake_price(s):.4f}"} for s in symbol.split(',') if s
+            ]}
+        if function == 'TIME_SERIES_WEEKLY':
+            last_friday = date.today() - timedelta(days=(date.today().weekday() - 4) % 7)
+            series = {}
+            for week in range(self.weeks):
+                close = price * (1 + 0.05 * ((week % 13) - 6) / 6)
+                series[(last_friday - timedelta(weeks=week)).isoformat()] = {
+                    '1. open': f"{close * 0.99:.4f}", '2. high': f"{close * 1.02:.4f}",
+                    '3. low': f"{close * 0.97:.4f}", '4. close': f"{close:.4f}"
+                }
+            return {'Weekly Time Series': series}
+        return {'Error Message': f"Unknown function {function}"}
+
+    def __enter__(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # keep-alive, like the real API
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                with fake._lock:
+                    fake.requests += 1
+                    note = fake._rng.random() < fake.note_rate
+                    fake.notes += note
+                time.sleep(fake.latency)
+                response = {'Note': fake.NOTE} if note else fake.response_for(parse_qs(urlparse(self.path).query))
+                body = json.dumps(response).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = _Server(('127.0.0.1', 0), Handler)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def make_bot(server: FakeAlphaVantage, **files) -> stockwatch.StockWatcherBot:
+    """A fresh bot (empty cache, history and storage, no quota limits) whose market data client talks to the fake server
+
+    Keyword arguments override the StockWatcherBot file locations, e.g. to reopen
+    the files of an earlier bot as a restart would.
+    """
+    workdir = tempfile.mkdtemp(prefix='stockwatch-bench-')
+    bot = stockwatch.StockWatcherBot(**{
+        'database_file': os.path.join(workdir, 'stock_watchlist.db'),
+        'watchlist_file': os.path.join(workdir, 'user_watchlists.json'),
+        'history_dir': None,
+        'listing_file': None,
+        'snapshot_file': None,
+        **files
+    })
+    bot.market_data = stockwatch.MarketDataClient(base_url=server.url)
+    bot.quota = stockwatch.QuotaScheduler(per_minute=10 ** 9, per_day=10 ** 9)
+    bot.alpha_vantage = stockwatch.AlphaVantageProvider(bot.market_data, bot.quota)
+    bot.provider = bot.alpha_vantage
+    return bot
+
+
+async def bench_fanout(args):
+    """Wall-clock time of a /check fan-out as the watchlist grows"""
+    print(f"Upstream latency {args.latency * 1000:.0f} ms per request, "
+          f"concurrency limit {args.concurrency}\n")
+    print(f"{'symbols':>8} {'sequential':>12} {'bounded':>12} {'speedup':>8}")
+    with FakeAlphaVantage(latency=args.latency) as server:
+        # One untimed fetch pays the first-use costs (deferred imports, HTTP stack) outside the table
+        bot = make_bot(server)
+        await bot.get_stock_prices(['WARMUP'])
+        await bot.market_data.aclose()
+        for size in args.sizes:
+            symbols = [f"SYM{i}" for i in range(size)]
+            timings = []
+            for concurrency in (1, args.concurrency):
+                bot = make_bot(server)
+                start = time.perf_counter()
+                results = await bot.get_stock_prices(symbols, concurrency=concurrency)
+                timings.append(time.perf_counter() - start)
+                await bot.market_data.aclose()
+                assert all(result is not None for result in results)
+            print(f"{size:>8} {timings[0]:>11.3f}s {timings[1]:>11.3f}s {timings[0] / timings[1]:>7.1f}x")
+
+
+async def bench_batch(args):
+    """Quote stage of /check: one GLOBAL_QUOTE per symbol vs. bulk quote requests"""
+    print(f"Upstream latency {args.latency * 1000:.0f} ms per request, "
+          f"{stockwatch.BULK_QUOTE_SIZE} symbols per bulk request\n")
+    print(f"{'symbols':>8} {'per-symbol':>12} {'requests':>9} {'bulk':>10} {'requests':>9} {'speedup':>8}")
+    with FakeAlphaVantage(latency=args.latency) as server:
+        bot = make_bot(server)  # Untimed, as in bench_fanout
+        await bot.get_stock_prices(['WARMUP'])
+        await bot.market_data.aclose()
+        for size in args.sizes:
+            symbols = [f"SYM{i}" for i in range(size)]
+            row = []
+            for bulk in (False, True):
+                bot = make_bot(server)
+                bot.provider = bot.alpha_vantage = stockwatch.AlphaVantageProvider(bot.market_data, bot.quota, bulk=bulk)
+                last_closed = stockwatch.last_closed_week().toordinal()
+                for symbol in symbols:
+                    # History is already stored, so only quotes hit the server
+                    price = fake_price(symbol)
+                    bot.history.append(symbol, [(last_closed - 7 * week, price, price, price, price)
+                                                for week in reversed(range(stockwatch.MA_WEEKS))])
+                before = server.requests
+                start = time.perf_counter()
+                results = await bot.get_stock_prices(symbols)
+                row += [time.perf_counter() - start, server.requests - before]
+                await bot.market_data.aclose()
+                assert all(isinstance(result, dict) for result in results)
+            print(f"{size:>8} {row[0]:>11.3f}s {row[1]:>9} {row[2]:>9.3f}s {row[3]:>9} {row[0] / row[2]:>7.1f}x")
+
+
+def python_indicators(closes: list, sma_windows: list, ema_windows: list) -> dict:
+    """Per-symbol pure Python reference for the indicator engine"""
+    result = {}
+    for window in sma_windows:
+        if len(closes) >= window:
+            result[f"sma_{window}"] = sum(closes[-window:]) / window
+    for window in ema_windows:
+        alpha = 2 / (window + 1)
+        ema = closes[0]
+        for close in closes[1:]:
+            ema = alpha * close + (1 - alpha) * ema
+        result[f"ema_{window}"] = ema
+    return result
+
+
+async def bench_indicators(args):
+    """One vectorized engine pass vs. a per-symbol Python loop"""
+    engine = stockwatch.IndicatorEngine()
+    rng = np.random.default_rng(0)
+    walk = 100 * np.exp(np.cumsum(rng.normal(0, 0.02, (args.weeks, args.symbols)), axis=0))
+    matrix = stockwatch.pd.DataFrame(walk, columns=[f"SYM{i}" for i in range(args.symbols)])
+    print(f"{args.symbols} symbols x {args.weeks} weeks, SMA {engine.sma_windows}, EMA {engine.ema_windows}\n")
+
+    start = time.perf_counter()
+    table = engine.compute(matrix)
+    vectorized = time.perf_counter() - start
+
+    sample = min(args.symbols, 1000)
+    start = time.perf_counter()
+    for column in range(sample):
+        reference = python_indicators(walk[:, column].tolist(), engine.sma_windows, engine.ema_windows)
+    looped = (time.perf_counter() - start) * args.symbols / sample
+    for name, value in reference.items():
+        assert abs(table.iloc[sample - 1][name] - value) < 1e-6 * value, name
+
+    print(f"vectorized engine      {vectorized * 1000:9.1f} ms")
+    print(f"per-symbol Python loop {looped * 1000:9.1f} ms (extrapolated from {sample} symbols)")
+    print(f"speedup                {looped / vectorized:9.1f}x")
+    print(f"crossovers on the latest bar: {int((table[f'cross_sma_{stockwatch.MA_WEEKS}'] != 0).sum())}")
+
+
+async def bench_watchlist(args):
+    """Indexed watchlists vs. the plain {user_id: [symbols]} dict at scale"""
+    rng = random.Random(0)
+    universe = [f"SYM{i}" for i in range(args.universe)]
+    plain = {str(user): rng.sample(universe, args.per_user) for user in range(args.users)}
+    print(f"{args.users} users x {args.per_user} symbols from a universe of {args.universe}\n")
+
+    start = time.perf_counter()
+    index = stockwatch.WatchlistIndex(plain)
+    print(f"build index                 {(time.perf_counter() - start) * 1000:9.1f} ms")
+
+    def timed(label: str, plain_fn, index_fn, repeat: int = 1):
+        timings = []
+        for fn in (plain_fn, index_fn):
+            start = time.perf_counter()
+            for _ in range(repeat):
+                result = fn()
+            timings.append((time.perf_counter() - start) / repeat)
+        print(f"{label:<27} {timings[0] * 1000:9.3f} ms -> {timings[1] * 1000:9.3f} ms ({timings[0] / timings[1]:,.0f}x)")
+        return result
+
+    def plain_symbols():
+        return {symbol for watchlist in plain.values() for symbol in watchlist}
+
+    def plain_subscribers():
+        return [user for user, watchlist in plain.items() if 'SYM7' in watchlist]
+
+    distinct = timed("distinct watched symbols", plain_symbols, lambda: set(index.symbols()))
+    assert distinct == plain_symbols()
+    subscribers = timed("subscribers of one symbol", plain_subscribers, lambda: index.subscribers('SYM7'), repeat=3)
+    assert set(subscribers) == set(plain_subscribers())
+
+    # Membership-heavy mutations on one long watchlist, as /add and /remove do
+    long_plain = universe[:2000]
+    long_index = stockwatch.WatchlistIndex({'u': long_plain})
+    timed("2k membership checks", lambda: [symbol in long_plain for symbol in universe[:2000]],
+          lambda: [long_index.contains('u', symbol) for symbol in universe[:2000]])
+    timed("remove+re-add on 2k list", lambda: [long_plain.remove('SYM0'), long_plain.append('SYM0')],
+          lambda: [long_index.remove('u', 'SYM0'), long_index.add('u', 'SYM0')], repeat=1000)
+
+
+async def bench_stress(args):
+    """Thousands of simulated users editing and reading watchlists while saves run in the background"""
+    workdir = tempfile.mkdtemp(prefix='stockwatch-stress-')
+    database_file = os.path.join(workdir, 'stock_watchlist.db')
+    bot = stockwatch.StockWatcherBot(database_file=database_file,
+                                     watchlist_file=os.path.join(workdir, 'user_watchlists.json'), history_dir=None)
+    bot.persistence.debounce = 0.01
+    universe = [f"SYM{i}" for i in range(args.universe)]
+    expected = {}
+    read_latencies = []
+    stop = threading.Event()
+
+    def simulate(user_id: str, rng: random.Random, watchlist: dict):
+        # The same /add, /remove mix a user issues; `watchlist` is the expected end state
+        symbol = rng.choice(universe)
+        if rng.random() < 0.6:
+            assert bot.add_to_watchlist(user_id, symbol) == (symbol not in watchlist)
+            watchlist[symbol] = None
+        else:
+            assert bot.remove_from_watchlist(user_id, symbol) == (symbol in watchlist)
+            watchlist.pop(symbol, None)
+
+    async def loop_user(user: int):
+        rng, watchlist = random.Random(user), {}
+        expected[str(user)] = watchlist
+        for _ in range(args.ops):
+            simulate(str(user), rng, watchlist)
+            start = time.perf_counter()
+            assert bot.get_user_watchlist(str(user)) == list(watchlist)
+            read_latencies.append(time.perf_counter() - start)
+            await asyncio.sleep(0)
+
+    def thread_users(worker: int):
+        # Writers off the event loop, racing the handlers and the persistence thread
+        for user in range(args.users + worker, args.users + args.users // 10, args.threads):
+            user_id = str(user)
+            rng, watchlist = random.Random(user_id), {}
+            expected[user_id] = watchlist
+            for _ in range(args.ops):
+                simulate(user_id, rng, watchlist)
+
+    def reader():
+        # /check-style fan-out and full snapshots, concurrently with the writers
+        while not stop.is_set():
+            for symbol in bot.watchlists.symbols()[:50]:
+                bot.watchlists.subscribers(symbol)
+            bot.watchlists.to_dict()
+            time.sleep(0.001)
+
+    loop = asyncio.get_running_loop()
+    readers = [threading.Thread(target=reader, daemon=True) for _ in range(2)]
+    for thread in readers:
+        thread.start()
+    start = time.perf_counter()
+    await asyncio.gather(*(loop_user(user) for user in range(args.users)),
+                         *(loop.run_in_executor(None, thread_users, worker) for worker in range(args.threads)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    for thread in readers:
+        thread.join()
+    await bot.persistence.aclose()
+
+    total = args.ops * (args.users + args.users // 10)
+    read_latencies.sort()
+    print(f"{args.users} loop users + {args.users // 10} thread users x {args.ops} ops, "
+          f"{len(readers)} snapshot readers, {args.threads} writer threads")
+    print(f"{total} watchlist changes in {elapsed:.2f} s ({total / elapsed:,.0f}/s)")
+    print(f"/list read p50 {read_latencies[len(read_latencies) // 2] * 1e6:.1f} us, "
+          f"p99 {read_latencies[int(len(read_latencies) * 0.99)] * 1e6:.1f} us")
+    print(f"persistence: {bot.persistence.stats()}")
+
+    # Memory, reverse index and the database must all agree with what each user did
+    memory = bot.watchlists.to_dict()
+    wanted = {user_id: list(watchlist) for user_id, watchlist in expected.items() if watchlist}
+    assert {u: l for u, l in memory.items() if l} == wanted, "in-memory watchlists diverged"
+    for user_id, symbols in wanted.items():
+        assert all(user_id in bot.watchlists.subscribers(symbol) for symbol in symbols), "reverse index diverged"
+    assert sum(len(bot.watchlists.subscribers(s)) for s in bot.watchlists.symbols()) == \
+        sum(len(symbols) for symbols in wanted.values()), "reverse index has stale entries"
+    stored = stockwatch.SqliteWatchlistStorage(database_file).load()
+    assert {u: set(l) for u, l in stored.items()} == {u: set(l) for u, l in wanted.items()}, "database diverged"
+    print("memory, reverse index and database agree")
+
+
+async def bench_startup(args):
+    """Startup cost and the first replies after a restart, with and without the persisted warm-up data"""
+    here = os.path.dirname(os.path.abspath(__file__))
+
+    def import_seconds(touch: str) -> float:
+        code = f"import time; t = time.perf_counter(); import stockwatch{touch}; print(time.perf_counter() - t)"
+        return min(float(subprocess.check_output([sys.executable, '-c', code], cwd=here)) for _ in range(3))
+
+    deferred = import_seconds('')
+    eager = import_seconds('; stockwatch.pd.DataFrame; stockwatch.yf.download')
+    print(f"import stockwatch            {deferred * 1000:8.0f} ms (heavy imports deferred)")
+    print(f"  with pandas/yfinance       {eager * 1000:8.0f} ms (what every start paid before)\n")
+
+    symbols = [f"SYM{i}" for i in range(args.symbols)]
+    workdir = tempfile.mkdtemp(prefix='stockwatch-startup-')
+    files = {
+        'database_file': os.path.join(workdir, 'stock_watchlist.db'),
+        'history_dir': os.path.join(workdir, 'price_history'),
+        'snapshot_file': os.path.join(workdir, 'market_snapshot.json')
+    }
+    with FakeAlphaVantage(latency=args.latency) as server:
+        # The previous run: a user watches the symbols, /check fetched them, then the bot shut down
+        previous = make_bot(server, **files)
+        for symbol in symbols:
+            previous.add_to_watchlist(1, symbol)
+        await previous.get_stock_prices(symbols)
+        await previous.persistence.aclose()
+        previous.save_snapshot()
+        await previous.market_data.aclose()
+
+        print(f"{args.symbols} watched symbols, upstream latency {args.latency * 1000:.0f} ms\n")
+        print(f"{'restart':<8} {'ready':>10} {'first /price':>14} {'first /check':>14} {'requests':>9}")
+        for label, restart_files in (('cold', {'database_file': files['database_file']}), ('warm', files)):
+            start = time.perf_counter()
+            bot = make_bot(server, **restart_files)
+            if label == 'warm':
+                bot.warm_up()
+            ready = time.perf_counter() - start
+            before = server.requests
+
+            start = time.perf_counter()
+            if bot.last_known_price(symbols[0]) is None:
+                await bot.get_stock_price(symbols[0], stockwatch.PRIORITY_INTERACTIVE)
+            first_price = time.perf_counter() - start
+
+            start = time.perf_counter()
+            await bot.get_stock_prices(symbols)
+            first_check = time.perf_counter() - start
+            print(f"{label:<8} {ready * 1000:8.1f} ms {first_price * 1000:11.1f} ms "
+                  f"{first_check * 1000:11.1f} ms {server.requests - before:>9}")
+            await bot.persistence.aclose()
+            await bot.market_data.aclose()
+
+
+class FakeTelegram(BaseRequest):
+    """Bot API stand-in: answers every call locally after `latency` seconds and counts calls per method"""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls = Counter()
+        self._message_ids = itertools.count(1)
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url: str, method: str, request_data=None, read_timeout=None,
+                         write_timeout=None, connect_timeout=None, pool_timeout=None):
+        api_method = url.rsplit('/', 1)[-1]
+        params = request_data.parameters if request_data else {}
+        self.calls[api_method] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if api_method == 'getMe':
+            result = {'id': 1, 'is_bot': True, 'first_name': 'Stock Watcher', 'username': 'stock_watcher_bot'}
+        elif api_method in ('sendMessage', 'editMessageText'):
+            result = {
+                'message_id': params.get('message_id') or next(self._message_ids),
+                'date': int(time.time()),
+                'chat': {'id': params.get('chat_id', 0), 'type': 'private'},
+                'text': params.get('text', '')
+            }
+        else:
+            result = True
+        return 200, json.dumps({'ok': True, 'result': result}).encode()
+
+
+class UpdateFactory:
+    """Synthetic private-chat updates in the shape Telegram sends them, as Updates or as raw webhook JSON"""
+
+    def __init__(self, application=None):
+        self.bot = application.bot if application else None
+        self._ids = itertools.count(1)
+
+    def _user(self, user_id: int) -> dict:
+        return {'id': user_id, 'is_bot': False, 'first_name': f"User{user_id}"}
+
+    def _message(self, user_id: int, text: str) -> dict:
+        return {'message_id': next(self._ids), 'date': int(time.time()), 'text': text,
+                'chat': {'id': user_id, 'type': 'private'}, 'from': self._user(user_id)}
+
+    def command_data(self, user_id: int, text: str) -> dict:
+        message = self._message(user_id, text)
+        if text.startswith('/'):
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+        return {'update_id': next(self._ids), 'message': message}
+
+    def button_data(self, user_id: int, data: str) -> dict:
+        return {'update_id': next(self._ids), 'callback_query': {
+            'id': str(next(self._ids)), 'from': self._user(user_id), 'chat_instance': str(user_id),
+            'data': data, 'message': self._message(user_id, "previous reply")
+        }}
+
+    def command(self, user_id: int, text: str) -> Update:
+        return Update.de_json(self.command_data(user_id, text), self.bot)
+
+    def button(self, user_id: int, data: str) -> Update:
+        return Update.de_json(self.button_data(user_id, data), self.bot)
+
+
+def user_session(rng: random.Random, universe: List[str], actions: int) -> List[tuple]:
+    """A plausible sequence of (kind, payload) interactions for one user"""
+    watched = rng.sample(universe, 3)
+    session = [('command', '/start'), ('command', f"/add {' '.join(watched)}")]
+    while len(session) < actions:
+        choice = rng.random()
+        symbol = rng.choice(universe)
+        if choice < 0.35:
+            session.append(('command', f"/price {symbol}"))
+        elif choice < 0.5:
+            session.append(('button', f"price_{symbol}"))
+        elif choice < 0.65:
+            session.append(('command', '/list'))
+        elif choice < 0.8:
+            session.append(('command', '/check'))
+        elif choice < 0.9:
+            session.append(('command', f"/add {symbol}"))
+        else:
+            session.append(('command', f"/remove {rng.choice(watched)}"))
+    return session[:actions]
+
+
+def percentiles(samples: List[float]) -> str:
+    samples = sorted(samples)
+    pick = lambda q: samples[min(len(samples) - 1, int(q * len(samples)))] * 1000
+    return f"{pick(0.5):8.1f} {pick(0.95):8.1f} {pick(0.99):8.1f} {samples[-1] * 1000:8.1f}"
+
+
+async def bench_load(args):
+    """Replay N simulated users against the real handlers, with fake Telegram and Alpha Vantage"""
+    stockwatch.metrics = stockwatch.Metrics()
+    universe = [f"SYM{i}" for i in range(args.universe)]
+    telegram = FakeTelegram(latency=args.telegram_latency)
+    latencies = {}
+    with FakeAlphaVantage(latency=args.latency, note_rate=args.note_rate) as server:
+        stockwatch.bot = make_bot(server)
+        if args.per_minute:
+            stockwatch.bot.quota = stockwatch.QuotaScheduler(args.per_minute, args.per_day)
+            stockwatch.bot.alpha_vantage.quota = stockwatch.bot.quota
+        application = stockwatch.build_application(token='123456:LOADTEST', request=telegram)
+        await application.initialize()
+        updates = UpdateFactory(application)
+
+        async def replay(user_id: int):
+            rng = random.Random(user_id)
+            for kind, payload in user_session(rng, universe, args.actions):
+                update = updates.command(user_id, payload) if kind == 'command' else updates.button(user_id, payload)
+                label = payload.split()[0] if kind == 'command' else 'button:' + payload.split('_')[0]
+                start = time.perf_counter()
+                await application.process_update(update)
+                latencies.setdefault(label, []).append(time.perf_counter() - start)
+                if args.think:
+                    await asyncio.sleep(rng.expovariate(1 / args.think))
+
+        start = time.perf_counter()
+        await asyncio.gather(*(replay(user_id) for user_id in range(1, args.users + 1)))
+        elapsed = time.perf_counter() - start
+        # Let background refreshes started by /price finish before closing
+        await asyncio.gather(*[task for task in asyncio.all_tasks() if task is not asyncio.current_task()],
+                             return_exceptions=True)
+        await application.shutdown()
+        await stockwatch.bot.persistence.aclose()
+        await stockwatch.bot.market_data.aclose()
+
+    total = sum(len(samples) for samples in latencies.values())
+    print(f"{args.users} users x {args.actions} actions over {args.universe} symbols; "
+          f"upstream {args.latency * 1000:.0f} ms, Telegram {args.telegram_latency * 1000:.0f} ms, "
+          f"{args.note_rate:.0%} rate-limit notes\n")
+    print(f"{total} updates in {elapsed:.2f} s: {total / elapsed:,.0f} updates/s\n")
+    print(f"{'update':<16} {'count':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    for label, samples in sorted(latencies.items(), key=lambda item: -len(item[1])):
+        print(f"{label:<16} {len(samples):>7} {percentiles(samples)}")
+    print(f"{'all':<16} {total:>7} {percentiles([x for samples in latencies.values() for x in samples])}")
+
+    errors = sum(value for (name, _), value in stockwatch.metrics.counters.items() if name == 'handler_errors_total')
+    print(f"\nAlpha Vantage: {server.requests} requests, {server.notes} rate-limit notes; "
+          f"Telegram: {dict(telegram.calls)}; handler errors: {errors:g}")
+    print(f"Quota: {stockwatch.bot.quota.stats()}")
+    print(f"Cache: {stockwatch.bot.cache.stats()}")
+
+
+def webhook_worker_setup(base_url: str, telegram_latency: float, bot: stockwatch.StockWatcherBot) -> BaseRequest:
+    """Runs inside each webhook worker: point it at the fake Alpha Vantage and answer Bot API calls locally"""
+    stockwatch.METRICS_PORT = None
+    bot.market_data = stockwatch.MarketDataClient(base_url=base_url)
+    bot.quota = stockwatch.QuotaScheduler(per_minute=10 ** 9, per_day=10 ** 9)
+    bot.alpha_vantage = stockwatch.AlphaVantageProvider(bot.market_data, bot.quota)
+    bot.provider = bot.alpha_vantage
+    return FakeTelegram(latency=telegram_latency)
+
+
+async def bench_webhook(args):
+    """Post a simulated webhook update stream to the dispatcher with 1 vs. N worker processes"""
+    universe = [f"SYM{i}" for i in range(args.universe)]
+    sessions = {user_id: user_session(random.Random(user_id), universe, args.actions)
+                for user_id in range(1, args.users + 1)}
+    print(f"{args.users} users x {args.actions} actions over {args.universe} symbols; "
+          f"upstream {args.latency * 1000:.0f} ms, Telegram {args.telegram_latency * 1000:.0f} ms, "
+          f"{os.cpu_count()} CPU(s)\n")
+    print(f"{'workers':>7} {'updates/s':>10} {'requests':>9}   {'per worker: updates, handler p50/p95/p99 ms'}")
+    loop = asyncio.get_running_loop()
+    for count in args.workers:
+        workdir = tempfile.mkdtemp(prefix='stockwatch-webhook-')
+        with FakeAlphaVantage(latency=args.latency) as server:
+            bot_options = {
+                'database_file': os.path.join(workdir, 'stock_watchlist.db'),
+                'watchlist_file': os.path.join(workdir, 'user_watchlists.json'),
+                'history_dir': os.path.join(workdir, 'history'),
+                'listing_file': None,
+                'snapshot_file': None,
+                'shared_cache_file': os.path.join(workdir, 'quote_cache.db')
+            }
+            setup = functools.partial(webhook_worker_setup, server.url, args.telegram_latency)
+            processes, connections = await loop.run_in_executor(
+                None, stockwatch.start_workers, count, bot_options, setup)
+            dispatcher = stockwatch.WebhookDispatcher(connections, secret='bench-secret')
+            front = await asyncio.start_server(dispatcher.handle, '127.0.0.1', 0)
+            updates = UpdateFactory()
+
+            async def post(user_id: int, secret: str = 'bench-secret') -> int:
+                """Deliver a user's updates in order over one keep-alive connection, as Telegram does"""
+                reader, writer = await asyncio.open_connection(*front.sockets[0].getsockname()[:2])
+                updates_sent = sessions[user_id] if user_id else [('command', '/start')]
+                for kind, payload in updates_sent:
+                    data = (updates.command_data(user_id, payload) if kind == 'command'
+                            else updates.button_data(user_id, payload))
+                    body = json.dumps(data).encode()
+                    writer.write(f"POST {stockwatch.WEBHOOK_PATH} HTTP/1.1\r\nHost: bench\r\n"
+                                 f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n"
+                                 f"X-Telegram-Bot-Api-Secret-Token: {secret}\r\n\r\n".encode() + body)
+                    status = int((await reader.readline()).split()[1])
+                    while await reader.readline() not in (b'\r\n', b''):
+                        pass
+                    if status != 200:
+                        break
+                writer.close()
+                return status
+
+            assert await post(0, secret='wrong') == 403
+            start = time.perf_counter()
+            assert set(await asyncio.gather(*(post(user_id) for user_id in sessions))) == {200}
+            # Workers finish what they were sent before reporting back
+            dispatcher.close()
+            stats = await loop.run_in_executor(None, stockwatch.stop_workers, processes, connections)
+            elapsed = time.perf_counter() - start
+            front.close()
+            await front.wait_closed()
+
+        processed = sum(worker['updates'] for worker in stats)
+        errors = sum(worker['errors'] for worker in stats)
+        assert processed == args.users * args.actions, f"{processed} of {args.users * args.actions} updates processed"
+        assert not errors, f"{errors:g} handler errors"
+        per_worker = []
+        for worker in sorted(stats, key=lambda worker: worker['worker']):
+            merged = stockwatch.Histogram()
+            for histogram in worker['handlers'].values():
+                merged.counts = [a + b for a, b in zip(merged.counts, histogram.counts)]
+                merged.count += histogram.count
+            quantiles = "/".join(f"{merged.quantile(q) * 1000:.0f}" for q in (0.5, 0.95, 0.99))
+            per_worker.append(f"{worker['updates']} {quantiles}")
+        print(f"{count:>7} {processed / elapsed:>10,.0f} {server.requests:>9}   {'; '.join(per_worker)}")
+
+
+class FloodControlledTelegram(FakeTelegram):
+    """FakeTelegram that enforces flood limits like Telegram: sends over the limit get a 429 with retry_after"""
+
+    def __init__(self, latency: float = 0.0, rate: float = 30, per_chat_rate: float = 1, per_chat_burst: int = 3):
+        super().__init__(latency)
+        self.bucket = stockwatch.TokenBucket(rate, rate)
+        self.per_chat_rate = per_chat_rate
+        self.per_chat_burst = per_chat_burst
+        self.chat_buckets = {}
+        self.rejected = 0
+        self.delivered = Counter()  # messages per chat
+
+    async def do_request(self, url: str, method: str, request_data=None, read_timeout=None,
+                         write_timeout=None, connect_timeout=None, pool_timeout=None):
+        if url.endswith('/sendMessage'):
+            chat_id = request_data.parameters['chat_id']
+            chat = self.chat_buckets.setdefault(chat_id, stockwatch.TokenBucket(self.per_chat_burst, self.per_chat_rate))
+            wait = max(self.bucket.wait_time(), chat.wait_time())
+            if wait > 0:
+                self.rejected += 1
+                return 429, json.dumps({'ok': False, 'error_code': 429,
+                                        'description': f"Too Many Requests: retry after {math.ceil(wait)}",
+                                        'parameters': {'retry_after': math.ceil(wait)}}).encode()
+            self.bucket.take()
+            chat.take()
+            self.delivered[chat_id] += 1
+        return await super().do_request(url, method, request_data, read_timeout, write_timeout,
+                                        connect_timeout, pool_timeout)
+
+
+async def bench_send(args):
+    """An alert broadcast sent one by one vs. through the send queue, against flood-controlled Telegram"""
+    rng = random.Random(1)
+    alerts = [(user_id, f"🔔 **SYM{rng.randrange(100)} crossed above its 52-Week SMA**")
+              for user_id in range(1, args.users + 1) for _ in range(rng.randint(1, args.max_alerts))]
+    print(f"{len(alerts)} alerts for {args.users} users; Telegram latency {args.telegram_latency * 1000:.0f} ms, "
+          f"limits 30/s overall and 1/s per chat after a burst of 3\n")
+    print(f"{'mode':<10} {'seconds':>8} {'messages':>9} {'429s':>6} {'lost':>6} {'wait p50 ms':>12} {'wait p95 ms':>12}")
+
+    for mode in ('direct', 'queue'):
+        stockwatch.metrics = stockwatch.Metrics()
+        telegram = FloodControlledTelegram(latency=args.telegram_latency)
+        telegram_bot = Bot('123456:SENDTEST', request=telegram, get_updates_request=FakeTelegram())
+        await telegram_bot.initialize()
+        start = time.perf_counter()
+        lost = 0
+        if mode == 'direct':
+            # The old scan_alerts loop: one send_message per alert, errors logged and dropped
+            for user_id, text in alerts:
+                try:
+                    await telegram_bot.send_message(chat_id=user_id, text=text, parse_mode='Markdown')
+                except RetryAfter:
+                    lost += 1
+            waits = ""
+        else:
+            outbox = stockwatch.SendQueue(telegram_bot, rate=args.rate)
+            for user_id, text in alerts:
+                outbox.notify(user_id, text)
+            await outbox.aclose(timeout=3600)
+            lost = outbox.failed
+            histogram = stockwatch.metrics.histograms[('send_queue_wait_seconds', ())]
+            waits = f"{histogram.quantile(0.5) * 1000:12.0f} {histogram.quantile(0.95) * 1000:12.0f}"
+        elapsed = time.perf_counter() - start
+        print(f"{mode:<10} {elapsed:8.1f} {sum(telegram.delivered.values()):>9} {telegram.rejected:>6} {lost:>6} {waits}")
+        await telegram_bot.shutdown()
+
+
+def random_walk_bars(rng: random.Random, start: date, weeks: int, price: float = 100.0) -> List[tuple]:
+    """(day ordinal, open, high, low, close) weekly bars of a random walk"""
+    bars = []
+    for week in range(weeks):
+        close = price * math.exp(rng.gauss(0.0015, 0.025))
+        bars.append(((start + timedelta(weeks=week)).toordinal(), price,
+                     max(price, close) * 1.01, min(price, close) * 0.99, close))
+        price = close
+    return bars
+
+
+async def bench_history(args):
+    """Columnar history store: appends, loads, zero-copy windows and a local backtest"""
+    workdir = tempfile.mkdtemp(prefix='stockwatch-history-')
+    rng = random.Random(7)
+    weeks = args.years * 52
+    first_week = stockwatch.last_closed_week() - timedelta(weeks=weeks)
+    symbols = ['SPY'] + [f"SYM{i}" for i in range(args.symbols - 1)]
+    store = stockwatch.HistoryStore(workdir)
+    series = {symbol: random_walk_bars(rng, first_week, weeks - args.appends) for symbol in symbols}
+    start = time.perf_counter()
+    for symbol, bars in series.items():
+        store.append(symbol, bars)
+    print(f"{args.symbols} symbols x {weeks} weeks of OHLC written in {time.perf_counter() - start:.2f} s")
+
+    # A weekly refresh: every symbol gets one more closed week, args.appends times
+    start = time.perf_counter()
+    for week in range(weeks - args.appends, weeks):
+        day = first_week + timedelta(weeks=week)
+        for symbol in symbols:
+            last = store.get(symbol).closes[-1]
+            store.append(symbol, [(day.toordinal(), last, last * 1.01, last * 0.99, last * 1.001)])
+    appended = args.appends * len(symbols)
+    print(f"{appended} single-week appends: {(time.perf_counter() - start) / appended * 1e6:.0f} us each")
+
+    store = stockwatch.HistoryStore(workdir)
+    start = time.perf_counter()
+    histories = [store.get(symbol) for symbol in symbols]
+    print(f"\n{'load all symbols':<24} {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    start = time.perf_counter()
+    sums = [sum(history.tail(stockwatch.MA_WEEKS)) for history in histories]
+    window = time.perf_counter() - start
+    spy = histories[0]
+    assert np.shares_memory(np.frombuffer(spy.tail(52), dtype=float), np.frombuffer(spy.closes, dtype=float))
+    print(f"{'52-week windows':<24} {window / len(sums) * 1e6:.1f} us per symbol, sharing the loaded column's memory")
+
+    start = time.perf_counter()
+    crossings = stockwatch.ma_crossings(spy, stockwatch.MA_WEEKS)
+    query = time.perf_counter() - start
+    above = sum(1 for _, direction in crossings if direction > 0)
+    print(f"\nSPY crossed its {stockwatch.MA_WEEKS}-week MA {len(crossings)} times in {weeks} weeks "
+          f"({above} up, {len(crossings) - above} down), computed locally in {query * 1000:.2f} ms")
+    for day, direction in crossings[-3:]:
+        print(f"  {day}  {'above' if direction > 0 else 'below'}")
+    start = time.perf_counter()
+    total = sum(len(stockwatch.ma_crossings(history)) for history in histories)
+    print(f"All {len(histories)} symbols: {total} crossings in {(time.perf_counter() - start) * 1000:.0f} ms")
+
+
+class SimulatedClock:
+    """Virtual time for QuotaScheduler: sleeping advances the clock instantly"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+    async def sleep(self, seconds: float):
+        await asyncio.sleep(0)  # Let tasks woken at the current time run first
+        self.now += seconds
+        await asyncio.sleep(0)
+
+
+async def bench_quota(args):
+    """Replay request bursts against the quota scheduler on a simulated clock"""
+    failures = []
+
+    def check(name: str, ok: bool):
+        print(f"  [{'PASS' if ok else 'FAIL'}] {name}")
+        if not ok:
+            failures.append(name)
+
+    def new_scheduler():
+        clock = SimulatedClock()
+        quota = stockwatch.QuotaScheduler(args.per_minute, args.per_day, clock=clock, sleep=clock.sleep)
+        return clock, quota
+
+    # Bulk /check work is queued first, then interactive /price requests arrive
+    clock, quota = new_scheduler()
+    grants = []
+
+    async def request(name: str, priority: int):
+        await quota.acquire(priority)
+        grants.append((clock.now, name))
+
+    tasks = [asyncio.create_task(request(f"bulk-{i}", stockwatch.PRIORITY_BULK)) for i in range(args.per_minute + 5)]
+    await asyncio.sleep(0)
+    tasks += [asyncio.create_task(request(f"price-{i}", stockwatch.PRIORITY_INTERACTIVE)) for i in range(3)]
+    await asyncio.gather(*tasks)
+    print("Grant timeline (simulated seconds):")
+    for at, name in grants:
+        print(f"  t={at:7.1f}  {name}")
+    order = [name for _, name in grants]
+    queued_bulk = [order.index(f"bulk-{i}") for i in range(args.per_minute, args.per_minute + 5)]
+    check("interactive requests overtake queued bulk work",
+          all(order.index(f"price-{i}") < min(queued_bulk) for i in range(3)))
+    check("grants never exceed the per-minute bucket",
+          all(n + 1 <= args.per_minute + at * args.per_minute / 60 + 1e-9 for n, (at, _) in enumerate(grants)))
+
+    # Exhaust the daily quota; the next caller gets an ETA instead of waiting silently
+    clock, quota = new_scheduler()
+    for _ in range(args.per_day):
+        await quota.acquire(stockwatch.PRIORITY_BULK)
+    try:
+        await quota.acquire(stockwatch.PRIORITY_INTERACTIVE, max_wait=stockwatch.QUOTA_MAX_WAIT)
+        check("request over the daily quota is rejected", False)
+    except stockwatch.QuotaExceeded as e:
+        print(f"\nAfter {args.per_day} calls in {clock.now / 60:.0f} simulated min: retry in {stockwatch.format_eta(e.eta)}")
+        check("request over the daily quota is rejected with an ETA", e.eta > stockwatch.QUOTA_MAX_WAIT)
+
+    # A cancelled waiter must not consume a token
+    clock, quota = new_scheduler()
+    for _ in range(args.per_minute):
+        await quota.acquire()
+    waiter = asyncio.create_task(quota.acquire())
+    await asyncio.sleep(0)
+    waiter.cancel()
+    await asyncio.gather(waiter, return_exceptions=True)
+    await quota.acquire()
+    check("cancelled waiters do not consume quota", quota.granted == args.per_minute + 1)
+
+    if failures:
+        raise SystemExit(f"{len(failures)} check(s) failed")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    fanout = subparsers.add_parser('fanout', help='bounded-concurrency /check fan-out vs. sequential')
+    fanout.add_argument('--latency', type=float, default=0.05)
+    fanout.add_argument('--concurrency', type=int, default=stockwatch.FETCH_CONCURRENCY)
+    fanout.add_argument('--sizes', type=int, nargs='+', default=[1, 5, 10, 30, 60])
+    fanout.set_defaults(func=bench_fanout)
+
+    quota = subparsers.add_parser('quota', help='quota scheduler on a simulated clock')
+    quota.add_argument('--per-minute', type=int, default=stockwatch.API_CALLS_PER_MINUTE)
+    quota.add_argument('--per-day', type=int, default=stockwatch.API_CALLS_PER_DAY)
+    quota.set_defaults(func=bench_quota)
+
+    batch = subparsers.add_parser('batch', help='bulk quote requests vs. one request per symbol')
+    batch.add_argument('--latency', type=float, default=0.05)
+    batch.add_argument('--sizes', type=int, nargs='+', default=[10, 50, 100, 300])
+    batch.set_defaults(func=bench_batch)
+
+    indicators = subparsers.add_parser('indicators', help='vectorized indicator engine over a large universe')
+    indicators.add_argument('--symbols', type=int, default=10000)
+    indicators.add_argument('--weeks', type=int, default=260)
+    indicators.set_defaults(func=bench_indicators)
+
+    watchlist = subparsers.add_parser('watchlist', help='indexed watchlists with 100k users')
+    watchlist.add_argument('--users', type=int, default=100000)
+    watchlist.add_argument('--per-user', type=int, default=10)
+    watchlist.add_argument('--universe', type=int, default=5000)
+    watchlist.set_defaults(func=bench_watchlist)
+
+    stress = subparsers.add_parser('stress', help='concurrent watchlist edits, reads and background saves')
+    stress.add_argument('--users', type=int, default=5000)
+    stress.add_argument('--ops', type=int, default=50)
+    stress.add_argument('--threads', type=int, default=4)
+    stress.add_argument('--universe', type=int, default=200)
+    stress.set_defaults(func=bench_stress)
+
+    startup = subparsers.add_parser('startup', help='import time and first replies after a cold vs. warmed restart')
+    startup.add_argument('--symbols', type=int, default=30)
+    startup.add_argument('--latency', type=float, default=0.05)
+    startup.set_defaults(func=bench_startup)
+
+    load = subparsers.add_parser('load', help='replay simulated users against the real handlers')
+    load.add_argument('--users', type=int, default=200)
+    load.add_argument('--actions', type=int, default=10)
+    load.add_argument('--universe', type=int, default=50)
+    load.add_argument('--latency', type=float, default=0.05, help='fake Alpha Vantage latency in seconds')
+    load.add_argument('--telegram-latency', type=float, default=0.02, help='fake Bot API latency in seconds')
+    load.add_argument('--note-rate', type=float, default=0.0, help="share of upstream calls answered with a rate-limit 'Note'")
+    load.add_argument('--think', type=float, default=0.0, help='mean pause between a user\'s actions in seconds')
+    load.add_argument('--per-minute', type=int, default=0, help='enforce this Alpha Vantage quota (0: unlimited)')
+    load.add_argument('--per-day', type=int, default=stockwatch.API_CALLS_PER_DAY)
+    load.set_defaults(func=bench_load)
+
+    webhook = subparsers.add_parser('webhook', help='simulated webhook stream routed to worker processes')
+    webhook.add_argument('--users', type=int, default=200)
+    webhook.add_argument('--actions', type=int, default=10)
+    webhook.add_argument('--universe', type=int, default=50)
+    webhook.add_argument('--workers', type=int, nargs='+', default=[1, 4])
+    webhook.add_argument('--latency', type=float, default=0.05, help='fake Alpha Vantage latency in seconds')
+    webhook.add_argument('--telegram-latency', type=float, default=0.02, help='fake Bot API latency in seconds')
+    webhook.set_defaults(func=bench_webhook)
+
+    send = subparsers.add_parser('send', help='alert broadcast through the send queue vs. direct sends')
+    send.add_argument('--users', type=int, default=300)
+    send.add_argument('--max-alerts', type=int, default=3, help='alerts per user are drawn from 1..max')
+    send.add_argument('--rate', type=float, default=stockwatch.SEND_RATE,
+                      help='send queue rate; above 30 makes Telegram answer with RetryAfter')
+    send.add_argument('--telegram-latency', type=float, default=0.02, help='fake Bot API latency in seconds')
+    send.set_defaults(func=bench_send)
+
+    history = subparsers.add_parser('history', help='columnar history store and a local MA-crossing backtest')
+    history.add_argument('--symbols', type=int, default=1000)
+    history.add_argument('--years', type=int, default=30)
+    history.add_argument('--appends', type=int, default=4, help='weeks appended one at a time after the bulk load')
+    history.set_defaults(func=bench_history)
+
+    args = parser.parse_args()
+    asyncio.run(args.func(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,22 +1,42 @@
-import logging
-import requests
-from telegram import Update, BotCommand
-from telegram.ext import ApplicationBuilder, CommandHandler, ContextTypes, JobQueue
-from collections import defaultdict
-
 ALPHA_VANTAGE_API_KEY = 'XXX'
 BOT_TOKEN = 'XXX'
 TELEGRAM_CHAT_ID = 'XXX'
+import time
+PROCESS_STARTED = time.perf_counter()  # time-to-first-ready and time-to-first-reply are measured from here
 import logging
+import atexit
+import csv
+import importlib.util
 import json
+import multiprocessing
 import os
-from typing import Dict, List
+import sys
+import functools
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Set, Union
 import asyncio
-from datetime import datetime, timedelta
-import yfinance as yf
-import pandas as pd
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes, CallbackQueryHandler
+import bisect
+import heapq
+import hmac
+import itertools
+import re
+import secrets
+import sqlite3
+import threading
+from array import array
+from datetime import date, datetime, timedelta
+from zoneinfo import ZoneInfo
+try:
+    import fcntl
+except ImportError:  # Windows: history appends are not locked
+    fcntl = None
+import httpx
+from telegram import Bot, Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import BadRequest, NetworkError, RetryAfter
+from telegram.request import HTTPXRequest
+from telegram.ext import Application, CommandHandler, MessageHandler, TypeHandler, filters, ContextTypes, CallbackQueryHandler
 
 # Configure logging
 logging.basicConfig(
@@ -24,147 +44,1683 @@ logging.basicConfig(
     level=logging.INFO
 )
 logger = logging.getLogger(__name__)
+# httpx logs every request URL at INFO, which would include the API key
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+# Defer importing yfinance, pandas and numpy (about a second together) until first use;
+# main() then loads them during warm-up, before the first update is handled
+FAST_STARTUP = True
+
+
+def lazy_import(name: str):
+    """Import a module on first attribute access when FAST_STARTUP is on"""
+    if not FAST_STARTUP or name in sys.modules:
+        return importlib.import_module(name)
+    spec = importlib.util.find_spec(name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+
+yf = lazy_import('yfinance')
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
 
 # File to store user watchlists
 WATCHLIST_FILE = "user_watchlists.json"
+DATABASE_FILE = "stock_watchlist.db"
+# 'sqlite' keeps watchlists as rows in DATABASE_FILE and writes only the changed rows;
+# 'json' rewrites WATCHLIST_FILE on every change
+WATCHLIST_BACKEND = 'sqlite'
+PERSIST_DEBOUNCE = 2.0  # seconds watchlist changes are collected before being written together
+PERSIST_MAX_PENDING = 100  # write immediately once this many changes are waiting
+
+# Alpha Vantage HTTP client
+ALPHA_VANTAGE_URL = "https://www.alphavantage.co/query"
+HTTP_TIMEOUT = 10  # per-request deadline in seconds, including time spent waiting for a pooled connection
+HTTP_MAX_CONNECTIONS = 20
+FETCH_CONCURRENCY = 8  # max symbols fetched in parallel by /check and /add
+
+# Alpha Vantage quota (free tier: 5 requests per minute, 25 per day)
+API_CALLS_PER_MINUTE = 5
+API_CALLS_PER_DAY = 25
+QUOTA_MAX_WAIT = 30  # seconds a request may queue for quota before the caller is told to retry later
+PRIORITY_INTERACTIVE = 0  # /price and the Refresh button
+PRIORITY_BULK = 1  # /check and /add validation
+
+# Quote source: 'alphavantage', or 'yfinance' to fetch whole watchlists in one request
+# without spending Alpha Vantage quota (weekly history always comes from Alpha Vantage)
+QUOTE_PROVIDER = 'alphavantage'
+ALPHA_VANTAGE_BULK_QUOTES = False  # REALTIME_BULK_QUOTES needs a premium API key
+BULK_QUOTE_SIZE = 100  # max symbols per REALTIME_BULK_QUOTES call
+
+# Alpha Vantage response cache
+QUOTE_CACHE_TTL = 60  # seconds a GLOBAL_QUOTE price stays fresh
+STALE_MAX_AGE = 24 * 3600  # /price answers instantly from data up to this old, then refreshes it in place
+SNAPSHOT_FILE = "market_snapshot.json"  # last known data per symbol, saved on shutdown and reloaded at startup
+CACHE_MAX_ENTRIES = 2048
+CACHE_MAX_BYTES = 16 * 1024 * 1024
+MA_WEEKS = 52
+MARKET_TIMEZONE = ZoneInfo("America/New_York")
+
+# Symbol directory for /add: the CSV returned by Alpha Vantage's LISTING_STATUS function
+# (symbol,name,exchange,assetType,...). Listed symbols are validated without an API call.
+SYMBOL_LISTING_FILE = "listing_status.csv"
+INVALID_SYMBOL_TTL = 6 * 3600  # seconds a ticker the provider did not know is rejected without asking again
+
+# Weekly close history, kept across restarts so TIME_SERIES_WEEKLY is fetched once per week per symbol
+HISTORY_DIR = "price_history"
+
+# Indicators computed for every symbol in one vectorized pass (windows in weeks; the
+# MA_WEEKS SMA behind /price and /check is always included)
+SMA_WINDOWS = [45, 52]
+EMA_WINDOWS = [52]
+INDICATOR_HISTORY_WEEKS = 260  # weeks fed to the engine; a longer history lets EMAs settle
+
+# Long replies: /check shows results as they arrive and /list pages through the watchlist
+MESSAGE_LIMIT = 4000  # characters per message, under Telegram's 4096 to leave room for Markdown
+CHECK_EDIT_INTERVAL = 1.5  # seconds between edits of a /check reply while results are still arriving
+LIST_PAGE_SIZE = 25  # symbols per /list page
+
+# Outbound notifications: Telegram allows about 30 messages per second in total and about one per second to a chat
+SEND_RATE = 25  # messages per second across all chats
+SEND_RATE_PER_CHAT = 1.0  # messages per second to one chat, after a burst of SEND_BURST_PER_CHAT
+SEND_BURST_PER_CHAT = 3
+SEND_BATCH_WINDOW = 1.0  # seconds a notification waits for others to the same chat to be merged into it
+SEND_MAX_ATTEMPTS = 3  # tries per message on network errors; waiting out a RetryAfter does not count
+
+# Crossover alerts
+ALERT_SCAN_INTERVAL = 3 * 60 * 60  # seconds between scans; each scan costs one quote per distinct watched symbol
+ALERT_INDICATOR = f"sma_{MA_WEEKS}"  # the average whose crossings trigger alerts
+
+# Instrumentation
+ADMIN_USER_IDS: Set[int] = set()  # Telegram user ids allowed to use /stats
+METRICS_HOST = "127.0.0.1"  # Prometheus text format at http://METRICS_HOST:METRICS_PORT/metrics
+METRICS_PORT: Optional[int] = 9108  # None disables the endpoint
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)  # seconds
+
+# 'polling' runs one process. 'webhook' runs a front process that receives Telegram's webhook
+# calls and routes each chat to one of WEBHOOK_WORKERS processes. The workers share the
+# watchlist database, price history and a quote cache in SHARED_CACHE_FILE, so adding workers
+# does not multiply Alpha Vantage calls.
+RUN_MODE = 'polling'
+WEBHOOK_LISTEN = "0.0.0.0"
+WEBHOOK_PORT = 8443
+WEBHOOK_PATH = "/telegram"
+WEBHOOK_URL: Optional[str] = None  # public HTTPS URL of WEBHOOK_PATH, e.g. behind a TLS-terminating reverse proxy
+# Telegram sends it back in X-Telegram-Bot-Api-Secret-Token; when None, a random one is registered with WEBHOOK_URL
+WEBHOOK_SECRET: Optional[str] = None
+WEBHOOK_WORKERS = 4
+WEBHOOK_MAX_BODY = 1024 * 1024  # bytes; larger updates are refused with 413 before they are read
+WEBHOOK_MAX_HEADERS = 100
+WEBHOOK_READ_TIMEOUT = 30  # seconds to receive a request, or to wait for the next one on a kept-alive connection
+SHARED_CACHE_FILE = "quote_cache.db"
+SHARED_FETCH_POLL = 0.05  # seconds between checks while another worker fetches the same symbol
+# A fetch may queue for quota and be queued again after a rate-limit 'Note'
+SHARED_FETCH_LEASE = 2 * (QUOTA_MAX_WAIT + HTTP_TIMEOUT)  # seconds before another worker takes over a fetch
+
+
+def next_weekly_close(now: Optional[datetime] = None) -> datetime:
+    """When the next weekly bar closes (Friday 16:00 New York time)"""
+    now = now or datetime.now(MARKET_TIMEZONE)
+    days_ahead = (4 - now.weekday()) % 7
+    close = (now + timedelta(days=days_ahead)).replace(hour=16, minute=0, second=0, microsecond=0)
+    if close <= now:
+        close += timedelta(days=7)
+    return close
+
+
+def last_closed_week(now: Optional[datetime] = None) -> date:
+    """The Friday ending the most recent fully closed week"""
+    return (next_weekly_close(now) - timedelta(days=7)).date()
+
+
+def weekly_bar_open(now: Optional[datetime] = None) -> bool:
+    """Whether this week's bar is still forming (Monday 09:30 to Friday 16:00 New York time)"""
+    now = now or datetime.now(MARKET_TIMEZONE)
+    week_open = (now - timedelta(days=now.weekday())).replace(hour=9, minute=30, second=0, microsecond=0)
+    week_close = (week_open + timedelta(days=4)).replace(hour=16, minute=0)
+    return week_open <= now < week_close
+
+
+def latest_bar_date(now: Optional[datetime] = None) -> date:
+    """The Friday of the bar indicators refer to: this week's while it is forming, else the last closed one"""
+    now = now or datetime.now(MARKET_TIMEZONE)
+    return next_weekly_close(now).date() if weekly_bar_open(now) else last_closed_week(now)
+
+
+class Histogram:
+    """Latency distribution over fixed bucket bounds, in seconds"""
+
+    def __init__(self, buckets: tuple = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last slot is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds: float):
+        index = 0
+        while index < len(self.buckets) and seconds > self.buckets[index]:
+            index += 1
+        self.counts[index] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def quantile(self, q: float) -> float:
+        """Estimate, interpolated within the bucket holding the q-th observation"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                lower = self.buckets[index - 1] if index else 0.0
+                upper = self.buckets[index] if index < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+
+class Metrics:
+    """Process-wide counters, gauges and latency histograms, keyed by name and labels"""
+
+    def __init__(self):
+        self.counters: Dict[tuple, float] = {}
+        self.gauges: Dict[tuple, float] = {}
+        self.histograms: Dict[tuple, Histogram] = {}
+
+    @staticmethod
+    def _key(name: str, labels: Dict) -> tuple:
+        return name, tuple(sorted(labels.items()))
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = self._key(name, labels)
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def set_gauge(self, name: str, value: float, **labels):
+        self.gauges[self._key(name, labels)] = value
+
+    def add_gauge(self, name: str, value: float, **labels):
+        key = self._key(name, labels)
+        self.gauges[key] = self.gauges.get(key, 0) + value
+
+    def observe(self, name: str, seconds: float, **labels):
+        key = self._key(name, labels)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram()
+        histogram.observe(seconds)
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        """Time a block into the <name>_seconds histogram and count it in <name>_in_flight meanwhile"""
+        self.add_gauge(f"{name}_in_flight", 1, **labels)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(f"{name}_seconds", time.perf_counter() - start, **labels)
+            self.add_gauge(f"{name}_in_flight", -1, **labels)
+
+    @staticmethod
+    def _labels(labels: tuple, extra: str = "") -> str:
+        parts = [f'{key}="{value}"' for key, value in labels] + ([extra] if extra else [])
+        return "{" + ",".join(parts) + "}" if parts else ""
+
+    def render_prometheus(self) -> str:
+        """All metrics in the Prometheus text exposition format"""
+        lines = []
+        for kind, values in (('counter', self.counters), ('gauge', self.gauges)):
+            typed = set()
+            for (name, labels), value in sorted(list(values.items())):
+                if name not in typed:
+                    lines.append(f"# TYPE {name} {kind}")
+                    typed.add(name)
+                lines.append(f"{name}{self._labels(labels)} {value:g}")
+        typed = set()
+        for (name, labels), histogram in sorted(list(self.histograms.items()), key=lambda item: item[0]):
+            if name not in typed:
+                lines.append(f"# TYPE {name} histogram")
+                typed.add(name)
+            cumulative = 0
+            for bound, count in zip(histogram.buckets + ('+Inf',), histogram.counts):
+                cumulative += count
+                bucket_labels = self._labels(labels, 'le="%s"' % bound)
+                lines.append(f"{name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{name}_sum{self._labels(labels)} {histogram.sum:g}")
+            lines.append(f"{name}_count{self._labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> List[tuple]:
+        """(name with labels, count, p50, p95, p99 in ms) per histogram, busiest first"""
+        rows = []
+        for (name, labels), histogram in list(self.histograms.items()):
+            label = name.removesuffix('_seconds') + "".join(f" {value}" for _, value in labels)
+            rows.append((label, histogram.count,
+                         *(histogram.quantile(q) * 1000 for q in (0.5, 0.95, 0.99))))
+        return sorted(rows, key=lambda row: -row[1])
+
+
+metrics = Metrics()
+
+
+def _estimate_size(value) -> int:
+    """Rough in-memory size of a cached value in bytes"""
+    size = sys.getsizeof(value)
+    if isinstance(value, (list, tuple)):
+        size += sum(sys.getsizeof(item) for item in value)
+    elif isinstance(value, dict):
+        size += sum(sys.getsizeof(k) + sys.getsizeof(v) for k, v in value.items())
+    return size
+
+
+class QuoteCache:
+    """LRU cache for market data with a separate TTL per data kind"""
+
+    shared = False  # whether other processes see this cache
+
+    def __init__(self, ttls: Dict[str, Union[float, Callable[[], float]]],
+                 max_entries: int = CACHE_MAX_ENTRIES, max_bytes: int = CACHE_MAX_BYTES):
+        self.ttls = ttls
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # (kind, symbol) -> (value, expires_at, size)
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, kind: str, symbol: str):
+        """Return a fresh cached value or None"""
+        key = (kind, symbol)
+        entry = self._entries.get(key)
+        if entry is None or entry[1] <= time.monotonic():
+            if entry is not None:
+                self._drop(key)
+            self.misses += 1
+            metrics.inc('cache_misses_total', kind=kind)
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        metrics.inc('cache_hits_total', kind=kind)
+        return entry[0]
+
+    def set(self, kind: str, symbol: str, value, ttl: Optional[float] = None):
+        """Store a value using the TTL configured for its kind, unless one is given"""
+        if ttl is None:
+            ttl = self.ttls[kind]
+            if callable(ttl):
+                ttl = ttl()
+        key = (kind, symbol)
+        if key in self._entries:
+            self._drop(key)
+        size = _estimate_size(value)
+        self._entries[key] = (value, time.monotonic() + ttl, size)
+        self._bytes += size
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            self._drop(next(iter(self._entries)))
+            self.evictions += 1
+            metrics.inc('cache_evictions_total')
+
+    def _drop(self, key):
+        _, _, size = self._entries.pop(key)
+        self._bytes -= size
+
+    def items(self, kind: str) -> List[tuple]:
+        """(symbol, value) for every fresh entry of a kind, without touching LRU order or counters"""
+        now = time.monotonic()
+        return [(symbol, value) for (entry_kind, symbol), (value, expires_at, _) in list(self._entries.items())
+                if entry_kind == kind and expires_at > now]
+
+    def stats(self) -> Dict:
+        """Hit/miss counters and current usage"""
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'bytes': self._bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0
+        }
+
+    def lease(self, key: str, seconds: float) -> bool:
+        """Claim the right to fetch key; always granted within one process"""
+        return True
+
+    def release(self, key: str):
+        pass
+
+
+class SharedQuoteCache(QuoteCache):
+    """QuoteCache shared by worker processes through a SQLite table.
+
+    Each process keeps its own LRU in front. Misses fall through to the table
+    and every set() is written through, with expiry in wall-clock time. Fetch
+    leases let one process fetch a symbol while the others wait for its result.
+    """
+
+    shared = True
+    SHARED_KINDS = ('quote', 'snapshot', 'invalid')
+
+    def __init__(self, path: str, ttls: Dict[str, Union[float, Callable[[], float]]], **kwargs):
+        super().__init__(ttls, **kwargs)
+        self.owner = os.getpid()
+        self.conn = open_database(path)
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS quote_cache (
+                kind TEXT,
+                symbol TEXT,
+                value TEXT,
+                expires_at REAL,
+                PRIMARY KEY (kind, symbol)
+            )
+        ''')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS fetch_leases (
+                key TEXT PRIMARY KEY,
+                owner INTEGER,
+                expires_at REAL
+            )
+        ''')
+        self.conn.commit()
+
+    def get(self, kind: str, symbol: str):
+        """Return a fresh value from this process or, failing that, from the shared table"""
+        value = super().get(kind, symbol)
+        if value is not None or kind not in self.SHARED_KINDS:
+            return value
+        row = self.conn.execute(
+            "SELECT value, expires_at FROM quote_cache WHERE kind = ? AND symbol = ? AND expires_at > ?",
+            (kind, symbol, time.time())
+        ).fetchone()
+        if row is None:
+            return None
+        metrics.inc('shared_cache_hits_total', kind=kind)
+        value = self._decode(row[0])
+        super().set(kind, symbol, value, ttl=row[1] - time.time())
+        return value
+
+    @staticmethod
+    def _decode(text: str):
+        value = json.loads(text)
+        return tuple(value) if isinstance(value, list) else value  # Snapshots are (stock_data, fetched_at)
+
+    def items(self, kind: str) -> List[tuple]:
+        """(symbol, value) for every fresh entry of a kind, whichever process stored it"""
+        if kind not in self.SHARED_KINDS:
+            return super().items(kind)
+        try:
+            rows = self.conn.execute("SELECT symbol, value FROM quote_cache WHERE kind = ? AND expires_at > ?",
+                                     (kind, time.time())).fetchall()
+        except sqlite3.Error as e:
+            logger.error(f"Error reading shared cache entries {kind}: {e}")
+            return super().items(kind)
+        return [(symbol, self._decode(value)) for symbol, value in rows]
+
+    def set(self, kind: str, symbol: str, value, ttl: Optional[float] = None):
+        """Store a value here and in the shared table"""
+        super().set(kind, symbol, value, ttl)
+        entry = self._entries.get((kind, symbol))
+        if kind not in self.SHARED_KINDS or entry is None:
+            return
+        try:
+            with self.conn:
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO quote_cache (kind, symbol, value, expires_at) VALUES (?, ?, ?, ?)",
+                    (kind, symbol, json.dumps(value), time.time() + entry[1] - time.monotonic())
+                )
+        except sqlite3.Error as e:
+            logger.error(f"Error writing shared cache entry {kind} {symbol}: {e}")
+
+    def lease(self, key: str, seconds: float) -> bool:
+        """Claim the right to fetch key for up to seconds; False while another process holds it"""
+        now = time.time()
+        try:
+            with self.conn:
+                cursor = self.conn.execute('''
+                    INSERT INTO fetch_leases (key, owner, expires_at) VALUES (?, ?, ?)
+                    ON CONFLICT (key) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at
+                    WHERE fetch_leases.expires_at <= ? OR fetch_leases.owner = excluded.owner
+                ''', (key, self.owner, now + seconds, now))
+            return cursor.rowcount == 1
+        except sqlite3.Error as e:
+            logger.error(f"Error taking fetch lease {key}: {e}")
+            return True  # Fetching twice beats not fetching at all
+
+    def release(self, key: str):
+        """Give up a lease taken by this process"""
+        try:
+            with self.conn:
+                self.conn.execute("DELETE FROM fetch_leases WHERE key = ? AND owner = ?", (key, self.owner))
+        except sqlite3.Error as e:
+            logger.error(f"Error releasing fetch lease {key}: {e}")
+
+
+class MarketDataClient:
+    """Async Alpha Vantage client sharing one pool of keep-alive connections"""
+
+    def __init__(self, base_url: str = ALPHA_VANTAGE_URL, api_key: str = ALPHA_VANTAGE_API_KEY,
+                 timeout: float = HTTP_TIMEOUT, max_connections: int = HTTP_MAX_CONNECTIONS):
+        self.base_url = base_url
+        self.api_key = api_key
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self._client: Optional[httpx.AsyncClient] = None
+
+    def _get_client(self) -> httpx.AsyncClient:
+        # Created lazily so the pool binds to the event loop the bot actually runs on
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(self.timeout),
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections
+                )
+            )
+        return self._client
+
+    async def query(self, function: str, symbol: str, deadline: Optional[float] = None) -> Dict:
+        """Run one Alpha Vantage query and return the decoded JSON body.
+
+        The whole call, pool wait included, must finish within deadline seconds;
+        otherwise asyncio.TimeoutError is raised. Cancelling the caller aborts the
+        request and returns its connection to the pool.
+        """
+        params = {
+            'function': function,
+            'symbol': symbol,
+            'apikey': self.api_key
+        }
+        outcome = 'error'
+        try:
+            with metrics.timer('upstream_request', function=function):
+                response = await asyncio.wait_for(
+                    self._get_client().get(self.base_url, params=params),
+                    timeout=deadline or self.timeout
+                )
+            outcome = 'ok'
+            return response.json()
+        except asyncio.TimeoutError:
+            outcome = 'timeout'
+            raise
+        except asyncio.CancelledError:
+            outcome = 'cancelled'
+            raise
+        finally:
+            metrics.inc('upstream_requests_total', function=function, outcome=outcome)
+
+    async def aclose(self):
+        """Close pooled connections"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+class QuotaExceeded(Exception):
+    """Raised when a request would have to queue longer than allowed for API quota"""
+
+    def __init__(self, eta: float):
+        super().__init__(f"API quota exhausted, retry in {eta:.0f}s")
+        self.eta = eta
+
+
+class ProviderError(Exception):
+    """Raised when the quote provider answers with an error instead of data, e.g. a bad key or a rate limit notice"""
+
+
+def format_eta(seconds: float) -> str:
+    """Human readable wait time"""
+    if seconds < 90:
+        return f"{max(1, round(seconds))}s"
+    if seconds < 90 * 60:
+        return f"{round(seconds / 60)} min"
+    return f"{seconds / 3600:.1f} h"
+
+
+class TokenBucket:
+    """Token bucket refilled continuously at a fixed rate"""
+
+    def __init__(self, capacity: float, refill_per_second: float, clock: Callable[[], float] = time.monotonic):
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        self.clock = clock
+        self.tokens = capacity
+        self.updated = clock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.refill_per_second)
+        self.updated = now
+
+    def wait_time(self, tokens: float = 1) -> float:
+        """Seconds until the bucket holds the given number of tokens"""
+        self._refill()
+        return max(0.0, (tokens - self.tokens) / self.refill_per_second)
+
+    def take(self, tokens: float = 1):
+        self._refill()
+        self.tokens -= tokens
+
+    def drain(self):
+        """Empty the bucket, e.g. after the provider reports we are over quota"""
+        self._refill()
+        self.tokens = min(self.tokens, 0.0)
+
+
+class QuotaScheduler:
+    """Process-wide API quota shared by all callers and granted in priority order.
+
+    Requests get a token from both the per-minute and the per-day bucket. When
+    none is available they queue, lower priority values first and FIFO within a
+    priority, and a single dispatcher hands out tokens as the buckets refill.
+    The clock and sleep functions can be swapped for a simulated clock.
+    """
+
+    def __init__(self, per_minute: int = API_CALLS_PER_MINUTE, per_day: int = API_CALLS_PER_DAY,
+                 clock: Callable[[], float] = time.monotonic, sleep: Callable = asyncio.sleep):
+        self.buckets = [
+            TokenBucket(per_minute, per_minute / 60, clock),
+            TokenBucket(per_day, per_day / 86400, clock)
+        ]
+        self.sleep = sleep
+        self._queue = []  # heap of (priority, seq, future)
+        self._seq = itertools.count()
+        self._dispatcher: Optional[asyncio.Task] = None
+        self.granted = 0
+        self.queued = 0
+        self.rejected = 0
+        self.throttled_count = 0
+
+    def _waiting(self, priority: int) -> int:
+        return sum(1 for p, _, future in self._queue if p <= priority and not future.done())
+
+    def eta(self, priority: int = PRIORITY_BULK) -> float:
+        """Estimated seconds until a new request at this priority would be granted"""
+        needed = self._waiting(priority) + 1
+        return max(bucket.wait_time(needed) for bucket in self.buckets)
+
+    async def acquire(self, priority: int = PRIORITY_BULK, max_wait: Optional[float] = None):
+        """Wait for one API call's worth of quota.
+
+        Raises QuotaExceeded with the expected wait if it is longer than max_wait.
+        """
+        eta = self.eta(priority)
+        if max_wait is not None and eta > max_wait:
+            self.rejected += 1
+            metrics.inc('quota_rejected_total', priority=priority)
+            raise QuotaExceeded(eta)
+        if eta == 0 and not self._queue:
+            self._grant()
+            metrics.observe('quota_wait_seconds', 0.0, priority=priority)
+            return
+        self.queued += 1
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._queue, (priority, next(self._seq), future))
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.ensure_future(self._dispatch())
+        start = time.perf_counter()
+        await future
+        metrics.observe('quota_wait_seconds', time.perf_counter() - start, priority=priority)
+
+    def _grant(self):
+        for bucket in self.buckets:
+            bucket.take()
+        self.granted += 1
+
+    async def _dispatch(self):
+        while self._queue:
+            if self._queue[0][2].done():  # Waiter was cancelled
+                heapq.heappop(self._queue)
+                continue
+            wait = max(bucket.wait_time() for bucket in self.buckets)
+            if wait > 0:
+                await self.sleep(wait)
+                continue
+            _, _, future = heapq.heappop(self._queue)
+            self._grant()
+            future.set_result(None)
+
+    def throttled(self):
+        """Record that the provider rejected a call for rate limiting"""
+        self.throttled_count += 1
+        metrics.inc('quota_throttled_total')
+        self.buckets[0].drain()
+
+    def stats(self) -> Dict:
+        """Grant/queue counters and the current wait at each priority"""
+        return {
+            'granted': self.granted,
+            'queued': self.queued,
+            'rejected': self.rejected,
+            'throttled': self.throttled_count,
+            'waiting': len(self._queue),
+            'eta_interactive': round(self.eta(PRIORITY_INTERACTIVE), 1),
+            'eta_bulk': round(self.eta(PRIORITY_BULK), 1)
+        }
+
+
+class SingleFlight:
+    """Coalesces concurrent calls for the same key into one in-flight task"""
 
-class StockWatcherBot:
     def __init__(self):
-        self.watchlists = self.load_watchlists()
+        self._inflight: Dict = {}
+        self._waiters: Dict = {}
+        self.calls = 0
+        self.saved = 0
+
+    async def do(self, key, factory: Callable):
+        """Await factory() unless a call for key is already running, then share its result"""
+        task = self._inflight.get(key)
+        if task is None:
+            self.calls += 1
+            task = self._start(key, factory())
+        else:
+            self.saved += 1
+            metrics.inc('singleflight_coalesced_total')
+            logger.debug(f"Coalesced {key} onto in-flight fetch")
+        return await self._wait(task)
+
+    async def do_many(self, keys: List, factory: Callable) -> Dict:
+        """Like do() for several keys: keys already in flight are joined and the rest
+        are loaded together by one factory(missing_keys) call returning {key: value}"""
+        keys = list(dict.fromkeys(keys))
+        missing = [key for key in keys if key not in self._inflight]
+        self.saved += len(keys) - len(missing)
+        metrics.inc('singleflight_coalesced_total', len(keys) - len(missing))
+        if missing:
+            self.calls += 1
+            batch = asyncio.ensure_future(factory(missing))
+            batch.add_done_callback(lambda done: done.cancelled() or done.exception())
+            for key in missing:
+                self._start(key, self._pick(batch, key))
+        tasks = [self._inflight[key] for key in keys]
+        results = await asyncio.gather(*(self._wait(task) for task in tasks))
+        return dict(zip(keys, results))
+
+    @staticmethod
+    async def _pick(batch: asyncio.Future, key):
+        return (await asyncio.shield(batch)).get(key)
+
+    def _start(self, key, coro) -> asyncio.Task:
+        task = asyncio.ensure_future(coro)
+        self._inflight[key] = task
+        self._waiters[task] = 0
+        task.add_done_callback(lambda done: self._finish(key, done))
+        return task
+
+    async def _wait(self, task: asyncio.Task):
+        self._waiters[task] += 1
+        try:
+            # Shield so one waiter being cancelled does not cancel the fetch for the others
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if not task.done() and self._waiters[task] == 1:
+                task.cancel()  # Nobody is left waiting for this result
+            raise
+        finally:
+            if task in self._waiters:
+                self._waiters[task] -= 1
+
+    def _finish(self, key, task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        self._waiters.pop(task, None)
+        if not task.cancelled():
+            task.exception()  # Mark as retrieved even if every waiter went away
+
+    def stats(self) -> Dict:
+        """Upstream calls made vs. calls saved by coalescing"""
+        return {
+            'calls': self.calls,
+            'saved': self.saved,
+            'in_flight': len(self._inflight)
+        }
+
+
+class QuoteProvider:
+    """Source of current prices.
+
+    Batched providers fetch a whole list of symbols in one upstream request;
+    the default get_quotes simply fetches each symbol in parallel.
+    """
+
+    batched = False
+
+    async def get_quote(self, symbol: str, priority: int = PRIORITY_BULK) -> Optional[float]:
+        """Current price for one symbol, or None if the symbol is unknown"""
+        raise NotImplementedError
+
+    async def get_quotes(self, symbols: List[str], priority: int = PRIORITY_BULK) -> Dict[str, float]:
+        """Current prices for several symbols; unknown symbols are left out"""
+        prices = await asyncio.gather(*(self.get_quote(symbol, priority) for symbol in symbols))
+        return {symbol: price for symbol, price in zip(symbols, prices) if price is not None}
+
+
+class AlphaVantageProvider(QuoteProvider):
+    """Quotes from Alpha Vantage, spending the shared API quota.
+
+    GLOBAL_QUOTE covers one symbol per call. With bulk enabled (premium keys
+    only) get_quotes uses REALTIME_BULK_QUOTES for up to BULK_QUOTE_SIZE
+    symbols per call.
+    """
+
+    def __init__(self, client: MarketDataClient, quota: QuotaScheduler, bulk: bool = ALPHA_VANTAGE_BULK_QUOTES):
+        self.client = client
+        self.quota = quota
+        self.batched = bulk
+
+    async def query(self, function: str, symbol: str, priority: int = PRIORITY_BULK) -> Dict:
+        """Run an Alpha Vantage query within the shared quota.
+
+        A rate limit 'Note' from the provider drains the per-minute bucket and the
+        request is queued again once, rather than losing its data.
+        """
+        for attempt in range(2):
+            await self.quota.acquire(priority, max_wait=QUOTA_MAX_WAIT)
+            data = await self.client.query(function, symbol)
+            if 'Note' not in data:
+                return data
+            logger.warning(f"Alpha Vantage API rate limit for {symbol}: {data['Note']}")
+            self.quota.throttled()
+        raise QuotaExceeded(self.quota.eta(priority))
+
+    async def get_quote(self, symbol: str, priority: int = PRIORITY_BULK) -> Optional[float]:
+        quote_data = await self.query('GLOBAL_QUOTE', symbol, priority)
+        
+        # Check for API errors
+        if 'Error Message' in quote_data:
+            raise ProviderError(f"Alpha Vantage API error for {symbol}: {quote_data['Error Message']}")
+        
+        if 'Global Quote' not in quote_data:
+            # e.g. {'Information': ...} for a bad API key or the daily rate limit
+            raise ProviderError(f"Unexpected response format for {symbol}: {quote_data}")
+        
+        if not quote_data['Global Quote']:
+            return None  # Alpha Vantage's answer for an unknown ticker
+        return float(quote_data['Global Quote']['05. price'])
+
+    async def get_quotes(self, symbols: List[str], priority: int = PRIORITY_BULK) -> Dict[str, float]:
+        if not self.batched:
+            return await super().get_quotes(symbols, priority)
+        prices = {}
+        for i in range(0, len(symbols), BULK_QUOTE_SIZE):
+            chunk = symbols[i:i + BULK_QUOTE_SIZE]
+            data = await self.query('REALTIME_BULK_QUOTES', ','.join(chunk), priority)
+            if 'data' not in data:
+                logger.error(f"Unexpected bulk quote response for {len(chunk)} symbols: {data}")
+                continue
+            for item in data['data']:
+                prices[item['symbol'].upper()] = float(item['close'])
+        return prices
+
+
+class YFinanceProvider(QuoteProvider):
+    """Quotes from Yahoo Finance; one download covers the whole symbol list and uses no Alpha Vantage quota"""
+
+    batched = True
+
+    async def get_quote(self, symbol: str, priority: int = PRIORITY_BULK) -> Optional[float]:
+        return (await self.get_quotes([symbol], priority)).get(symbol)
+
+    async def get_quotes(self, symbols: List[str], priority: int = PRIORITY_BULK) -> Dict[str, float]:
+        return await asyncio.to_thread(self._download, symbols)
+
+    @staticmethod
+    def _download(symbols: List[str]) -> Dict[str, float]:
+        data = yf.download(symbols, period='5d', interval='1d', progress=False, threads=False)
+        closes = data['Close']
+        if isinstance(closes, pd.Series):  # Single ticker downloads are not column-indexed by symbol
+            closes = closes.to_frame(symbols[0])
+        prices = {}
+        for symbol in symbols:
+            if symbol in closes:
+                series = closes[symbol].dropna()
+                if not series.empty:
+                    prices[symbol] = float(series.iloc[-1])
+        return prices
+
+
+def price_matrix(series: Dict[str, 'np.ndarray'], forming: Optional[Dict[str, float]] = None) -> 'pd.DataFrame':
+    """Weeks x symbols matrix of closes, oldest first, with every series aligned on its latest bar
     
-    def load_watchlists(self) -> Dict:
+    forming, if given, adds a last row with each symbol's price for the week
+    that has not closed yet. Each series is copied once, straight into the matrix.
+    """
+    extra = 0 if forming is None else 1
+    depth = max((len(values) for values in series.values()), default=0) + extra
+    matrix = np.full((depth, len(series)), np.nan)
+    for column, (symbol, values) in enumerate(series.items()):
+        if len(values):
+            matrix[depth - extra - len(values):depth - extra, column] = values
+        if forming is not None:
+            matrix[-1, column] = forming[symbol]
+    return pd.DataFrame(matrix, columns=list(series))
+
+
+class IndicatorEngine:
+    """Vectorized moving-average indicators over a weeks x symbols price matrix.
+
+    For every window it computes the average on the latest bar, the percent
+    distance of the current price from it, and a crossover flag: +1 if the
+    latest bar crossed above the average, -1 if it crossed below, 0 otherwise.
+    Symbols without enough history get NaN.
+    """
+
+    def __init__(self, sma_windows: List[int] = SMA_WINDOWS, ema_windows: List[int] = EMA_WINDOWS):
+        self.sma_windows = sorted(set(sma_windows) | {MA_WEEKS})
+        self.ema_windows = sorted(set(ema_windows))
+
+    def compute(self, matrix: 'pd.DataFrame', prices: Optional['pd.Series'] = None) -> 'pd.DataFrame':
+        """One row per symbol; prices are the current prices (default: the latest bar)"""
+        values = matrix.to_numpy(dtype=float)
+        weeks = len(values)
+        empty = np.full(values.shape[1], np.nan)
+        latest = values[-1] if weeks else empty
+        previous = values[-2] if weeks > 1 else empty
+        current = prices.reindex(matrix.columns).to_numpy(dtype=float) if prices is not None else latest
+        columns = {'price': current}
+        
+        for window in self.sma_windows:
+            last = values[-window:].mean(axis=0) if weeks >= window else empty
+            prior = values[-window - 1:-1].mean(axis=0) if weeks > window else empty
+            self._add(columns, f"sma_{window}", last, prior, latest, previous, current)
+        
+        observed = (~np.isnan(values)).sum(axis=0)
+        for window in self.ema_windows:
+            last, prior = self._ema(values, window)
+            self._add(columns, f"ema_{window}",
+                      np.where(observed >= window, last, np.nan),
+                      np.where(observed > window, prior, np.nan),
+                      latest, previous, current)
+        
+        return pd.DataFrame(columns, index=matrix.columns)
+
+    @staticmethod
+    def _ema(values: 'np.ndarray', window: int) -> tuple:
+        """EMA of every column on the last two bars, seeded with each column's first close.
+
+        The loop runs over weeks only; each step updates all symbols at once.
+        """
+        alpha = 2 / (window + 1)
+        ema = np.full(values.shape[1], np.nan)
+        prior = ema
+        for row in values:
+            prior = ema
+            ema = np.where(np.isnan(ema), row, alpha * row + (1 - alpha) * ema)
+        return ema, prior
+
+    @staticmethod
+    def _add(columns: Dict, name: str, last, prior, latest, previous, current):
+        with np.errstate(invalid='ignore', divide='ignore'):
+            columns[name] = last
+            columns[f"pct_{name}"] = (current - last) / last * 100
+            crossed = (latest > last).astype(int) - (previous > prior).astype(int)
+        columns[f"cross_{name}"] = np.where(np.isnan(prior) | np.isnan(last), 0, crossed)
+
+
+class WeeklyHistory:
+    """Closed weekly OHLC bars for one symbol, oldest first, one column per field
+
+    Columns are memoryviews of compact arrays, so slicing them never copies.
+    A history does not change once built; appending bars produces a new one.
+    """
+
+    FIELDS = ('opens', 'highs', 'lows', 'closes')
+
+    def __init__(self, dates: Optional[memoryview] = None, **columns: memoryview):
+        self.dates = dates if dates is not None else memoryview(array('i'))  # date.toordinal() of each bar
+        for field in self.FIELDS:
+            setattr(self, field, columns.get(field, memoryview(array('d'))))
+
+    def __len__(self) -> int:
+        return len(self.dates)
+
+    def tail(self, weeks: int) -> memoryview:
+        """The latest closes, oldest first"""
+        return self.closes[-weeks:]
+
+    def index(self, day: date) -> int:
+        """Position of the first bar on or after day"""
+        return bisect.bisect_left(self.dates, day.toordinal())
+
+    def between(self, first: date, last: date) -> 'WeeklyHistory':
+        """The bars from first to last inclusive, sharing this history's memory"""
+        start, stop = self.index(first), self.index(last + timedelta(days=1))
+        return WeeklyHistory(self.dates[start:stop],
+                             **{field: getattr(self, field)[start:stop] for field in self.FIELDS})
+
+    def is_current(self, last_closed: date) -> bool:
+        """Whether the latest stored bar belongs to the most recently closed week"""
+        return bool(self.dates) and \
+            date.fromordinal(self.dates[-1]).isocalendar()[:2] == last_closed.isocalendar()[:2]
+
+
+def ma_crossings(history: WeeklyHistory, window: int = MA_WEEKS) -> List[tuple]:
+    """(date, +1 or -1) for every week the close crossed above or below its window-week SMA, oldest first
+
+    Uses the same rule as the engine's crossover flag, over the whole stored
+    history and without any API call.
+    """
+    closes = np.frombuffer(history.closes, dtype=float)  # no copy of the stored column
+    if len(closes) <= window:
+        return []
+    sums = np.concatenate(([0.0], np.cumsum(closes)))
+    sma = (sums[window:] - sums[:-window]) / window  # sma[i] covers closes[i:i + window]
+    above = closes[window - 1:] > sma
+    flips = np.flatnonzero(above[1:] != above[:-1]) + 1
+    return [(date.fromordinal(history.dates[i + window - 1]), 1 if above[i] else -1) for i in flips]
+
+
+def read_column(path: str, typecode: str) -> memoryview:
+    """A column file read into an array; a torn trailing record is left out"""
+    # A week of history is a few bytes per column, so reading beats memory-mapping: a map
+    # holds its own file descriptor for as long as it lives, one per column and symbol
+    column = array(typecode)
+    with open(path, 'rb') as f:
+        data = f.read()
+    column.frombytes(data[:len(data) // column.itemsize * column.itemsize])
+    return memoryview(column)
+
+
+class HistoryStore:
+    """Weekly OHLC history per symbol, persisted as append-only binary columns.
+
+    Each symbol has a <SYMBOL>.dates file of int32 day ordinals, the date
+    index, and <SYMBOL>.opens/.highs/.lows/.closes files of float64 values,
+    one record per week in every file. Without a directory the store is
+    memory only.
+    """
+
+    SYMBOL_PATTERN = re.compile(r'[A-Z0-9.\-^=]{1,20}')
+
+    def __init__(self, directory: Optional[str] = HISTORY_DIR):
+        self.directory = directory
+        self._series: Dict[str, WeeklyHistory] = {}
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def _paths(self, symbol: str) -> Optional[Dict[str, str]]:
+        # Symbols come from user input, so only safe names ever become file names
+        if not self.directory or not self.SYMBOL_PATTERN.fullmatch(symbol):
+            return None
+        base = os.path.join(self.directory, symbol)
+        return {field: f"{base}.{field}" for field in ('dates',) + WeeklyHistory.FIELDS}
+
+    def get(self, symbol: str) -> WeeklyHistory:
+        """History for symbol, loaded from disk on first use"""
+        history = self._series.get(symbol)
+        if history is None:
+            history = self._series[symbol] = self._load(symbol)
+        return history
+
+    @contextmanager
+    def _locked(self, paths: Dict[str, str]):
+        """Hold an exclusive lock on a symbol's files while they are repaired or appended to
+        
+        Worker processes share the history directory; the lock keeps two of
+        them from appending the same weeks or cutting back a half-written batch.
+        """
+        with open(paths['dates'], 'ab') as f:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            yield  # Closing the file releases the lock
+
+    def _load(self, symbol: str) -> WeeklyHistory:
+        paths = self._paths(symbol)
+        if not paths or not os.path.exists(paths['dates']):
+            return WeeklyHistory()
+        try:
+            with self._locked(paths):
+                if not self._repair(paths):
+                    return WeeklyHistory()
+                dates = read_column(paths['dates'], 'i')
+                columns = {field: read_column(paths[field], 'd') for field in WeeklyHistory.FIELDS}
+            if len(dates) > 1 and (np.diff(np.frombuffer(dates, dtype=np.int32)) <= 0).any():
+                # Files appended to without the lock can repeat weeks; keep the first copy of each, in memory
+                kept = []
+                for i, day in enumerate(dates):
+                    if not kept or day > dates[kept[-1]]:
+                        kept.append(i)
+                dates = memoryview(array('i', (dates[i] for i in kept)))
+                columns = {field: memoryview(array('d', (column[i] for i in kept)))
+                           for field, column in columns.items()}
+            return WeeklyHistory(dates, **columns)
+        except Exception as e:
+            logger.error(f"Error loading price history for {symbol}: {e}")
+            return WeeklyHistory()
+
+    @staticmethod
+    def _repair(paths: Dict[str, str]) -> int:
+        """Bring every column file to the same number of records before reading them; returns that number
+        
+        A crash between the appends of one batch can leave some files longer,
+        even with no dates at all; they are cut back. Files from before
+        opens/highs/lows were stored are padded with NaN, so the next append
+        lines up.
+        """
+        sizes = {}
+        for field, path in paths.items():
+            try:
+                sizes[field] = os.stat(path).st_size
+            except FileNotFoundError:
+                sizes[field] = 0
+        count = min(sizes['dates'] // 4, sizes['closes'] // 8)
+        for field, path in paths.items():
+            expected = count * (4 if field == 'dates' else 8)
+            if sizes[field] > expected:
+                os.truncate(path, expected)
+            elif sizes[field] < expected:
+                with open(path, 'ab') as f:
+                    f.truncate(sizes[field] // 8 * 8)
+                    array('d', [float('nan')] * (count - sizes[field] // 8)).tofile(f)
+        return count
+
+    def reload(self, symbol: str) -> WeeklyHistory:
+        """Re-read a symbol's history from disk, picking up bars another process appended"""
+        self._series.pop(symbol, None)
+        return self.get(symbol)
+
+    def append(self, symbol: str, bars: List[tuple]) -> WeeklyHistory:
+        """Append (day ordinal, open, high, low, close) bars newer than the stored ones, oldest first
+        
+        Returns the symbol's new history; histories handed out earlier keep
+        showing the bars they had.
+        """
+        history = self.get(symbol)
+        if not bars:
+            return history
+        paths = self._paths(symbol)
+        if paths is not None:
+            try:
+                with self._locked(paths):
+                    # Another process may have stored some of these weeks since this one loaded the history
+                    count = self._repair(paths)
+                    newest = read_column(paths['dates'], 'i')[-1] if count else 0
+                    new_dates, new_columns = self._columns([bar for bar in bars if bar[0] > newest])
+                    # Values first and the date index last, so a crash leaves no date without its values
+                    for field, values in new_columns.items():
+                        with open(paths[field], 'ab') as f:
+                            values.tofile(f)
+                    with open(paths['dates'], 'ab') as f:
+                        new_dates.tofile(f)
+                return self.reload(symbol)
+            except Exception as e:
+                logger.error(f"Error saving price history for {symbol}: {e}")
+        new_dates, new_columns = self._columns(bars)
+        history = WeeklyHistory(
+            memoryview(array('i', history.dates) + new_dates),
+            **{field: memoryview(array('d', getattr(history, field)) + values) for field, values in new_columns.items()}
+        )
+        self._series[symbol] = history
+        return history
+
+    @staticmethod
+    def _columns(bars: List[tuple]) -> tuple:
+        """(dates, {field: values}) arrays of (day ordinal, open, high, low, close) bars"""
+        return array('i', [bar[0] for bar in bars]), \
+            {field: array('d', [bar[i] for bar in bars]) for i, field in enumerate(WeeklyHistory.FIELDS, 1)}
+
+
+class SymbolDirectory:
+    """Known ticker symbols and their company names, for validation without API calls"""
+
+    def __init__(self, path: Optional[str] = SYMBOL_LISTING_FILE):
+        self._names: Dict[str, str] = {}
+        if path and os.path.exists(path):
+            self.load(path)
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def __contains__(self, symbol: str) -> bool:
+        return symbol in self._names
+
+    def load(self, path: str) -> int:
+        """Read a listing CSV with symbol and name columns; delisted rows are skipped"""
+        loaded = 0
+        try:
+            with open(path, newline='') as f:
+                for row in csv.DictReader(f):
+                    row = {key.strip().lower(): (value or '').strip() for key, value in row.items() if key}
+                    symbol = row.get('symbol', '').upper()
+                    if not symbol or row.get('status', 'Active').lower() == 'delisted':
+                        continue
+                    self._names[symbol] = row.get('name') or symbol
+                    loaded += 1
+            logger.info(f"Loaded {loaded} symbols from {path}")
+        except Exception as e:
+            logger.error(f"Error loading symbol listing {path}: {e}")
+        return loaded
+
+    def name(self, symbol: str) -> Optional[str]:
+        """Company name of a known symbol, or None if the symbol is not known"""
+        return self._names.get(symbol)
+
+    def add(self, symbol: str, name: Optional[str] = None):
+        """Remember a symbol the provider confirmed"""
+        self._names.setdefault(symbol, name or symbol)
+
+
+class WatchlistIndex:
+    """User watchlists with set-based membership and a symbol -> subscribers reverse index.
+
+    Each watchlist is an insertion-ordered dict used as a set, so membership,
+    adds and removes are O(1) and /list keeps the order stocks were added in.
+
+    Safe to share between the event loop and the persistence thread: writers
+    take a lock so both indexes change together, while readers never lock and
+    get a snapshot copied in a single step (list(), set() and dict.copy() of a
+    built-in container run without releasing the GIL).
+    """
+
+    def __init__(self, watchlists: Optional[Dict[str, List[str]]] = None):
+        self._users: Dict[str, Dict[str, None]] = {}
+        self._subscribers: Dict[str, Set[str]] = {}
+        self._write_lock = threading.Lock()
+        for user_id, symbols in (watchlists or {}).items():
+            self._users.setdefault(str(user_id), {})
+            for symbol in symbols:
+                self.add(user_id, symbol)
+
+    def __len__(self) -> int:
+        return len(self._users)
+
+    def __contains__(self, user_id) -> bool:
+        return str(user_id) in self._users
+
+    def contains(self, user_id, symbol: str) -> bool:
+        """Whether a symbol is on a user's watchlist"""
+        return symbol in self._users.get(str(user_id), ())
+
+    def get(self, user_id) -> List[str]:
+        """Symbols on a user's watchlist, in the order they were added"""
+        return list(self._users.get(str(user_id), ()))
+
+    def add(self, user_id, symbol: str) -> bool:
+        """Add a symbol; False if it was already there"""
+        with self._write_lock:
+            watchlist = self._users.setdefault(str(user_id), {})
+            if symbol in watchlist:
+                return False
+            watchlist[symbol] = None
+            self._subscribers.setdefault(symbol, set()).add(str(user_id))
+            return True
+
+    def remove(self, user_id, symbol: str) -> bool:
+        """Remove a symbol; False if it was not there"""
+        with self._write_lock:
+            watchlist = self._users.get(str(user_id))
+            if watchlist is None or symbol not in watchlist:
+                return False
+            del watchlist[symbol]
+            subscribers = self._subscribers[symbol]
+            subscribers.discard(str(user_id))
+            if not subscribers:
+                del self._subscribers[symbol]
+            return True
+
+    def subscribers(self, symbol: str) -> Set[str]:
+        """Snapshot of the users watching a symbol"""
+        return set(self._subscribers.get(symbol, ()))
+
+    def symbols(self) -> List[str]:
+        """Snapshot of the distinct watched symbols"""
+        return list(self._subscribers)
+
+    def to_dict(self) -> Dict[str, List[str]]:
+        """Plain {user_id: [symbols]} form, as stored in WATCHLIST_FILE"""
+        return {user_id: list(watchlist) for user_id, watchlist in self._users.copy().items()}
+
+
+def open_database(path: str) -> sqlite3.Connection:
+    """SQLite connection in WAL mode: readers never wait for the writer and a crash cannot tear a write"""
+    # Saves run on the persistence thread; each connection is still used by one thread at a time
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+class JsonWatchlistStorage:
+    """Watchlists in a single JSON file, rewritten in full on every save"""
+
+    def __init__(self, path: str = WATCHLIST_FILE):
+        self.path = path
+
+    def load(self) -> Dict[str, List[str]]:
         """Load user watchlists from file"""
         try:
-            if os.path.exists(WATCHLIST_FILE):
-                with open(WATCHLIST_FILE, 'r') as f:
+            if os.path.exists(self.path):
+                with open(self.path, 'r') as f:
                     return json.load(f)
         except Exception as e:
             logger.error(f"Error loading watchlists: {e}")
         return {}
-    
-    def save_watchlists(self):
-        """Save user watchlists to file"""
+
+    def save(self, watchlists: WatchlistIndex, changes: List[tuple]):
+        """Save user watchlists to file.
+
+        The data goes to a temporary file that then atomically replaces the old
+        one, so a crash mid-write leaves the previous version intact.
+        """
+        tmp_path = self.path + '.tmp'
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(watchlists.to_dict(), f, indent=2)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            logger.error(f"Error saving watchlists: {e}")
+
+
+class SqliteWatchlistStorage:
+    """Watchlists as rows of the watchlist table; a save writes only the changed rows.
+
+    The statements are fixed strings, so sqlite3 compiles each once and reuses
+    it from the connection's statement cache.
+    """
+
+    INSERT = "INSERT OR IGNORE INTO watchlist (user_id, symbol, added_date) VALUES (?, ?, ?)"
+    DELETE = "DELETE FROM watchlist WHERE user_id = ? AND symbol = ?"
+
+    def __init__(self, path: str = DATABASE_FILE):
+        self.conn = open_database(path)
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS watchlist (
+                user_id INTEGER,
+                symbol TEXT,
+                added_date TEXT,
+                PRIMARY KEY (user_id, symbol)
+            )
+        ''')
+        self.conn.commit()
+
+    def is_empty(self) -> bool:
+        return self.conn.execute("SELECT 1 FROM watchlist LIMIT 1").fetchone() is None
+
+    def load(self) -> Dict[str, List[str]]:
+        """Load user watchlists, oldest additions first"""
+        watchlists = {}
+        try:
+            for user_id, symbol in self.conn.execute(
+                    "SELECT user_id, symbol FROM watchlist ORDER BY added_date, rowid"):
+                watchlists.setdefault(str(user_id), []).append(symbol)
+        except Exception as e:
+            logger.error(f"Error loading watchlists: {e}")
+        return watchlists
+
+    def save(self, watchlists: WatchlistIndex, changes: List[tuple]):
+        """Apply ('add' | 'remove', user_id, symbol) changes in one transaction"""
+        now = datetime.now().isoformat()
         try:
-            with open(WATCHLIST_FILE, 'w') as f:
-                json.dump(self.watchlists, f, indent=2)
+            with self.conn:
+                for action, user_id, symbol in changes:
+                    if action == 'add':
+                        self.conn.execute(self.INSERT, (int(user_id), symbol, now))
+                    else:
+                        self.conn.execute(self.DELETE, (int(user_id), symbol))
         except Exception as e:
             logger.error(f"Error saving watchlists: {e}")
+
+
+class WriteBehind:
+    """Collects watchlist changes in memory and persists them in batches.
+
+    The first pending change starts a PERSIST_DEBOUNCE timer; everything that
+    arrives before it fires is written in one save, or as soon as max_pending
+    changes are waiting. Saves run on a single background thread so the event
+    loop never waits on disk I/O.
+
+    Only the touched (user_id, symbol) pairs are remembered; a flush writes
+    whatever the index holds for them at that moment. Repeated changes to the
+    same pair collapse into one row write, and changes racing a flush are
+    simply written again by the next one, so storage always converges on the
+    in-memory state. Pending changes are flushed at interpreter exit as a last
+    resort.
+    """
+
+    def __init__(self, storage, watchlists: WatchlistIndex,
+                 debounce: float = PERSIST_DEBOUNCE, max_pending: int = PERSIST_MAX_PENDING):
+        self.storage = storage
+        self.watchlists = watchlists
+        self.debounce = debounce
+        self.max_pending = max_pending
+        self._pending: Set[tuple] = set()  # (user_id, symbol)
+        self._lock = threading.Lock()  # guards _pending, _queued and the counters
+        self._flush_lock = threading.Lock()  # one save at a time
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='watchlist-persist')
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._queued = False  # a background flush is waiting to run
+        self.recorded = 0
+        self.written = 0
+        self.flushes = 0
+        self.flush_seconds_total = 0.0
+        self.flush_seconds_max = 0.0
+        self.flush_seconds_last = 0.0
+        atexit.register(self.flush)
+
+    def record(self, changes: List[tuple]):
+        """Mark ('add' | 'remove', user_id, symbol) changes for the next flush"""
+        with self._lock:
+            for _, user_id, symbol in changes:
+                self._pending.add((str(user_id), symbol))
+            self.recorded += len(changes)
+            due = len(self._pending) >= self.max_pending
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.flush()
+            return
+        if due:
+            if self._timer is not None:
+                self._timer.cancel()
+            self._flush_in_background(loop)
+        elif self._timer is None:
+            self._timer = loop.call_later(self.debounce, self._flush_in_background, loop)
+
+    def _flush_in_background(self, loop: asyncio.AbstractEventLoop):
+        self._timer = None
+        with self._lock:
+            if self._queued:
+                return
+            self._queued = True
+        loop.run_in_executor(self._executor, self.flush)
+
+    def flush(self):
+        """Write all pending changes now"""
+        with self._flush_lock:
+            with self._lock:
+                self._queued = False
+                if not self._pending:
+                    return
+                pending, self._pending = self._pending, set()
+            changes = [('add' if self.watchlists.contains(user_id, symbol) else 'remove', user_id, symbol)
+                       for user_id, symbol in pending]
+            start = time.perf_counter()
+            self.storage.save(self.watchlists, changes)
+            elapsed = time.perf_counter() - start
+            metrics.observe('persistence_flush_seconds', elapsed)
+            metrics.inc('persistence_changes_written_total', len(changes))
+            with self._lock:
+                self.flushes += 1
+                self.written += len(changes)
+                self.flush_seconds_total += elapsed
+                self.flush_seconds_last = elapsed
+                self.flush_seconds_max = max(self.flush_seconds_max, elapsed)
+
+    async def aclose(self):
+        """Cancel the debounce timer and wait for a final flush on the persistence thread"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        await asyncio.get_running_loop().run_in_executor(self._executor, self.flush)
+        self._executor.shutdown()
+
+    def stats(self) -> Dict:
+        """Flush latency and how many writes batching saved"""
+        with self._lock:
+            return {
+                'pending': len(self._pending),
+                'changes_recorded': self.recorded,
+                'changes_written': self.written,
+                'flushes': self.flushes,
+                'coalesced_writes': self.recorded - self.flushes - len(self._pending),
+                'flush_ms_last': round(self.flush_seconds_last * 1000, 2),
+                'flush_ms_avg': round(self.flush_seconds_total / self.flushes * 1000, 2) if self.flushes else 0.0,
+                'flush_ms_max': round(self.flush_seconds_max * 1000, 2)
+            }
+
+
+def migrate_watchlists(json_file: str, storage: SqliteWatchlistStorage) -> int:
+    """One-shot import of a JSON watchlist file into the SQLite store.
+
+    The file is renamed to <file>.migrated afterwards so it is never imported twice.
+    """
+    watchlists = JsonWatchlistStorage(json_file).load()
+    now = datetime.now().isoformat()
+    rows = [(int(user_id), symbol.upper(), now) for user_id, symbols in watchlists.items() for symbol in symbols]
+    with storage.conn:
+        storage.conn.executemany(storage.INSERT, rows)
+    try:
+        os.replace(json_file, json_file + '.migrated')
+    except FileNotFoundError:
+        return 0  # Another process imported it first; INSERT OR IGNORE made this import a no-op
+    logger.info(f"Migrated {len(rows)} watchlist entries for {len(watchlists)} users from {json_file}")
+    return len(rows)
+
+
+class AlertStore:
+    """Record of sent crossover alerts in the alerts table, used to deduplicate notifications"""
+
+    def __init__(self, path: str = DATABASE_FILE):
+        self.conn = open_database(path)
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS alerts (
+                user_id INTEGER,
+                symbol TEXT,
+                alert_date TEXT,
+                price REAL,
+                ma_45 REAL,
+                crossed_ma REAL,
+                PRIMARY KEY (user_id, symbol, alert_date)
+            )
+        ''')
+        if 'crossed_ma' not in {row[1] for row in self.conn.execute("PRAGMA table_info(alerts)")}:
+            # Tables from before alerts recorded the average that was crossed
+            try:
+                self.conn.execute("ALTER TABLE alerts ADD COLUMN crossed_ma REAL")
+            except sqlite3.OperationalError as e:
+                if 'duplicate column' not in str(e):
+                    raise  # Otherwise another worker process added it first
+        self.conn.commit()
+
+    def claim(self, alerts: List[tuple]) -> List[tuple]:
+        """Record (user_id, symbol, alert_date, price, ma_45, crossed_ma) alerts and return only those not sent before.
+
+        ma_45 is the 45-week SMA, if computed; crossed_ma is the ALERT_INDICATOR average that was crossed.
+        """
+        new = []
+        with self.conn:
+            for alert in alerts:
+                cursor = self.conn.execute(
+                    "INSERT OR IGNORE INTO alerts (user_id, symbol, alert_date, price, ma_45, crossed_ma) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    alert
+                )
+                if cursor.rowcount:
+                    new.append(alert)
+        return new
+
+
+class StockWatcherBot:
+    def __init__(self, database_file: str = DATABASE_FILE, watchlist_file: str = WATCHLIST_FILE,
+                 history_dir: Optional[str] = HISTORY_DIR, listing_file: Optional[str] = SYMBOL_LISTING_FILE,
+                 snapshot_file: Optional[str] = SNAPSHOT_FILE, shared_cache_file: Optional[str] = None):
+        self.snapshot_file = snapshot_file
+        self.snapshot_writer = True  # webhook workers leave saving the snapshot to the one that runs the jobs
+        self.ready_at: Optional[float] = None  # perf_counter() when warm-up finished
+        self.first_reply_at: Optional[float] = None
+        self.metrics_server: Optional[asyncio.AbstractServer] = None
+        self.outbox: Optional[SendQueue] = None  # created in startup(), once there is a Telegram bot to send with
+        if WATCHLIST_BACKEND == 'sqlite':
+            self.storage = SqliteWatchlistStorage(database_file)
+            if self.storage.is_empty() and os.path.exists(watchlist_file):
+                migrate_watchlists(watchlist_file, self.storage)
+        else:
+            self.storage = JsonWatchlistStorage(watchlist_file)
+        self.watchlists = WatchlistIndex(self.load_watchlists())
+        self.persistence = WriteBehind(self.storage, self.watchlists)
+        cache_ttls = {'quote': QUOTE_CACHE_TTL, 'snapshot': STALE_MAX_AGE, 'invalid': INVALID_SYMBOL_TTL}
+        if shared_cache_file:
+            self.cache = SharedQuoteCache(shared_cache_file, cache_ttls)
+        else:
+            self.cache = QuoteCache(cache_ttls)
+        self.symbols = SymbolDirectory(listing_file)
+        self.history = HistoryStore(history_dir)
+        self.indicators = IndicatorEngine()
+        self.inflight = SingleFlight()
+        self.market_data = MarketDataClient()
+        self.quota = QuotaScheduler()
+        self.alpha_vantage = AlphaVantageProvider(self.market_data, self.quota)
+        self.provider = YFinanceProvider() if QUOTE_PROVIDER == 'yfinance' else self.alpha_vantage
+        self.alerts = AlertStore(database_file)
+    
+    def load_watchlists(self) -> Dict:
+        """Load user watchlists from storage"""
+        return self.storage.load()
+    
+    def reload_watchlists(self):
+        """Pick up changes other worker processes made to the shared watchlist database"""
+        self.persistence.flush()
+        self.watchlists = WatchlistIndex(self.load_watchlists())
+        self.persistence.watchlists = self.watchlists
+    
+    def save_watchlists(self, changes: List[tuple]):
+        """Persist ('add' | 'remove', user_id, symbol) changes with the next batched write"""
+        self.persistence.record(changes)
     
     def get_user_watchlist(self, user_id: str) -> List[str]:
         """Get watchlist for a specific user"""
-        return self.watchlists.get(str(user_id), [])
+        return self.watchlists.get(user_id)
     
     def add_to_watchlist(self, user_id: str, symbol: str) -> bool:
         """Add stock to user's watchlist"""
-        user_id = str(user_id)
-        if user_id not in self.watchlists:
-            self.watchlists[user_id] = []
-        
         symbol = symbol.upper()
-        if symbol not in self.watchlists[user_id]:
-            self.watchlists[user_id].append(symbol)
-            self.save_watchlists()
+        if self.watchlists.add(user_id, symbol):
+            self.save_watchlists([('add', user_id, symbol)])
             return True
         return False
     
     def remove_from_watchlist(self, user_id: str, symbol: str) -> bool:
         """Remove stock from user's watchlist"""
-        user_id = str(user_id)
         symbol = symbol.upper()
         
-        if user_id in self.watchlists and symbol in self.watchlists[user_id]:
-            self.watchlists[user_id].remove(symbol)
-            self.save_watchlists()
+        if self.watchlists.remove(user_id, symbol):
+            self.save_watchlists([('remove', user_id, symbol)])
             return True
         return False
     
-    def get_stock_price(self, symbol: str) -> Dict:
-        """Get current stock price and 52-week MA using Alpha Vantage API"""
+    async def _get_quote(self, symbol: str, priority: int = PRIORITY_BULK) -> Optional[float]:
+        """Get the current price from the quote provider, served from cache when fresh"""
+        current_price = self.cache.get('quote', symbol)
+        if current_price is not None:
+            return current_price
+        return await self.inflight.do(('quote', symbol), lambda: self._load_quote(symbol, priority))
+    
+    async def _load_quote(self, symbol: str, priority: int) -> Optional[float]:
+        return await self._shared_fetch(f"quote:{symbol}", lambda: self.cache.get('quote', symbol),
+                                        lambda: self._fetch_quote(symbol, priority))
+    
+    async def _fetch_quote(self, symbol: str, priority: int) -> Optional[float]:
+        current_price = await self.provider.get_quote(symbol, priority)
+        if current_price is not None:
+            self.cache.set('quote', symbol, current_price)
+        return current_price
+    
+    async def _shared_fetch(self, key: str, ready: Callable, load: Callable):
+        """Run load() unless another worker process is already loading key; then wait for ready() to see its result
+        
+        Within one process this is just load(), since SingleFlight already
+        coalesces concurrent callers.
+        """
+        if not self.cache.shared:
+            return await load()
+        deadline = time.monotonic() + SHARED_FETCH_LEASE
+        while not self.cache.lease(key, SHARED_FETCH_LEASE):
+            value = ready()
+            if value is not None:
+                metrics.inc('shared_fetches_joined_total')
+                return value
+            if time.monotonic() > deadline:
+                break  # The other worker looks stuck; fetch it here
+            await asyncio.sleep(SHARED_FETCH_POLL)
         try:
-            # Get current quote
-            quote_url = f"https://www.alphavantage.co/query"
-            quote_params = {
-                'function': 'GLOBAL_QUOTE',
-                'symbol': symbol,
-                'apikey': ALPHA_VANTAGE_API_KEY
-            }
-            
-            quote_response = requests.get(quote_url, params=quote_params, timeout=10)
-            quote_data = quote_response.json()
-            
-            # Check for API errors
-            if 'Error Message' in quote_data:
-                logger.error(f"Alpha Vantage API error for {symbol}: {quote_data['Error Message']}")
-                return None
-            
-            if 'Note' in quote_data:
-                logger.warning(f"Alpha Vantage API rate limit for {symbol}: {quote_data['Note']}")
-                return None
-            
-            if 'Global Quote' not in quote_data:
-                logger.error(f"Unexpected response format for {symbol}: {quote_data}")
-                return None
-            
-            quote = quote_data['Global Quote']
-            current_price = float(quote['05. price'])
-            company_name = symbol  # Alpha Vantage doesn't provide company name in quote
-            
-            # Get historical data for 52-week MA calculation
-            # Using weekly data to reduce API calls
-            hist_url = f"https://www.alphavantage.co/query"
-            hist_params = {
-                'function': 'TIME_SERIES_WEEKLY',
-                'symbol': symbol,
-                'apikey': ALPHA_VANTAGE_API_KEY
-            }
-            
-            hist_response = requests.get(hist_url, params=hist_params, timeout=10)
-            hist_data = hist_response.json()
-            
-            if 'Weekly Time Series' not in hist_data:
-                logger.error(f"No historical data available for {symbol}")
-                # Return current price without MA if historical data unavailable
-                return {
-                    'symbol': symbol,
-                    'company_name': company_name,
-                    'current_price': round(current_price, 2),
-                    'ma_52_week': None,
-                    'above_ma': None,
-                    'change_percent': None
-                }
-            
-            # Calculate 52-week moving average
-            weekly_data = hist_data['Weekly Time Series']
-            dates = sorted(weekly_data.keys(), reverse=True)  # Most recent first
-            
-            if len(dates) < 52:
-                logger.warning(f"Not enough historical data for {symbol} (only {len(dates)} weeks)")
-                ma_52_week = None
-                above_ma = None
-                change_percent = None
-            else:
-                # Get closing prices for last 52 weeks
-                closing_prices = []
-                for date in dates[:52]:
-                    closing_prices.append(float(weekly_data[date]['4. close']))
-                
-                ma_52_week = sum(closing_prices) / len(closing_prices)
-                above_ma = current_price > ma_52_week
-                change_percent = round(((current_price - ma_52_week) / ma_52_week) * 100, 2)
-                ma_52_week = round(ma_52_week, 2)
+            value = ready()  # Finished by another worker just before the lease was ours
+            return value if value is not None else await load()
+        finally:
+            self.cache.release(key)
+    
+    async def prefetch_quotes(self, symbols: List[str], priority: int = PRIORITY_BULK):
+        """Load every uncached quote for symbols in one bulk request, if the provider supports it"""
+        if not self.provider.batched:
+            return
+        missing = [symbol for symbol in dict.fromkeys(symbols) if self.cache.get('quote', symbol) is None]
+        if not missing:
+            return
+        try:
+            await self.inflight.do_many([('quote', symbol) for symbol in missing],
+                                        lambda keys: self._load_quotes([key[1] for key in keys], priority))
+        except Exception as e:
+            # Symbols missed here are fetched one by one afterwards
+            logger.error(f"Bulk quote request for {len(missing)} symbols failed: {e}")
+    
+    async def _load_quotes(self, symbols: List[str], priority: int) -> Dict:
+        prices = await self.provider.get_quotes(symbols, priority)
+        for symbol, price in prices.items():
+            self.cache.set('quote', symbol, price)
+        return {('quote', symbol): prices.get(symbol) for symbol in symbols}
+    
+    async def _get_weekly_history(self, symbol: str, priority: int = PRIORITY_BULK) -> Optional[WeeklyHistory]:
+        """Get closed weekly history; Alpha Vantage is only asked again once a new week has closed"""
+        history = self.history.get(symbol)
+        if history.is_current(last_closed_week()):
+            return history
+        return await self.inflight.do(('weekly', symbol), lambda: self._shared_fetch(
+            f"weekly:{symbol}", lambda: self._reloaded_history(symbol), lambda: self._load_weekly_history(symbol, priority)
+        ))
+    
+    def _reloaded_history(self, symbol: str) -> Optional[WeeklyHistory]:
+        # Another worker process may have appended this week's bar since we loaded the file
+        history = self.history.reload(symbol)
+        return history if history.is_current(last_closed_week()) else None
+    
+    async def _load_weekly_history(self, symbol: str, priority: int) -> Optional[WeeklyHistory]:
+        # Using weekly data to reduce API calls
+        hist_data = await self.alpha_vantage.query('TIME_SERIES_WEEKLY', symbol, priority)
+        
+        if 'Weekly Time Series' not in hist_data:
+            logger.error(f"No historical data available for {symbol}")
+            return None
+        
+        # Take in only weeks that closed since the last fetch; this week's bar is still forming
+        history = self.history.get(symbol)
+        newest = history.dates[-1] if history.dates else 0
+        last_closed = last_closed_week().toordinal()
+        bars = []
+        for day, bar in hist_data['Weekly Time Series'].items():
+            ordinal = date.fromisoformat(day).toordinal()
+            if newest < ordinal <= last_closed:
+                bars.append((ordinal, float(bar['1. open']), float(bar['2. high']),
+                             float(bar['3. low']), float(bar['4. close'])))
+        return self.history.append(symbol, sorted(bars))
+    
+    async def _fetch_symbol(self, symbol: str, priority: int) -> Optional[tuple]:
+        """Get (current price, weekly history or None) for a symbol, or None if it could not be fetched"""
+        try:
+            current_price = await self._get_quote(symbol, priority)
+            if current_price is None:
+                return None
             
-            return {
-                'symbol': symbol,
-                'company_name': company_name,
-                'current_price': round(current_price, 2),
-                'ma_52_week': ma_52_week,
-                'above_ma': above_ma,
-                'change_percent': change_percent
-            }
+            # Get historical data for 52-week MA calculation
+            history = await self._get_weekly_history(symbol, priority)
+            return current_price, history
             
-        except requests.exceptions.RequestException as e:
+        except QuotaExceeded:
+            raise
+        except ProviderError as e:
+            logger.error(str(e))
+            return None
+        except httpx.HTTPError as e:
             logger.error(f"Network error getting stock price for {symbol}: {e}")
             return None
+        except asyncio.TimeoutError:
+            logger.error(f"Timed out getting stock price for {symbol}")
+            return None
         except KeyError as e:
             logger.error(f"Key error parsing data for {symbol}: {e}")
             return None
@@ -174,9 +1730,257 @@ class StockWatcherBot:
         except Exception as e:
             logger.error(f"Unexpected error getting stock price for {symbol}: {e}")
             return None
+    
+    def analyze(self, fetched: Dict[str, tuple]) -> Dict[str, Dict]:
+        """Run the indicator engine once over {symbol: (current price, history)} and build each result"""
+        # Views of the loaded close columns; price_matrix copies each window once, into the matrix
+        series = {symbol: np.frombuffer(history.tail(INDICATOR_HISTORY_WEEKS), dtype=float) if history is not None
+                  else np.empty(0) for symbol, (_, history) in fetched.items()}
+        current_prices = {symbol: current_price for symbol, (current_price, _) in fetched.items()}
+        # While this week's bar is still forming, the current price stands in for its close
+        matrix = price_matrix(series, current_prices if weekly_bar_open() else None)
+        table = self.indicators.compute(matrix, pd.Series(current_prices, dtype=float))
+        
+        results = {}
+        for symbol, (current_price, history) in fetched.items():
+            row = table.loc[symbol]
+            indicators = {
+                name: None if pd.isna(value) else int(value) if name.startswith('cross_') else round(float(value), 2)
+                for name, value in row.items() if name != 'price'
+            }
+            ma_52_week = row[f"sma_{MA_WEEKS}"]
+            if pd.isna(ma_52_week):
+                if history is not None:
+                    logger.warning(f"Not enough historical data for {symbol} (only {len(series[symbol])} weeks)")
+                ma_52_week = None
+                above_ma = None
+                change_percent = None
+            else:
+                above_ma = bool(current_price > ma_52_week)
+                change_percent = indicators[f"pct_sma_{MA_WEEKS}"]
+                ma_52_week = round(float(ma_52_week), 2)
+            
+            results[symbol] = {
+                'symbol': symbol,
+                'company_name': self.symbols.name(symbol) or symbol,
+                'current_price': round(current_price, 2),
+                'ma_52_week': ma_52_week,
+                'above_ma': above_ma,
+                'change_percent': change_percent,
+                'indicators': indicators
+            }
+        return results
+    
+    async def get_stock_price(self, symbol: str, priority: int = PRIORITY_BULK) -> Optional[Dict]:
+        """Get current stock price and 52-week MA using Alpha Vantage API
+        
+        Raises QuotaExceeded when the API quota would make the caller wait longer
+        than QUOTA_MAX_WAIT; its eta says when to try again.
+        """
+        with metrics.timer('get_stock_price'):
+            result = (await self.get_stock_prices([symbol], priority=priority))[0]
+        if isinstance(result, QuotaExceeded):
+            raise result
+        return result
+    
+    async def get_stock_prices(self, symbols: List[str], concurrency: int = FETCH_CONCURRENCY,
+                               priority: int = PRIORITY_BULK) -> List[Union[Dict, QuotaExceeded, None]]:
+        """Get price data for several symbols in parallel, in the order given
+        
+        A symbol that could not be fetched within the API quota gets its
+        QuotaExceeded error in place of the result. With a batched quote provider
+        all quotes come from a single bulk request first. Indicators for all
+        fetched symbols are computed together in one engine pass.
+        """
+        with metrics.timer('get_stock_prices'):
+            return await self._get_stock_prices(symbols, concurrency, priority)
+    
+    async def _get_stock_prices(self, symbols: List[str], concurrency: int, priority: int) -> List:
+        results = {}
+        async for batch in self.stream_stock_prices(symbols, concurrency, priority):
+            results.update(batch)
+        return [results[symbol] for symbol in symbols]
+    
+    async def stream_stock_prices(self, symbols: List[str], concurrency: int = FETCH_CONCURRENCY,
+                                  priority: int = PRIORITY_BULK, interval: Optional[float] = None):
+        """Yield {symbol: result} batches as the fetches for symbols complete
+        
+        The first batch comes as soon as any symbol is done, later ones at most
+        every interval seconds; each batch is analyzed in one engine pass. With
+        interval None everything arrives in a single batch.
+        """
+        await self.prefetch_quotes(symbols, priority)
+        semaphore = asyncio.Semaphore(concurrency)
+        
+        async def fetch(symbol: str) -> tuple:
+            async with semaphore:
+                try:
+                    return symbol, await self._fetch_symbol(symbol, priority)
+                except QuotaExceeded as e:
+                    return symbol, e
+        
+        loop = asyncio.get_running_loop()
+        pending = {asyncio.ensure_future(fetch(symbol)) for symbol in dict.fromkeys(symbols)}
+        last_batch = None
+        try:
+            while pending:
+                if interval is None:
+                    done, pending = await asyncio.wait(pending)
+                else:
+                    if last_batch is not None:
+                        # Collect whatever finishes until the next batch is due
+                        await asyncio.wait(pending, timeout=max(0.0, last_batch + interval - loop.time()))
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                fetched = dict(task.result() for task in done)
+                analyzed = self.analyze({symbol: data for symbol, data in fetched.items() if isinstance(data, tuple)})
+                fetched_at = time.time()
+                for symbol, stock_data in analyzed.items():
+                    self.cache.set('snapshot', symbol, (stock_data, fetched_at))
+                last_batch = loop.time()
+                yield {symbol: analyzed[symbol] if isinstance(data, tuple) else data
+                       for symbol, data in fetched.items()}
+        finally:
+            for task in pending:
+                task.cancel()
+    
+    async def validate_symbols(self, symbols: List[str], priority: int = PRIORITY_BULK) -> List[Union[str, QuotaExceeded, None]]:
+        """Company name for each valid symbol and None for invalid ones, in the order given
+        
+        Symbols in the directory and tickers rejected within INVALID_SYMBOL_TTL
+        are answered without an API call; anything else costs one quote request,
+        and the answer is remembered unless the provider failed to give one.
+        """
+        results = {}
+        unknown = []
+        for symbol in dict.fromkeys(symbols):
+            if symbol in self.symbols:
+                results[symbol] = self.symbols.name(symbol)
+            elif not HistoryStore.SYMBOL_PATTERN.fullmatch(symbol) or self.cache.get('invalid', symbol):
+                results[symbol] = None
+            else:
+                unknown.append(symbol)
+        
+        async def check(symbol: str) -> Union[str, QuotaExceeded, None]:
+            try:
+                current_price = await self._get_quote(symbol, priority)
+            except QuotaExceeded as e:
+                return e
+            except Exception as e:
+                # Provider and network errors say nothing about the ticker, so they are not remembered
+                logger.error(f"Could not validate {symbol}: {e}")
+                return None
+            if current_price is None:
+                self.cache.set('invalid', symbol, True)
+                return None
+            self.symbols.add(symbol)
+            return self.symbols.name(symbol)
+        
+        if unknown:
+            await self.prefetch_quotes(unknown, priority)
+            results.update(zip(unknown, await asyncio.gather(*(check(symbol) for symbol in unknown))))
+        return [results[symbol] for symbol in symbols]
+    
+    def last_known_price(self, symbol: str) -> Optional[tuple]:
+        """Last successfully fetched (stock_data, fetched_at) for a symbol, at most STALE_MAX_AGE old"""
+        return self.cache.get('snapshot', symbol.upper())
+    
+    def save_snapshot(self):
+        """Write the last known data of every symbol to snapshot_file"""
+        if not self.snapshot_file or not self.snapshot_writer:
+            return
+        snapshot = {symbol: {'data': stock_data, 'fetched_at': fetched_at}
+                    for symbol, (stock_data, fetched_at) in self.cache.items('snapshot')}
+        tmp_path = f"{self.snapshot_file}.{os.getpid()}.tmp"
+        try:
+            with metrics.timer('snapshot_save'):
+                with open(tmp_path, 'w') as f:
+                    json.dump(snapshot, f)
+                os.replace(tmp_path, self.snapshot_file)
+        except Exception as e:
+            logger.error(f"Error saving market snapshot: {e}")
+    
+    def load_snapshot(self) -> int:
+        """Load last known data from snapshot_file, keeping each entry's original age"""
+        if not self.snapshot_file or not os.path.exists(self.snapshot_file):
+            return 0
+        try:
+            with open(self.snapshot_file, 'r') as f:
+                snapshot = json.load(f)
+        except Exception as e:
+            logger.error(f"Error loading market snapshot: {e}")
+            return 0
+        loaded = 0
+        now = time.time()
+        for symbol, entry in snapshot.items():
+            age = now - entry['fetched_at']
+            if age < STALE_MAX_AGE:
+                self.cache.set('snapshot', symbol, (entry['data'], entry['fetched_at']), ttl=STALE_MAX_AGE - age)
+                loaded += 1
+            if age < QUOTE_CACHE_TTL:
+                # A quick restart: the price is still fresh enough for /check
+                self.cache.set('quote', symbol, entry['data']['current_price'], ttl=QUOTE_CACHE_TTL - age)
+        return loaded
+    
+    def warm_up(self) -> Dict:
+        """Preload everything the first /price and /check would otherwise wait for
+        
+        Loads the persisted market snapshot and the weekly history of every
+        watched symbol, and pays the import and first-call cost of pandas and
+        numpy (and yfinance when it is the quote provider). Returns the time
+        each stage took in ms.
+        """
+        timings = {}
+        start = time.perf_counter()
+        timings['snapshot_symbols'] = self.load_snapshot()
+        timings['snapshot_ms'] = round((time.perf_counter() - start) * 1000, 1)
+        
+        start = time.perf_counter()
+        symbols = self.watchlists.symbols()
+        for symbol in symbols:
+            self.history.get(symbol)
+        timings['history_symbols'] = len(symbols)
+        timings['history_ms'] = round((time.perf_counter() - start) * 1000, 1)
+        
+        start = time.perf_counter()
+        self.analyze({'WARMUP': (1.0, None)})
+        if QUOTE_PROVIDER == 'yfinance':
+            yf.download  # Resolving an attribute completes the deferred import
+        timings['imports_ms'] = round((time.perf_counter() - start) * 1000, 1)
+        return timings
+
+    async def scan_crossovers(self) -> List[tuple]:
+        """Fetch every distinct watched symbol once and return new (user_id, stock_data) crossover alerts
+        
+        Upstream cost grows with the number of distinct symbols, not with
+        users x symbols; users are only visited for symbols that crossed.
+        """
+        if self.cache.shared:
+            self.reload_watchlists()
+        symbols = self.watchlists.symbols()
+        if not symbols:
+            return []
+        results = await self.get_stock_prices(symbols)
+        
+        # One alert per user, symbol and week, however often the price flips around the average. The key
+        # is the bar that crossed, so the same crossing seen again once that week has closed is not resent
+        alert_date = latest_bar_date().isoformat()
+        crossed = {}
+        candidates = []
+        for symbol, stock_data in zip(symbols, results):
+            if not isinstance(stock_data, dict) or not stock_data['indicators'].get(f"cross_{ALERT_INDICATOR}"):
+                continue
+            crossed[symbol] = stock_data
+            indicators = stock_data['indicators']
+            for user_id in self.watchlists.subscribers(symbol):
+                candidates.append((int(user_id), symbol, alert_date, stock_data['current_price'],
+                                   indicators.get('sma_45'), indicators[ALERT_INDICATOR]))
+        
+        skipped = sum(1 for result in results if isinstance(result, QuotaExceeded))
+        logger.info(f"Alert scan: {len(symbols)} symbols, {len(crossed)} crossed, {skipped} skipped for quota")
+        return [(user_id, crossed[symbol]) for user_id, symbol, *_ in self.alerts.claim(candidates)]
 
-# Initialize bot
-bot = StockWatcherBot()
+# Initialized in main(), so importing this module touches no files
+bot: Optional[StockWatcherBot] = None
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
@@ -235,6 +2039,7 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 • Use official stock symbols (e.g., AAPL for Apple)
 • The bot tracks 52-week moving average for technical analysis
 • You can add multiple stocks to monitor them easily
+• You'll get an alert when a watched stock crosses its 52-week MA
 
 **Example Usage:**
 `/add AAPL GOOGL MSFT` - Add multiple stocks
@@ -242,7 +2047,7 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 `/check` - Analyze all your stocks at once
     """
     
-    await update.message.reply_text(help_text, parse_mode='Markdown')
+    await update.effective_message.reply_text(help_text, parse_mode='Markdown')
 
 async def add_stock(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Add stock to watchlist"""
@@ -257,18 +2062,24 @@ async def add_stock(update: Update, context: ContextTypes.DEFAULT_TYPE):
     added_stocks = []
     already_exists = []
     invalid_stocks = []
+    queued_stocks = []
     
-    for symbol in context.args:
-        symbol = symbol.upper()
+    symbols = [symbol.upper() for symbol in context.args]
+    
+    # Listed symbols are validated locally; only unknown ones cost a quote request
+    results = await bot.validate_symbols(symbols)
+    
+    for symbol, company_name in zip(symbols, results):
+        if isinstance(company_name, QuotaExceeded):
+            queued_stocks.append(f"{symbol} (retry in ~{format_eta(company_name.eta)})")
+            continue
         
-        # Validate stock symbol by trying to get its info
-        stock_data = bot.get_stock_price(symbol)
-        if stock_data is None:
+        if company_name is None:
             invalid_stocks.append(symbol)
             continue
         
         if bot.add_to_watchlist(user_id, symbol):
-            added_stocks.append(f"{symbol} ({stock_data['company_name']})")
+            added_stocks.append(f"{symbol} ({company_name})")
         else:
             already_exists.append(symbol)
     
@@ -282,6 +2093,9 @@ async def add_stock(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if invalid_stocks:
         response += f"\n\n❌ **Invalid symbols:**\n" + "\n".join([f"• {stock}" for stock in invalid_stocks])
     
+    if queued_stocks:
+        response += f"\n\n⏳ **Not validated, API quota reached:**\n" + "\n".join([f"• {stock}" for stock in queued_stocks])
+    
     if not response:
         response = "❌ No valid stocks were processed."
     
@@ -333,58 +2147,56 @@ async def list_watchlist(update: Update, context: ContextTypes.DEFAULT_TYPE):
         keyboard = [[InlineKeyboardButton("➕ Add Stock", callback_data="add_help")]]
         reply_markup = InlineKeyboardMarkup(keyboard)
         
-        await update.message.reply_text(
+        await update.effective_message.reply_text(
             "📝 Your watchlist is empty.\n\nUse `/add <symbol>` to add stocks!\n\n**Example:** `/add AAPL GOOGL MSFT`",
             parse_mode='Markdown',
             reply_markup=reply_markup
         )
         return
     
-    response = f"📋 **Your Watchlist ({len(watchlist)} stocks):**\n\n"
-    
-    for i, symbol in enumerate(watchlist, 1):
-        response += f"{i}. 📈 **{symbol}**\n"
+    text, reply_markup = watchlist_page(watchlist, 0)
+    await update.effective_message.reply_text(text, parse_mode='Markdown', reply_markup=reply_markup)
+
+def watchlist_page(watchlist: List[str], page: int) -> tuple:
+    """Text and keyboard of one /list page; page is clamped to the pages there are"""
+    pages = max(1, -(-len(watchlist) // LIST_PAGE_SIZE))
+    page = min(max(page, 0), pages - 1)
+    first = page * LIST_PAGE_SIZE
+    lines = [f"📋 **Your Watchlist ({len(watchlist)} stocks):**\n"]
+    lines += [f"{i}. 📈 **{symbol}**" for i, symbol in enumerate(watchlist[first:first + LIST_PAGE_SIZE], first + 1)]
     
-    keyboard = [
+    keyboard = []
+    if pages > 1:
+        navigation = []
+        if page > 0:
+            navigation.append(InlineKeyboardButton("◀️ Previous", callback_data=f"list_{page - 1}"))
+        navigation.append(InlineKeyboardButton(f"{page + 1}/{pages}", callback_data=f"list_{page}"))
+        if page < pages - 1:
+            navigation.append(InlineKeyboardButton("Next ▶️", callback_data=f"list_{page + 1}"))
+        keyboard.append(navigation)
+    keyboard += [
         [InlineKeyboardButton("💰 Check Prices", callback_data="check_all")],
         [InlineKeyboardButton("➕ Add More", callback_data="add_help")]
     ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
-    await update.message.reply_text(
-        response, 
-        parse_mode='Markdown',
-        reply_markup=reply_markup
-    )
+    return "\n".join(lines), InlineKeyboardMarkup(keyboard)
 
-async def get_price(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Get stock price information"""
-    if not context.args:
-        await update.message.reply_text(
-            "❌ Please specify a stock symbol.\n\n**Usage:** `/price AAPL`",
-            parse_mode='Markdown'
-        )
-        return
-    
-    symbol = context.args[0].upper()
-    
-    # Send "typing" action
-    await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
-    
-    stock_data = bot.get_stock_price(symbol)
-    
-    if stock_data is None:
-        await update.message.reply_text(
-            f"❌ Could not find data for symbol **{symbol}**.\n\nPlease check the symbol and try again.",
-            parse_mode='Markdown'
-        )
-        return
-    
-    # Determine trend emoji and status
+def format_indicators(indicators: Dict) -> str:
+    """Extra configured moving averages, one line each"""
+    lines = ""
+    for name, value in indicators.items():
+        kind, _, window = name.partition('_')
+        if kind not in ('sma', 'ema') or value is None or name == f"sma_{MA_WEEKS}":
+            continue
+        lines += f"\n📐 **{window}-Week {kind.upper()}:** ${value} ({indicators[f'pct_{name}']:+.2f}%)"
+    return lines
+
+def format_price(stock_data: Dict, fetched_at: float, note: str = "") -> str:
+    """Price reply for /price, dated by when the data was fetched"""
     if stock_data['ma_52_week'] is not None:
         trend_emoji = "📈" if stock_data['above_ma'] else "📉"
         status = "Above 52-Week MA" if stock_data['above_ma'] else "Below 52-Week MA"
         ma_text = f"📊 **52-Week MA:** ${stock_data['ma_52_week']}\n📈 **Status:** {status}\n📊 **Difference:** {stock_data['change_percent']:+.2f}%"
+        ma_text += format_indicators(stock_data['indicators'])
     else:
         trend_emoji = "📊"
         ma_text = "📊 **52-Week MA:** Data unavailable\n⚠️ **Note:** Insufficient historical data for MA calculation"
@@ -395,45 +2207,151 @@ async def get_price(update: Update, context: ContextTypes.DEFAULT_TYPE):
 💰 **Current Price:** ${stock_data['current_price']}
 {ma_text}
 
-*Last updated: {datetime.now().strftime('%Y-%m-%d %H:%M UTC')}*
+*Last updated: {datetime.fromtimestamp(fetched_at).strftime('%Y-%m-%d %H:%M UTC')}*
     """
-    
-    # Add action buttons
-    keyboard = [
+    if note:
+        response += f"\n{note}"
+    return response
+
+def price_keyboard(symbol: str) -> InlineKeyboardMarkup:
+    """Action buttons under a /price reply"""
+    return InlineKeyboardMarkup([
         [InlineKeyboardButton("➕ Add to Watchlist", callback_data=f"add_{symbol}")],
         [InlineKeyboardButton("🔄 Refresh", callback_data=f"price_{symbol}")]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    ])
+
+async def edit_message(message, text: str, reply_markup: Optional[InlineKeyboardMarkup] = None):
+    """Edit a message in place; an unchanged text is not an error"""
+    try:
+        await message.edit_text(text, parse_mode='Markdown', reply_markup=reply_markup)
+    except BadRequest as e:
+        if 'not modified' not in str(e).lower():
+            raise
+
+async def edit_price_message(message, text: str, symbol: str):
+    """Edit a /price reply in place"""
+    await edit_message(message, text, price_keyboard(symbol))
+
+async def send_price(update: Update, text: str, symbol: str):
+    """Reply with a price, or update the message in place when the Refresh button was pressed"""
+    if update.callback_query:
+        await edit_price_message(update.effective_message, text, symbol)
+        return update.effective_message
+    return await update.effective_message.reply_text(text, parse_mode='Markdown', reply_markup=price_keyboard(symbol))
+
+async def refresh_price(message, symbol: str, stale_data: Dict, fetched_at: float):
+    """Fetch fresh data for a stale /price reply and edit it in place"""
+    try:
+        stock_data = await bot.get_stock_price(symbol, PRIORITY_INTERACTIVE)
+        note = "⚠️ Could not refresh right now; showing the last known price."
+    except QuotaExceeded as e:
+        stock_data = None
+        note = f"⏳ API quota reached; showing the last known price. Refresh again in about {format_eta(e.eta)}."
     
-    await update.message.reply_text(
-        response, 
-        parse_mode='Markdown',
-        reply_markup=reply_markup
-    )
+    if stock_data is not None:
+        text = format_price(stock_data, time.time())
+    else:
+        text = format_price(stale_data, fetched_at, note)
+    await edit_price_message(message, text, symbol)
 
-async def check_watchlist(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Check all stocks in watchlist against 52-week MA"""
-    user_id = update.effective_user.id
-    watchlist = bot.get_user_watchlist(user_id)
+async def get_price(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Get stock price information
     
-    if not watchlist:
-        await update.message.reply_text(
-            "📝 Your watchlist is empty.\n\nUse `/add <symbol>` to add stocks first!",
+    A symbol fetched before is answered at once from its last known data. If
+    that is older than QUOTE_CACHE_TTL the reply shows its age and is edited
+    in place once fresh data arrives.
+    """
+    if not context.args:
+        await update.effective_message.reply_text(
+            "❌ Please specify a stock symbol.\n\n**Usage:** `/price AAPL`",
             parse_mode='Markdown'
         )
         return
     
-    # Send "typing" action for longer operations
+    symbol = context.args[0].upper()
+    
+    snapshot = bot.last_known_price(symbol)
+    if snapshot is not None:
+        stock_data, fetched_at = snapshot
+        age = time.time() - fetched_at
+        if age < QUOTE_CACHE_TTL:
+            await send_price(update, format_price(stock_data, fetched_at), symbol)
+            return
+        message = await send_price(
+            update, format_price(stock_data, fetched_at, f"🕒 _Price from {format_eta(age)} ago, refreshing..._"), symbol
+        )
+        context.application.create_task(refresh_price(message, symbol, stock_data, fetched_at), update=update)
+        return
+    
+    # Send "typing" action
     await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
     
-    response = f"📊 **52-Week MA Analysis** ({len(watchlist)} stocks)\n\n"
+    try:
+        stock_data = await bot.get_stock_price(symbol, PRIORITY_INTERACTIVE)
+    except QuotaExceeded as e:
+        await update.effective_message.reply_text(
+            f"⏳ API quota reached, so **{symbol}** could not be fetched right now.\n\nPlease try again in about {format_eta(e.eta)}.",
+            parse_mode='Markdown'
+        )
+        return
+    
+    if stock_data is None:
+        await update.effective_message.reply_text(
+            f"❌ Could not find data for symbol **{symbol}**.\n\nPlease check the symbol and try again.",
+            parse_mode='Markdown'
+        )
+        return
     
+    await send_price(update, format_price(stock_data, time.time()), symbol)
+
+def paginate(blocks: List[str], limit: int = MESSAGE_LIMIT) -> List[str]:
+    """Pack text blocks, in order, into as few pages of at most limit characters as possible"""
+    pages = [""]
+    for block in blocks:
+        if pages[-1] and len(pages[-1]) + len(block) > limit:
+            pages.append("")
+        pages[-1] += block
+    return pages
+
+class PagedReply:
+    """A reply spread over as many messages as its pages need, edited in place as it changes"""
+
+    def __init__(self, update: Update):
+        self.update = update
+        self.messages = []
+        self.shown = []  # (text, reply_markup) currently in each message
+
+    async def show(self, pages: List[str], reply_markup: Optional[InlineKeyboardMarkup] = None):
+        """Make the messages show pages, sending new ones as needed; the keyboard goes under the last page"""
+        for index, text in enumerate(pages):
+            markup = reply_markup if index == len(pages) - 1 else None
+            if index == len(self.messages):
+                self.messages.append(
+                    await self.update.effective_message.reply_text(text, parse_mode='Markdown', reply_markup=markup)
+                )
+                self.shown.append((text, markup))
+            elif self.shown[index] != (text, markup):
+                await edit_message(self.messages[index], text, markup)
+                self.shown[index] = (text, markup)
+        while len(self.messages) > len(pages):
+            self.shown.pop()
+            await self.messages.pop().delete()
+
+def format_check(watchlist: List[str], results: Dict, done: bool) -> List[str]:
+    """Pages of the /check reply for the results so far, in watchlist order"""
     above_ma = []
     below_ma = []
     errors = []
+    queued = []
     
     for symbol in watchlist:
-        stock_data = bot.get_stock_price(symbol)
+        if symbol not in results:
+            continue
+        stock_data = results[symbol]
+        
+        if isinstance(stock_data, QuotaExceeded):
+            queued.append(f"{symbol} (retry in ~{format_eta(stock_data.eta)})")
+            continue
         
         if stock_data is None:
             errors.append(symbol)
@@ -454,27 +2372,57 @@ async def check_watchlist(update: Update, context: ContextTypes.DEFAULT_TYPE):
         else:
             below_ma.append(stock_line)
     
-    # Format results
-    if above_ma:
-        response += "✅ **Above 52-Week MA:**\n" + "\n".join(above_ma) + "\n\n"
+    # Format results one line per block, so that pages only break between lines
+    blocks = [f"📊 **52-Week MA Analysis** ({len(watchlist)} stocks)\n\n"]
+    sections = (
+        ("✅ **Above 52-Week MA:**", above_ma),
+        ("❌ **Below 52-Week MA:**", below_ma),
+        ("⚠️ **Data Unavailable:**", [f"• {symbol}" for symbol in errors]),
+        ("⏳ **Waiting for API Quota:**", [f"• {symbol}" for symbol in queued])
+    )
+    for title, lines in sections:
+        if lines:
+            blocks.append(f"{title}\n")
+            blocks += [f"{line}\n" for line in lines]
+            blocks.append("\n")
+    
+    if done:
+        blocks.append(f"*Analysis completed at {datetime.now().strftime('%Y-%m-%d %H:%M UTC')}*")
+    else:
+        blocks.append(f"⏳ _Checked {len(results)} of {len(watchlist)} stocks..._")
+    return paginate(blocks)
+
+async def check_watchlist(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Check all stocks in watchlist against 52-week MA
     
-    if below_ma:
-        response += "❌ **Below 52-Week MA:**\n" + "\n".join(below_ma) + "\n\n"
+    The reply is sent straight away and edited as results come in, at most
+    every CHECK_EDIT_INTERVAL seconds; a long watchlist continues in further
+    messages of up to MESSAGE_LIMIT characters.
+    """
+    user_id = update.effective_user.id
+    watchlist = bot.get_user_watchlist(user_id)
     
-    if errors:
-        response += "⚠️ **Data Unavailable:**\n" + "\n".join([f"• {symbol}" for symbol in errors]) + "\n\n"
+    if not watchlist:
+        await update.effective_message.reply_text(
+            "📝 Your watchlist is empty.\n\nUse `/add <symbol>` to add stocks first!",
+            parse_mode='Markdown'
+        )
+        return
     
-    response += f"*Analysis completed at {datetime.now().strftime('%Y-%m-%d %H:%M UTC')}*"
+    started = time.perf_counter()
+    reply = PagedReply(update)
+    await reply.show(format_check(watchlist, {}, done=False))
+    metrics.observe('check_first_reply_seconds', time.perf_counter() - started)
     
     # Add refresh button
     keyboard = [[InlineKeyboardButton("🔄 Refresh Analysis", callback_data="check_all")]]
     reply_markup = InlineKeyboardMarkup(keyboard)
     
-    await update.message.reply_text(
-        response, 
-        parse_mode='Markdown',
-        reply_markup=reply_markup
-    )
+    results = {}
+    async for batch in bot.stream_stock_prices(watchlist, interval=CHECK_EDIT_INTERVAL):
+        results.update(batch)
+        done = len(results) == len(watchlist)
+        await reply.show(format_check(watchlist, results, done), reply_markup if done else None)
 
 async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle inline button callbacks"""
@@ -485,6 +2433,13 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     if data == "list":
         await list_watchlist(update, context)
+    elif data.startswith("list_"):
+        watchlist = bot.get_user_watchlist(query.from_user.id)
+        if not watchlist:
+            await list_watchlist(update, context)
+            return
+        text, reply_markup = watchlist_page(watchlist, int(data[5:]))
+        await edit_message(query.message, text, reply_markup)
     elif data == "help":
         await help_command(update, context)
     elif data == "check_all":
@@ -508,7 +2463,7 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await query.edit_message_text(f"📊 **{symbol}** is already in your watchlist!")
     elif data.startswith("price_"):
         symbol = data[6:]
-        # Simulate price command
+        # Simulate price command; the reply replaces the message the button is on
         context.args = [symbol]
         await get_price(update, context)
 
@@ -528,25 +2483,647 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
             parse_mode='Markdown'
         )
 
-def main():
-    """Start the bot"""
-    # Create application
-    application = Application.builder().token(BOT_TOKEN).build()
+class OutgoingMessage:
+    """A message waiting in the SendQueue; notifications to one chat are merged into one of these"""
+
+    def __init__(self, chat_id: int, text: str, reply_markup: Optional[InlineKeyboardMarkup] = None,
+                 batchable: bool = False, not_before: float = 0.0):
+        self.chat_id = chat_id
+        self.texts = [text]
+        self.rows = list(reply_markup.inline_keyboard) if reply_markup else []
+        self.batchable = batchable
+        self.not_before = not_before
+        self.enqueued = time.monotonic()
+        self.attempts = 0
+        self.future: Optional[asyncio.Future] = None
+
+    @property
+    def text(self) -> str:
+        return "\n\n".join(self.texts)
+
+    def merge(self, text: str, reply_markup: Optional[InlineKeyboardMarkup]) -> bool:
+        """Append a notification if the result still fits in one message"""
+        if not self.batchable or len(self.text) + 2 + len(text) > MESSAGE_LIMIT:
+            return False
+        self.texts.append(text)
+        self.rows += list(reply_markup.inline_keyboard) if reply_markup else []
+        return True
+
+class SendQueue:
+    """Outbound messages throttled to Telegram's flood limits
+
+    Every send takes a token from a global bucket and one from its chat's
+    bucket, and a chat's messages go out in order, one at a time. A RetryAfter
+    from Telegram puts the message back at the front of its chat and pauses
+    sending for the time Telegram asked for. Notifications to one chat that
+    are waiting together are merged into a single message.
+    """
+
+    def __init__(self, telegram_bot, rate: float = SEND_RATE, per_chat_rate: float = SEND_RATE_PER_CHAT,
+                 per_chat_burst: int = SEND_BURST_PER_CHAT, batch_window: float = SEND_BATCH_WINDOW):
+        self.telegram_bot = telegram_bot
+        self.bucket = TokenBucket(rate, rate)
+        self.per_chat_rate = per_chat_rate
+        self.per_chat_burst = per_chat_burst
+        self.batch_window = batch_window
+        self._chats: Dict[int, deque] = {}  # messages waiting per chat, in order
+        self._chat_buckets: Dict[int, TokenBucket] = {}
+        self._sending: Set[int] = set()  # chats with a send in flight
+        self._paused_until = 0.0
+        self._tasks: Set[asyncio.Task] = set()
+        self._wakeup = asyncio.Event()
+        self._dispatcher: Optional[asyncio.Task] = None
+        self._sent_at = deque()  # send times within the last minute, for the drain rate
+        self.depth = 0  # queued or in flight
+        self.sent = 0
+        self.merged = 0
+        self.retried = 0
+        self.failed = 0
+
+    def _put(self, message: OutgoingMessage):
+        self._chats.setdefault(message.chat_id, deque()).append(message)
+        self.depth += 1
+        metrics.set_gauge('send_queue_depth', self.depth)
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.ensure_future(self._dispatch())
+        self._wakeup.set()
+
+    def notify(self, chat_id: int, text: str, reply_markup: Optional[InlineKeyboardMarkup] = None):
+        """Queue a notification; it waits batch_window seconds for others to the same chat to join it"""
+        waiting = self._chats.get(chat_id)
+        if waiting and waiting[-1].merge(text, reply_markup):
+            self.merged += 1
+            metrics.inc('send_merged_total')
+            return
+        self._put(OutgoingMessage(chat_id, text, reply_markup, batchable=True,
+                                  not_before=time.monotonic() + self.batch_window))
+
+    async def send(self, chat_id: int, text: str, reply_markup: Optional[InlineKeyboardMarkup] = None):
+        """Queue a message and wait until it has been sent; returns the sent Message"""
+        message = OutgoingMessage(chat_id, text, reply_markup)
+        message.future = asyncio.get_running_loop().create_future()
+        self._put(message)
+        return await message.future
+
+    def _chat_wait(self, chat_id: int, now: float) -> float:
+        """Seconds until the first waiting message of a chat may be sent"""
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self.per_chat_burst, self.per_chat_rate)
+        return max(self._chats[chat_id][0].not_before - now, bucket.wait_time())
+
+    async def _dispatch(self):
+        while self.depth:
+            self._wakeup.clear()
+            now = time.monotonic()
+            wait = None  # seconds until the next send is due; None: until a send in flight finishes
+            for chat_id in list(self._chats):
+                if chat_id in self._sending:
+                    continue
+                due = max(self._chat_wait(chat_id, now), self.bucket.wait_time(), self._paused_until - now)
+                if due > 0:
+                    wait = due if wait is None else min(wait, due)
+                    continue
+                self.bucket.take()
+                self._chat_buckets[chat_id].take()
+                message = self._chats[chat_id].popleft()
+                if not self._chats[chat_id]:
+                    del self._chats[chat_id]
+                self._sending.add(chat_id)
+                task = asyncio.ensure_future(self._send(message))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=wait)
+            except asyncio.TimeoutError:
+                pass
+        # Forget chats whose buckets have refilled
+        self._chat_buckets = {chat_id: bucket for chat_id, bucket in self._chat_buckets.items()
+                              if bucket.wait_time(bucket.capacity) > 0}
+
+    def _requeue(self, message: OutgoingMessage):
+        self.retried += 1
+        self._chats.setdefault(message.chat_id, deque()).appendleft(message)
+
+    async def _send(self, message: OutgoingMessage):
+        message.attempts += 1
+        try:
+            sent = await self.telegram_bot.send_message(
+                chat_id=message.chat_id, text=message.text, parse_mode='Markdown',
+                reply_markup=InlineKeyboardMarkup(message.rows) if message.rows else None
+            )
+        except RetryAfter as e:
+            # Telegram does not say whether the limit hit was the chat's or the bot's, so pause everything
+            logger.warning(f"Flood control: pausing sends for {e.retry_after}s")
+            metrics.inc('send_retry_after_total')
+            self._paused_until = max(self._paused_until, time.monotonic() + float(e.retry_after))
+            self._requeue(message)
+        except NetworkError as e:
+            if message.attempts < SEND_MAX_ATTEMPTS:
+                metrics.inc('send_retries_total')
+                self._requeue(message)
+            else:
+                self._fail(message, e)
+        except Exception as e:
+            self._fail(message, e)  # e.g. the user blocked the bot
+        else:
+            self._finish(message)
+            if message.future is not None and not message.future.done():
+                message.future.set_result(sent)
+        finally:
+            self._sending.discard(message.chat_id)
+            self._wakeup.set()
+
+    def _finish(self, message: OutgoingMessage):
+        now = time.monotonic()
+        self.depth -= 1
+        self.sent += 1
+        self._sent_at.append(now)
+        metrics.set_gauge('send_queue_depth', self.depth)
+        metrics.inc('messages_sent_total', kind='notification' if message.batchable else 'message')
+        metrics.observe('send_queue_wait_seconds', now - message.enqueued)
+
+    def _fail(self, message: OutgoingMessage, error: Exception):
+        self.depth -= 1
+        self.failed += 1
+        metrics.set_gauge('send_queue_depth', self.depth)
+        metrics.inc('send_failures_total')
+        logger.error(f"Error sending message to {message.chat_id}: {error}")
+        if message.future is not None and not message.future.done():
+            message.future.set_exception(error)
+
+    def drain_rate(self) -> float:
+        """Messages sent per second over the last minute"""
+        cutoff = time.monotonic() - 60
+        while self._sent_at and self._sent_at[0] < cutoff:
+            self._sent_at.popleft()
+        return len(self._sent_at) / 60
+
+    async def aclose(self, timeout: float = 10.0):
+        """Give queued messages up to timeout seconds to go out, then drop the rest"""
+        if self._dispatcher is not None and not self._dispatcher.done():
+            try:
+                await asyncio.wait_for(asyncio.shield(self._dispatcher), timeout)
+            except asyncio.TimeoutError:
+                logger.warning(f"Dropping {self.depth} unsent messages")
+                self._dispatcher.cancel()
+        for task in list(self._tasks):
+            task.cancel()
+
+    def stats(self) -> Dict:
+        """Queue depth, send counters and the drain rate"""
+        return {
+            'queued': self.depth,
+            'sent': self.sent,
+            'merged': self.merged,
+            'retried': self.retried,
+            'failed': self.failed,
+            'drain_per_second': round(self.drain_rate(), 2)
+        }
+
+def format_alert(stock_data: Dict) -> str:
+    """Notification text for a crossover"""
+    indicators = stock_data['indicators']
+    direction = "above" if indicators[f"cross_{ALERT_INDICATOR}"] > 0 else "below"
+    trend_emoji = "📈" if direction == "above" else "📉"
+    kind, _, window = ALERT_INDICATOR.partition('_')
+    return (
+        f"🔔 {trend_emoji} **{stock_data['symbol']} crossed {direction} its {window}-Week {kind.upper()}**\n\n"
+        f"💰 **Current Price:** ${stock_data['current_price']}\n"
+        f"📊 **{window}-Week {kind.upper()}:** ${indicators[ALERT_INDICATOR]}\n"
+        f"📊 **Difference:** {indicators[f'pct_{ALERT_INDICATOR}']:+.2f}%"
+    )
+
+async def scan_alerts(context: ContextTypes.DEFAULT_TYPE):
+    """Scheduled job: scan all watched symbols and notify subscribers of crossovers
+    
+    Alerts go out through the send queue, so a broadcast stays within
+    Telegram's flood limits and several alerts to one user arrive as one message.
+    """
+    for user_id, stock_data in await bot.scan_crossovers():
+        symbol = stock_data['symbol']
+        keyboard = [[InlineKeyboardButton(f"🔄 Refresh {symbol}", callback_data=f"price_{symbol}")]]
+        bot.outbox.notify(user_id, format_alert(stock_data), InlineKeyboardMarkup(keyboard))
+    bot.save_snapshot()
+
+def update_gauges():
+    """Copy current bot state into the gauges"""
+    cache = bot.cache.stats()
+    quota = bot.quota.stats()
+    metrics.set_gauge('cache_entries', cache['entries'])
+    metrics.set_gauge('cache_bytes', cache['bytes'])
+    metrics.set_gauge('quota_waiting', quota['waiting'])
+    metrics.set_gauge('quota_eta_seconds', quota['eta_interactive'], priority=PRIORITY_INTERACTIVE)
+    metrics.set_gauge('quota_eta_seconds', quota['eta_bulk'], priority=PRIORITY_BULK)
+    metrics.set_gauge('persistence_pending', bot.persistence.stats()['pending'])
+    if bot.outbox is not None:
+        metrics.set_gauge('send_drain_per_second', bot.outbox.stats()['drain_per_second'])
+    metrics.set_gauge('watchlist_users', len(bot.watchlists))
+    metrics.set_gauge('watched_symbols', len(bot.watchlists.symbols()))
+    metrics.set_gauge('uptime_seconds', round(time.perf_counter() - PROCESS_STARTED, 1))
+
+async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Admin-only summary of latencies, cache, quota and persistence"""
+    if update.effective_user.id not in ADMIN_USER_IDS:
+        await update.effective_message.reply_text("⛔ This command is only available to bot admins.")
+        return
+    
+    update_gauges()
+    cache = bot.cache.stats()
+    quota = bot.quota.stats()
+    persistence = bot.persistence.stats()
+    outbox = bot.outbox.stats()
+    lines = ["📊 **Bot Stats**", "", "⏱ **Latency** (count: p50 / p95 / p99 ms)"]
+    for label, count, p50, p95, p99 in metrics.summary()[:15]:
+        lines.append(f"`{label}` {count}: {p50:.0f} / {p95:.0f} / {p99:.0f}")
+    lines += [
+        "",
+        f"🗄 **Cache:** {cache['entries']} entries, {cache['hit_rate']:.0%} hit rate, {cache['evictions']} evictions",
+        f"🔀 **Coalesced fetches:** {bot.inflight.saved}",
+        f"🎟 **Quota:** {quota['granted']} granted, {quota['waiting']} waiting, "
+        f"{quota['rejected']} rejected, {quota['throttled']} throttled",
+        f"💾 **Persistence:** {persistence['flushes']} flushes, {persistence['flush_ms_avg']} ms avg, "
+        f"{persistence['coalesced_writes']} writes saved",
+        f"📤 **Send queue:** {outbox['queued']} queued, {outbox['sent']} sent ({outbox['drain_per_second']}/s), "
+        f"{outbox['merged']} merged, {outbox['retried']} retried, {outbox['failed']} failed",
+        f"👥 **Watchlists:** {len(bot.watchlists)} users, {len(bot.watchlists.symbols())} symbols",
+        f"🕒 **Uptime:** {format_eta(time.perf_counter() - PROCESS_STARTED)}"
+    ]
+    await update.effective_message.reply_text("\n".join(lines), parse_mode='Markdown')
+
+async def serve_metrics(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    """Answer a scrape of /metrics with the Prometheus text format"""
+    try:
+        request_line = await reader.readline()
+        while await reader.readline() not in (b'\r\n', b'\n', b''):
+            pass  # Headers are not needed
+        if request_line.split()[1:2] == [b'/metrics']:
+            if bot is not None:  # The webhook front process has routing counters but no bot
+                update_gauges()
+            status, body = "200 OK", metrics.render_prometheus().encode()
+        else:
+            status, body = "404 Not Found", b"Not found\n"
+        writer.write(f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4\r\n"
+                     f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+        await writer.drain()
+    except Exception as e:
+        logger.error(f"Error serving metrics: {e}")
+    finally:
+        writer.close()
+
+class TimedRequest(HTTPXRequest):
+    """Telegram Bot API requests, timed per API method so send latency shows up apart from upstream latency"""
+
+    async def do_request(self, url: str, method: str, *args, **kwargs):
+        with metrics.timer('telegram_request', method=url.rsplit('/', 1)[-1]):
+            return await super().do_request(url, method, *args, **kwargs)
+
+def instrumented(name: str, callback: Callable) -> Callable:
+    """Time a handler or job under handler=name and count the exceptions it raises"""
+    @functools.wraps(callback)
+    async def wrapper(*args):
+        try:
+            with metrics.timer('handler', handler=name):
+                return await callback(*args)
+        except Exception:
+            metrics.inc('handler_errors_total', handler=name)
+            raise
+    return wrapper
+
+async def startup(application: Application):
+    """Warm the data path and start the metrics endpoint before the first update is handled"""
+    timings = bot.warm_up()
+    if METRICS_PORT:
+        try:
+            bot.metrics_server = await asyncio.start_server(serve_metrics, METRICS_HOST, METRICS_PORT)
+        except OSError as e:
+            logger.error(f"Could not start metrics endpoint on {METRICS_HOST}:{METRICS_PORT}: {e}")
+    bot.outbox = SendQueue(application.bot)
+    bot.ready_at = time.perf_counter()
+    metrics.set_gauge('time_to_ready_seconds', round(bot.ready_at - PROCESS_STARTED, 3))
+    logger.info(f"Ready {bot.ready_at - PROCESS_STARTED:.2f}s after start: {timings}")
+
+async def log_first_reply(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Log time-to-first-reply once; runs after the handlers of the first update have answered it"""
+    if bot.first_reply_at is None:
+        bot.first_reply_at = time.perf_counter()
+        metrics.set_gauge('time_to_first_reply_seconds', round(bot.first_reply_at - PROCESS_STARTED, 3))
+        since_ready = f" ({bot.first_reply_at - bot.ready_at:.2f}s after ready)" if bot.ready_at else ""
+        logger.info(f"First reply {bot.first_reply_at - PROCESS_STARTED:.2f}s after start{since_ready}")
+
+async def stopping(application: Application):
+    """Send the notifications still queued while the Bot API connection is open"""
+    if bot.outbox is not None:
+        await bot.outbox.aclose()
+
+async def shutdown(application: Application):
+    """Write pending watchlist changes and the market snapshot, and release pooled HTTP connections"""
+    if bot.metrics_server is not None:
+        bot.metrics_server.close()
+    await bot.persistence.aclose()
+    bot.save_snapshot()
+    await bot.market_data.aclose()
+
+def build_application(token: str = BOT_TOKEN, request=None, updater: bool = True, jobs: bool = True) -> Application:
+    """The Application with every handler and job registered
+    
+    request replaces the Bot API transport. Webhook workers are fed by the
+    dispatcher instead of an updater, and only one of them runs the jobs.
+    """
+    # Concurrent updates keep one user's slow fetch from delaying everyone else, and let
+    # simultaneous requests for one symbol share a single fetch
+    builder = (
+        Application.builder()
+        .token(token)
+        .request(request or TimedRequest(connection_pool_size=256))
+        .concurrent_updates(True)
+        .post_init(startup)
+        .post_stop(stopping)
+        .post_shutdown(shutdown)
+    )
+    if not updater:
+        builder = builder.updater(None)
+    application = builder.build()
     
     # Add command handlers
-    application.add_handler(CommandHandler("start", start))
-    application.add_handler(CommandHandler("help", help_command))
-    application.add_handler(CommandHandler("add", add_stock))
-    application.add_handler(CommandHandler("remove", remove_stock))
-    application.add_handler(CommandHandler("list", list_watchlist))
-    application.add_handler(CommandHandler("price", get_price))
-    application.add_handler(CommandHandler("check", check_watchlist))
+    application.add_handler(CommandHandler("start", instrumented("start", start)))
+    application.add_handler(CommandHandler("help", instrumented("help", help_command)))
+    application.add_handler(CommandHandler("add", instrumented("add", add_stock)))
+    application.add_handler(CommandHandler("remove", instrumented("remove", remove_stock)))
+    application.add_handler(CommandHandler("list", instrumented("list", list_watchlist)))
+    application.add_handler(CommandHandler("price", instrumented("price", get_price)))
+    application.add_handler(CommandHandler("check", instrumented("check", check_watchlist)))
+    application.add_handler(CommandHandler("stats", instrumented("stats", stats_command)))
     
     # Add callback query handler for inline buttons
-    application.add_handler(CallbackQueryHandler(button_callback))
+    application.add_handler(CallbackQueryHandler(instrumented("button", button_callback)))
     
     # Add message handler for non-command messages
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, instrumented("message", handle_message)))
+    application.add_handler(TypeHandler(Update, log_first_reply), group=1)
+    
+    # Schedule crossover alerts
+    if jobs and application.job_queue is not None:
+        application.job_queue.run_repeating(instrumented("scan_alerts", scan_alerts), interval=ALERT_SCAN_INTERVAL, first=60)
+    elif jobs:
+        logger.warning("JobQueue unavailable (install python-telegram-bot[job-queue]); crossover alerts are disabled")
+    return application
+
+def user_of(data: Dict) -> int:
+    """User (or, for channel posts, chat) id an update comes from, for routing it to a worker
+    
+    Watchlists are keyed by user, so a user's updates from any chat must
+    reach the worker that holds their watchlist edits.
+    """
+    for field, payload in data.items():
+        if field == 'update_id' or not isinstance(payload, dict):
+            continue
+        user = payload.get('from') or payload.get('user')
+        if user:
+            return user['id']
+        chat = payload.get('chat') or (payload.get('message') or {}).get('chat')
+        if chat:
+            return chat['id']
+    return 0
+
+class WebhookDispatcher:
+    """Front process of webhook mode: accepts Telegram's webhook POSTs and routes each user to one worker
+    
+    Pinning a user to a worker keeps their updates in order and their watchlist
+    edits in one process. Updates are passed on as raw JSON over a pipe.
+    """
+
+    def __init__(self, connections: List, secret: str, path: str = WEBHOOK_PATH):
+        if not secret:
+            raise ValueError("The webhook needs a secret token, or anyone could post updates to it")
+        self.connections = connections
+        self.secret = secret.encode()
+        self.path = path
+        self.routed = [0] * len(connections)
+        # Pipe writes block once a busy worker's pipe is full; one thread per worker keeps them
+        # off the event loop and in order
+        self.senders = [ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"webhook-worker-{index}")
+                        for index in range(len(connections))]
+
+    def route(self, data: Dict) -> int:
+        return user_of(data) % len(self.connections)
+
+    def close(self):
+        """Wait for updates still being passed on; the connections are the caller's to close"""
+        for sender in self.senders:
+            sender.shutdown()
+
+    async def _read_head(self, reader: asyncio.StreamReader) -> Optional[tuple]:
+        """(method, target, headers) of the next request, or None once the client has closed the connection"""
+        request_line = await reader.readline()
+        if not request_line:
+            return None
+        headers = {}
+        while (line := await reader.readline()) not in (b'\r\n', b'\n', b''):
+            if len(headers) >= WEBHOOK_MAX_HEADERS:
+                raise ValueError("Too many request headers")
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        method, target = (request_line.split() + [b'', b''])[:2]
+        return method, target.decode('latin-1'), headers
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Serve keep-alive HTTP/1.1 requests on one connection
+        
+        The path, secret token and size are checked before the body is read,
+        so a stranger cannot make the front process buffer a large upload.
+        """
+        try:
+            while True:
+                head = await asyncio.wait_for(self._read_head(reader), WEBHOOK_READ_TIMEOUT)
+                if head is None:
+                    break
+                method, target, headers = head
+                length = headers.get('content-length', '0')
+                if method != b'POST' or target != self.path:
+                    status = "404 Not Found"
+                elif not hmac.compare_digest(headers.get('x-telegram-bot-api-secret-token', '').encode(), self.secret):
+                    status = "403 Forbidden"
+                elif not length.isdigit():
+                    status = "400 Bad Request"
+                elif int(length) > WEBHOOK_MAX_BODY:
+                    status = "413 Payload Too Large"
+                else:
+                    body = await asyncio.wait_for(reader.readexactly(int(length)), WEBHOOK_READ_TIMEOUT)
+                    status = "200 OK"
+                    try:
+                        worker = self.route(json.loads(body))
+                        await asyncio.get_running_loop().run_in_executor(
+                            self.senders[worker], self.connections[worker].send_bytes, body)
+                        self.routed[worker] += 1
+                        metrics.inc('webhook_updates_total', worker=worker)
+                    except ValueError:
+                        status = "400 Bad Request"
+                    writer.write(f"HTTP/1.1 {status}\r\nContent-Length: 0\r\n\r\n".encode())
+                    await writer.drain()
+                    continue
+                # The body was never read, so the connection cannot carry another request
+                writer.write(f"HTTP/1.1 {status}\r\nContent-Length: 0\r\nConnection: close\r\n\r\n".encode())
+                await writer.drain()
+                break
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.TimeoutError, ValueError):
+            pass  # The client went away, stalled or sent an oversized head
+        except Exception as e:
+            logger.error(f"Error handling webhook request: {e}")
+        finally:
+            writer.close()
+
+def run_worker(index: int, workers: int, connection, run_jobs: bool = False, bot_options: Optional[Dict] = None,
+               setup: Optional[Callable] = None):
+    """Entry point of a webhook worker process"""
+    asyncio.run(serve_worker(index, workers, connection, run_jobs, bot_options, setup))
+
+async def serve_worker(index: int, workers: int, connection, run_jobs: bool = False,
+                       bot_options: Optional[Dict] = None, setup: Optional[Callable] = None):
+    """Process the updates the dispatcher sends over connection until it is closed
+    
+    setup(bot), if given, may adjust the bot and return the Bot API request
+    object to use, which is how tests swap in local stand-ins. When done, the
+    worker sends its stats back over the connection.
+    """
+    global bot, METRICS_PORT
+    bot = StockWatcherBot(**{'shared_cache_file': SHARED_CACHE_FILE, **(bot_options or {})})
+    # The API key's quota is split between the workers rather than granted to each of them
+    bot.quota = QuotaScheduler(per_minute=max(1, API_CALLS_PER_MINUTE // workers),
+                               per_day=max(1, API_CALLS_PER_DAY // workers))
+    bot.alpha_vantage.quota = bot.quota
+    # Only one worker saves the snapshot; the shared cache gives it every worker's entries
+    bot.snapshot_writer = run_jobs
+    request = setup(bot) if setup else None
+    if METRICS_PORT:
+        METRICS_PORT += 1 + index  # The front process keeps METRICS_PORT for itself
+    application = build_application(request=request, updater=False, jobs=run_jobs)
+    await application.initialize()
+    await application.post_init(application)
+    await application.start()
+    connection.send({'worker': index, 'ready': True})
+    
+    loop = asyncio.get_running_loop()
+    processed = 0
+    while True:
+        try:
+            data = await loop.run_in_executor(None, connection.recv_bytes)
+        except (EOFError, OSError):
+            break  # The dispatcher went away
+        if not data:
+            break  # Asked to stop
+        try:
+            await application.update_queue.put(Update.de_json(json.loads(data), application.bot))
+            processed += 1
+        except Exception as e:
+            logger.error(f"Worker {index} could not read an update: {e}")
+    
+    await application.stop()  # Finishes the updates already queued
+    await application.post_stop(application)
+    await application.post_shutdown(application)
+    await application.shutdown()
+    connection.send({
+        'worker': index,
+        'updates': processed,
+        'errors': sum(value for (name, _), value in metrics.counters.items() if name == 'handler_errors_total'),
+        'cache': bot.cache.stats(),
+        'handlers': {dict(labels)['handler']: histogram for (name, labels), histogram in metrics.histograms.items()
+                     if name == 'handler_seconds'}
+    })
+    connection.close()
+
+def start_workers(count: int = WEBHOOK_WORKERS, bot_options: Optional[Dict] = None,
+                  setup: Optional[Callable] = None) -> tuple:
+    """Spawn worker processes and wait until they are ready
+    
+    Returns (processes, dispatcher-side connections). Worker 0 runs the alert job.
+    """
+    context = multiprocessing.get_context('spawn')
+    processes, connections = [], []
+    for index in range(count):
+        ours, theirs = context.Pipe()
+        process = context.Process(target=run_worker, args=(index, count, theirs, index == 0, bot_options, setup),
+                                  name=f"stockwatch-worker-{index}")
+        process.start()
+        theirs.close()
+        processes.append(process)
+        connections.append(ours)
+    for index, connection in enumerate(connections):
+        try:
+            connection.recv()  # Ready once its Application has started
+        except EOFError:
+            raise RuntimeError(f"Webhook worker {index} failed to start") from None
+    return processes, connections
+
+def stop_workers(processes: List, connections: List) -> List[Dict]:
+    """Ask the workers to drain and exit; returns the stats each one sent back
+    
+    Worker 0 saves the market snapshot, so it stops last, once the quotes
+    fetched by the others are all in the shared cache.
+    """
+    stats = []
+    for group in (connections[1:], connections[:1]):
+        for connection in group:
+            connection.send_bytes(b'')
+        for connection in group:
+            try:
+                stats.append(connection.recv())
+            except EOFError:
+                pass  # The worker died; its exit code tells the rest
+            connection.close()
+    for process in processes:
+        process.join()
+    return stats
+
+async def serve_webhook():
+    """Front process: register the webhook with Telegram, then route updates to the workers until interrupted"""
+    if WATCHLIST_BACKEND != 'sqlite' and WEBHOOK_WORKERS > 1:
+        raise SystemExit("Webhook mode with several workers needs WATCHLIST_BACKEND = 'sqlite'")
+    secret = WEBHOOK_SECRET
+    if not secret:
+        if not WEBHOOK_URL:
+            raise SystemExit("Webhook mode needs WEBHOOK_SECRET, or WEBHOOK_URL so that one can be registered")
+        secret = secrets.token_urlsafe(32)  # Registered below, so only Telegram knows it
+    if WATCHLIST_BACKEND == 'sqlite':
+        # Import a JSON watchlist file once, here, rather than in every worker at the same time
+        storage = SqliteWatchlistStorage(DATABASE_FILE)
+        if storage.is_empty() and os.path.exists(WATCHLIST_FILE):
+            migrate_watchlists(WATCHLIST_FILE, storage)
+        storage.conn.close()
+    processes, connections = start_workers()
+    dispatcher = WebhookDispatcher(connections, secret)
+    server = await asyncio.start_server(dispatcher.handle, WEBHOOK_LISTEN, WEBHOOK_PORT)
+    metrics_server = None
+    if METRICS_PORT:
+        try:
+            # Routing counts per worker; the workers serve theirs on the ports after it
+            metrics_server = await asyncio.start_server(serve_metrics, METRICS_HOST, METRICS_PORT)
+        except OSError as e:
+            logger.error(f"Could not start metrics endpoint on {METRICS_HOST}:{METRICS_PORT}: {e}")
+    if WEBHOOK_URL:
+        telegram_bot = Bot(BOT_TOKEN)
+        async with telegram_bot:
+            await telegram_bot.set_webhook(WEBHOOK_URL, secret_token=secret, allowed_updates=Update.ALL_TYPES)
+    logger.info(f"Webhook listening on {WEBHOOK_LISTEN}:{WEBHOOK_PORT}{WEBHOOK_PATH} with {len(processes)} workers")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        if metrics_server is not None:
+            metrics_server.close()
+        dispatcher.close()
+        stop_workers(processes, connections)
+
+def main():
+    """Start the bot"""
+    if RUN_MODE == 'webhook':
+        print(f"🚀 Stock Watcher Bot is starting {WEBHOOK_WORKERS} webhook workers...")
+        asyncio.run(serve_webhook())
+        return
+    
+    global bot
+    bot = StockWatcherBot()
+    application = build_application()
     
     # Start the bot
     print("🚀 Stock Watcher Bot is starting...")
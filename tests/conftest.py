@@ -0,0 +1,30 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import stockwatch  # noqa: E402
+
+
+@pytest.fixture
+def make_bot(tmp_path):
+    """Factory for StockWatcherBots whose files all live under tmp_path"""
+    bots = []
+
+    def factory(**files) -> stockwatch.StockWatcherBot:
+        bot = stockwatch.StockWatcherBot(**{
+            'database_file': str(tmp_path / 'stock_watchlist.db'),
+            'watchlist_file': str(tmp_path / 'user_watchlists.json'),
+            'history_dir': None,
+            'listing_file': None,
+            'snapshot_file': None,
+            **files
+        })
+        bots.append(bot)
+        return bot
+
+    yield factory
+    for bot in bots:
+        bot.persistence.flush()
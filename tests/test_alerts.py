@@ -0,0 +1,69 @@
+import asyncio
+from datetime import datetime
+
+import stockwatch
+
+NEW_YORK = stockwatch.MARKET_TIMEZONE
+
+
+def frozen_datetime(now: datetime):
+    class FrozenDatetime(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return now.astimezone(tz) if tz else now.replace(tzinfo=None)
+    return FrozenDatetime
+
+
+def crossed_above(symbol: str) -> dict:
+    return {
+        'symbol': symbol,
+        'current_price': 110.0,
+        'indicators': {'sma_45': 98.0, stockwatch.ALERT_INDICATOR: 100.0, f"cross_{stockwatch.ALERT_INDICATOR}": 1}
+    }
+
+
+def test_latest_bar_date_is_stable_across_the_friday_close():
+    thursday = datetime(2026, 10, 15, 12, 0, tzinfo=NEW_YORK)
+    friday_evening = datetime(2026, 10, 16, 17, 0, tzinfo=NEW_YORK)
+    saturday = datetime(2026, 10, 17, 12, 0, tzinfo=NEW_YORK)
+    next_thursday = datetime(2026, 10, 22, 12, 0, tzinfo=NEW_YORK)
+    days = {stockwatch.latest_bar_date(now).isoformat() for now in (thursday, friday_evening, saturday)}
+    assert days == {'2026-10-16'}
+    assert stockwatch.latest_bar_date(next_thursday).isoformat() == '2026-10-23'
+
+
+def test_crossing_is_alerted_once_across_the_friday_close(make_bot, monkeypatch):
+    bot = make_bot()
+    bot.add_to_watchlist(42, 'SPY')
+
+    async def get_stock_prices(symbols, *args, **kwargs):
+        return [crossed_above(symbol) for symbol in symbols]
+
+    monkeypatch.setattr(bot, 'get_stock_prices', get_stock_prices)
+    sent = []
+    # Thursday the forming bar crosses; Friday evening and Saturday see the same bar, now closed
+    for now in (datetime(2026, 10, 15, 12, 0), datetime(2026, 10, 16, 17, 0), datetime(2026, 10, 17, 12, 0)):
+        monkeypatch.setattr(stockwatch, 'datetime', frozen_datetime(now.replace(tzinfo=NEW_YORK)))
+        sent += asyncio.run(bot.scan_crossovers())
+    assert [(user_id, data['symbol']) for user_id, data in sent] == [(42, 'SPY')]
+
+    # A crossing on next week's bar is a new alert
+    monkeypatch.setattr(stockwatch, 'datetime', frozen_datetime(datetime(2026, 10, 22, 12, 0, tzinfo=NEW_YORK)))
+    assert len(asyncio.run(bot.scan_crossovers())) == 1
+
+
+def test_alert_records_each_average_in_its_own_column(make_bot, tmp_path):
+    # An alerts table created before the crossed average had a column of its own
+    conn = stockwatch.open_database(str(tmp_path / 'stock_watchlist.db'))
+    conn.execute("CREATE TABLE alerts (user_id INTEGER, symbol TEXT, alert_date TEXT, price REAL, ma_45 REAL, "
+                 "PRIMARY KEY (user_id, symbol, alert_date))")
+    conn.commit()
+    bot = make_bot()
+    bot.add_to_watchlist(42, 'SPY')
+
+    async def get_stock_prices(symbols, *args, **kwargs):
+        return [crossed_above(symbol) for symbol in symbols]
+
+    bot.get_stock_prices = get_stock_prices
+    assert len(asyncio.run(bot.scan_crossovers())) == 1
+    assert conn.execute("SELECT price, ma_45, crossed_ma FROM alerts").fetchall() == [(110.0, 98.0, 100.0)]
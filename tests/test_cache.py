@@ -0,0 +1,46 @@
+import stockwatch
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_entries_expire_after_their_kind_ttl(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(stockwatch.time, 'monotonic', clock)
+    cache = stockwatch.QuoteCache({'quote': 60, 'snapshot': lambda: 600})
+    cache.set('quote', 'SPY', 1.0)
+    cache.set('snapshot', 'SPY', {'price': 1.0})
+    cache.set('quote', 'QQQ', 2.0, ttl=5)
+    clock.now += 30
+    assert cache.get('quote', 'SPY') == 1.0
+    assert cache.get('quote', 'QQQ') is None
+    clock.now += 30
+    assert cache.get('quote', 'SPY') is None
+    assert cache.get('snapshot', 'SPY') == {'price': 1.0}
+    assert cache.stats()['entries'] == 1  # expired entries are dropped when looked up
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = stockwatch.QuoteCache({'quote': 60}, max_entries=2)
+    cache.set('quote', 'SPY', 1.0)
+    cache.set('quote', 'QQQ', 2.0)
+    cache.get('quote', 'SPY')
+    cache.set('quote', 'DIA', 3.0)
+    assert cache.get('quote', 'QQQ') is None
+    assert cache.get('quote', 'SPY') == 1.0 and cache.get('quote', 'DIA') == 3.0
+    assert cache.stats()['evictions'] == 1
+
+
+def test_byte_budget_evicts_and_tracks_replacements():
+    cache = stockwatch.QuoteCache({'snapshot': 60}, max_bytes=2 * stockwatch._estimate_size({'close': 'x' * 100}))
+    for symbol in ('SPY', 'QQQ', 'SPY'):
+        cache.set('snapshot', symbol, {'close': 'x' * 100})
+    assert cache.stats()['entries'] == 2 and cache.stats()['evictions'] == 0
+    cache.set('snapshot', 'DIA', {'close': 'x' * 100})
+    assert cache.get('snapshot', 'QQQ') is None  # SPY was written again after QQQ
+    assert cache.stats()['bytes'] <= cache.max_bytes
@@ -0,0 +1,144 @@
+import os
+from array import array
+from datetime import date
+
+import pytest
+
+import stockwatch
+
+FIRST = date(2020, 1, 3).toordinal()
+
+
+def bars(start: int, count: int, offset: float = 0.0) -> list:
+    """count weekly (day, open, high, low, close) bars from start; the close is offset + position"""
+    return [(start + 7 * i, 1.0, 2.0, 0.5, offset + i) for i in range(count)]
+
+
+def test_append_and_reload(tmp_path):
+    store = stockwatch.HistoryStore(str(tmp_path))
+    before = store.append('SPY', bars(FIRST, 3))
+    after = store.append('SPY', bars(FIRST + 21, 2, offset=3))
+    assert len(before) == 3  # earlier histories do not change
+    reloaded = stockwatch.HistoryStore(str(tmp_path)).get('SPY')
+    assert list(reloaded.dates) == list(after.dates) == [FIRST + 7 * i for i in range(5)]
+    assert list(reloaded.closes) == [0.0, 1.0, 2.0, 3.0, 4.0]
+    assert list(reloaded.highs) == [2.0] * 5
+
+
+def test_windows_share_memory(tmp_path):
+    np = pytest.importorskip('numpy')
+    history = stockwatch.HistoryStore(str(tmp_path)).append('SPY', bars(FIRST, 60))
+    window = history.tail(52)
+    assert list(window) == [float(i) for i in range(8, 60)]
+    assert np.shares_memory(np.frombuffer(window, dtype=float), np.frombuffer(history.closes, dtype=float))
+    year = history.between(date(2020, 1, 1), date(2020, 12, 31))
+    assert date.fromordinal(year.dates[0]) == date(2020, 1, 3) and date.fromordinal(year.dates[-1]) == date(2020, 12, 25)
+
+
+def test_torn_first_append_leaves_no_stale_values(tmp_path):
+    # A crash after the value columns of the first batch were written, before its dates
+    for field in stockwatch.WeeklyHistory.FIELDS:
+        with open(tmp_path / f"SPY.{field}", 'wb') as f:
+            array('d', [111.0, 222.0]).tofile(f)
+    store = stockwatch.HistoryStore(str(tmp_path))
+    assert len(store.get('SPY')) == 0
+    store.append('SPY', bars(FIRST, 3))
+    assert list(stockwatch.HistoryStore(str(tmp_path)).get('SPY').closes) == [0.0, 1.0, 2.0]
+
+
+def test_torn_append_is_cut_back(tmp_path):
+    stockwatch.HistoryStore(str(tmp_path)).append('SPY', bars(FIRST, 2))
+    with open(tmp_path / 'SPY.closes', 'ab') as f:
+        f.write(b'\0' * 12)  # one whole stray close and half of another
+    history = stockwatch.HistoryStore(str(tmp_path)).get('SPY')
+    assert list(history.closes) == [0.0, 1.0]
+    assert os.path.getsize(tmp_path / 'SPY.closes') == 16
+
+
+def test_stores_sharing_a_directory_append_each_week_once(tmp_path):
+    # Two worker processes fetched the same weeks; the second only appends the one it adds
+    first, second = stockwatch.HistoryStore(str(tmp_path)), stockwatch.HistoryStore(str(tmp_path))
+    first.get('SPY'), second.get('SPY')
+    first.append('SPY', bars(FIRST, 3))
+    history = second.append('SPY', bars(FIRST, 4))
+    assert list(history.dates) == [FIRST + 7 * i for i in range(4)]
+    assert os.path.getsize(tmp_path / 'SPY.dates') == 4 * 4
+    assert os.path.getsize(tmp_path / 'SPY.closes') == 4 * 8
+
+
+def test_repeated_weeks_are_dropped_on_load(tmp_path):
+    # Written without the lock: a batch of two weeks stored twice, then the next week
+    days = [FIRST, FIRST + 7, FIRST, FIRST + 7, FIRST + 14]
+    with open(tmp_path / 'SPY.dates', 'wb') as f:
+        array('i', days).tofile(f)
+    for field in stockwatch.WeeklyHistory.FIELDS:
+        with open(tmp_path / f"SPY.{field}", 'wb') as f:
+            array('d', range(len(days))).tofile(f)
+    history = stockwatch.HistoryStore(str(tmp_path)).get('SPY')
+    assert list(history.dates) == [FIRST, FIRST + 7, FIRST + 14]
+    assert list(history.closes) == [0.0, 1.0, 4.0]
+
+
+def test_history_without_ohlc_is_padded(tmp_path):
+    with open(tmp_path / 'SPY.dates', 'wb') as f:
+        array('i', [FIRST, FIRST + 7]).tofile(f)
+    with open(tmp_path / 'SPY.closes', 'wb') as f:
+        array('d', [10.0, 11.0]).tofile(f)
+    store = stockwatch.HistoryStore(str(tmp_path))
+    history = store.append('SPY', bars(FIRST + 14, 1, offset=12))
+    assert list(history.closes) == [10.0, 11.0, 12.0]
+    assert [value != value for value in history.opens] == [True, True, False]  # NaN for the old weeks
+
+
+def test_loaded_histories_hold_no_file_descriptors(tmp_path):
+    resource = pytest.importorskip('resource')
+    store = stockwatch.HistoryStore(str(tmp_path))
+    symbols = [f"SYM{i}" for i in range(300)]
+    for symbol in symbols:
+        store.append(symbol, bars(FIRST, 60))
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    open_fds = len(os.listdir('/proc/self/fd')) if os.path.isdir('/proc/self/fd') else 64
+    resource.setrlimit(resource.RLIMIT_NOFILE, (open_fds + 32, hard))
+    try:
+        reader = stockwatch.HistoryStore(str(tmp_path))
+        histories = [reader.get(symbol) for symbol in symbols]  # all held at once, as in one /check
+        with open(os.devnull) as f:  # descriptors are still available afterwards
+            assert f.readable()
+    finally:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (soft, hard))
+    assert all(len(history) == 60 for history in histories)
+
+
+def test_ma_crossings_match_a_direct_count(tmp_path):
+    pytest.importorskip('numpy')
+    import math
+    closes = [100 + 20 * math.sin(i / 15) for i in range(300)]
+    history = stockwatch.HistoryStore(None).append('SPY', [(FIRST + 7 * i, c, c, c, c) for i, c in enumerate(closes)])
+    expected = []
+    previous = None
+    for t in range(51, len(closes)):
+        above = closes[t] > sum(closes[t - 51:t + 1]) / 52
+        if previous is not None and above != previous:
+            expected.append((date.fromordinal(FIRST + 7 * t), 1 if above else -1))
+        previous = above
+    assert stockwatch.ma_crossings(history, 52) == expected and expected
+
+
+def test_price_matrix_aligns_windows_on_the_forming_bar():
+    np = pytest.importorskip('numpy')
+    matrix = stockwatch.price_matrix({'SPY': np.array([1.0, 2.0, 3.0]), 'NEW': np.empty(0), 'QQQ': np.array([5.0])},
+                                     forming={'SPY': 4.0, 'NEW': 8.0, 'QQQ': 6.0})
+    assert matrix['SPY'].tolist() == [1.0, 2.0, 3.0, 4.0]
+    assert matrix['QQQ'].tolist()[2:] == [5.0, 6.0] and matrix['NEW'].tolist()[3] == 8.0
+
+
+def test_analyze_averages_the_stored_window(make_bot, tmp_path, monkeypatch):
+    pytest.importorskip('pandas')
+    bot = make_bot(history_dir=str(tmp_path / 'history'))
+    history = bot.history.append('SPY', bars(FIRST, 60))
+    monkeypatch.setattr(stockwatch, 'weekly_bar_open', lambda now=None: False)
+    result = bot.analyze({'SPY': (100.0, history)})['SPY']
+    assert result['ma_52_week'] == round(sum(range(8, 60)) / 52, 2)
+    monkeypatch.setattr(stockwatch, 'weekly_bar_open', lambda now=None: True)
+    result = bot.analyze({'SPY': (100.0, history)})['SPY']
+    assert result['ma_52_week'] == round((sum(range(9, 60)) + 100.0) / 52, 2)
@@ -0,0 +1,73 @@
+import asyncio
+
+import pytest
+
+import stockwatch
+
+
+class SimulatedClock:
+    """Virtual time for QuotaScheduler: sleeping advances the clock instantly"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+    async def sleep(self, seconds: float):
+        await asyncio.sleep(0)  # Let tasks woken at the current time run first
+        self.now += seconds
+        await asyncio.sleep(0)
+
+
+def scheduler(per_minute: int = 5, per_day: int = 500):
+    clock = SimulatedClock()
+    return clock, stockwatch.QuotaScheduler(per_minute, per_day, clock=clock, sleep=clock.sleep)
+
+
+def test_interactive_requests_overtake_queued_bulk_work():
+    async def scenario():
+        clock, quota = scheduler()
+        order = []
+
+        async def request(name: str, priority: int):
+            await quota.acquire(priority)
+            order.append(name)
+
+        tasks = [asyncio.create_task(request(f"bulk-{i}", stockwatch.PRIORITY_BULK)) for i in range(8)]
+        await asyncio.sleep(0)
+        tasks.append(asyncio.create_task(request('price', stockwatch.PRIORITY_INTERACTIVE)))
+        await asyncio.gather(*tasks)
+        return clock.now, order
+
+    elapsed, order = asyncio.run(scenario())
+    assert order == [f"bulk-{i}" for i in range(5)] + ['price'] + [f"bulk-{i}" for i in range(5, 8)]
+    assert elapsed == pytest.approx(4 * 60 / 5)  # four calls over the burst, at 5 a minute
+
+
+def test_request_over_the_daily_quota_gets_an_eta():
+    async def scenario():
+        clock, quota = scheduler(per_minute=5, per_day=5)
+        for _ in range(5):
+            await quota.acquire()
+        with pytest.raises(stockwatch.QuotaExceeded) as error:
+            await quota.acquire(stockwatch.PRIORITY_INTERACTIVE, max_wait=stockwatch.QUOTA_MAX_WAIT)
+        return error.value.eta, quota.rejected
+
+    eta, rejected = asyncio.run(scenario())
+    assert eta > stockwatch.QUOTA_MAX_WAIT and rejected == 1
+
+
+def test_cancelled_waiters_do_not_consume_quota():
+    async def scenario():
+        clock, quota = scheduler()
+        for _ in range(5):
+            await quota.acquire()
+        waiter = asyncio.create_task(quota.acquire())
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        await quota.acquire()
+        return quota.granted
+
+    assert asyncio.run(scenario()) == 6
@@ -0,0 +1,93 @@
+import asyncio
+import time
+
+import pytest
+from telegram.error import NetworkError, RetryAfter
+
+import stockwatch
+
+
+class StubBot:
+    """Telegram bot whose send_message raises the queued errors first, then records what it sends"""
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.sent = []  # (seconds since creation, chat_id, text)
+        self.started = time.monotonic()
+
+    async def send_message(self, chat_id, text, parse_mode=None, reply_markup=None):
+        await asyncio.sleep(0)
+        if self.errors:
+            raise self.errors.pop(0)
+        self.sent.append((time.monotonic() - self.started, chat_id, text))
+        return text
+
+
+def queue(telegram_bot) -> stockwatch.SendQueue:
+    return stockwatch.SendQueue(telegram_bot, rate=1000, per_chat_rate=1000, per_chat_burst=100, batch_window=0.01)
+
+
+def test_retry_after_requeues_the_message_in_order():
+    telegram_bot = StubBot(RetryAfter(1))
+
+    async def scenario():
+        outbox = queue(telegram_bot)
+        first = asyncio.create_task(outbox.send(1, 'first'))
+        await asyncio.sleep(0)
+        second = asyncio.create_task(outbox.send(1, 'second'))
+        results = await asyncio.gather(first, second)
+        await outbox.aclose()
+        return results, outbox.stats()
+
+    results, stats = asyncio.run(scenario())
+    assert results == ['first', 'second']
+    assert [(chat_id, text) for _, chat_id, text in telegram_bot.sent] == [(1, 'first'), (1, 'second')]
+    assert telegram_bot.sent[0][0] >= 1  # waited out the retry_after
+    assert stats['retried'] == 1 and stats['sent'] == 2 and stats['failed'] == 0
+
+
+def test_retry_after_pauses_every_chat():
+    telegram_bot = StubBot(RetryAfter(1))
+
+    async def scenario():
+        outbox = queue(telegram_bot)
+        first = asyncio.create_task(outbox.send(1, 'first'))
+        await asyncio.sleep(0.05)  # Telegram has answered with the RetryAfter
+        await outbox.send(2, 'other chat')
+        await first
+        await outbox.aclose()
+
+    asyncio.run(scenario())
+    assert all(at >= 1 for at, _, _ in telegram_bot.sent)
+
+
+def test_network_errors_give_up_after_the_attempt_limit():
+    telegram_bot = StubBot(*(NetworkError('down') for _ in range(stockwatch.SEND_MAX_ATTEMPTS)))
+
+    async def scenario():
+        outbox = queue(telegram_bot)
+        with pytest.raises(NetworkError):
+            await outbox.send(1, 'lost')
+        await outbox.aclose()
+        return outbox.stats()
+
+    stats = asyncio.run(scenario())
+    assert not telegram_bot.sent
+    assert stats['failed'] == 1 and stats['retried'] == stockwatch.SEND_MAX_ATTEMPTS - 1
+
+
+def test_waiting_notifications_to_a_chat_are_merged():
+    telegram_bot = StubBot()
+
+    async def scenario():
+        outbox = queue(telegram_bot)
+        for text in ('SPY crossed', 'QQQ crossed'):
+            outbox.notify(1, text)
+        outbox.notify(2, 'DIA crossed')
+        await outbox.aclose()
+        return outbox.stats()
+
+    stats = asyncio.run(scenario())
+    assert sorted((chat_id, text) for _, chat_id, text in telegram_bot.sent) == [
+        (1, 'SPY crossed\n\nQQQ crossed'), (2, 'DIA crossed')]
+    assert stats['merged'] == 1 and stats['sent'] == 2
@@ -0,0 +1,38 @@
+import asyncio
+import time
+
+import stockwatch
+
+
+def test_waiting_worker_joins_a_fetch_that_queues_for_quota(make_bot, tmp_path):
+    cache_file = str(tmp_path / 'quote_cache.db')
+    holder, waiter = make_bot(shared_cache_file=cache_file), make_bot(shared_cache_file=cache_file)
+    waiter.cache.owner = holder.cache.owner + 1  # as if it were another worker process
+    loads = []
+
+    async def scenario():
+        fetching, quota = asyncio.Event(), asyncio.Event()
+
+        async def slow_load():
+            loads.append('holder')
+            fetching.set()
+            await quota.wait()  # queued behind the per-minute quota
+            holder.cache.set('quote', 'SPY', 123.0)
+            return 123.0
+
+        async def load():
+            loads.append('waiter')
+            return 0.0
+
+        owner = asyncio.create_task(holder._shared_fetch('quote:SPY', lambda: holder.cache.get('quote', 'SPY'), slow_load))
+        await fetching.wait()
+        (expires_at,) = holder.cache.conn.execute("SELECT expires_at FROM fetch_leases").fetchone()
+        assert expires_at - time.time() > 2 * stockwatch.QUOTA_MAX_WAIT  # covers two waits for quota
+        joined = asyncio.create_task(waiter._shared_fetch('quote:SPY', lambda: waiter.cache.get('quote', 'SPY'), load))
+        await asyncio.sleep(0.2)
+        assert not joined.done()
+        quota.set()
+        return await owner, await joined
+
+    assert asyncio.run(scenario()) == (123.0, 123.0)
+    assert loads == ['holder']
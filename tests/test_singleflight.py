@@ -0,0 +1,101 @@
+import asyncio
+
+import stockwatch
+
+
+class Upstream:
+    """A fetch that blocks until released and counts how often it started"""
+
+    def __init__(self):
+        self.calls = 0
+        self.release = asyncio.Event()
+        self.cancelled = False
+
+    async def fetch(self):
+        self.calls += 1
+        try:
+            await self.release.wait()
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+        return 42
+
+
+def test_concurrent_callers_share_one_call():
+    async def scenario():
+        flight, upstream = stockwatch.SingleFlight(), Upstream()
+        callers = [asyncio.create_task(flight.do('SPY', upstream.fetch)) for _ in range(5)]
+        await asyncio.sleep(0)
+        upstream.release.set()
+        return await asyncio.gather(*callers), upstream.calls, flight.stats()
+
+    results, calls, stats = asyncio.run(scenario())
+    assert results == [42] * 5 and calls == 1
+    assert stats == {'calls': 1, 'saved': 4, 'in_flight': 0}
+
+
+def test_cancelling_one_caller_keeps_the_call_for_the_others():
+    async def scenario():
+        flight, upstream = stockwatch.SingleFlight(), Upstream()
+        leaving, staying = (asyncio.create_task(flight.do('SPY', upstream.fetch)) for _ in range(2))
+        await asyncio.sleep(0)
+        leaving.cancel()
+        await asyncio.gather(leaving, return_exceptions=True)
+        upstream.release.set()
+        return await staying, upstream
+
+    result, upstream = asyncio.run(scenario())
+    assert result == 42 and not upstream.cancelled
+
+
+def test_call_is_cancelled_when_every_caller_leaves():
+    async def scenario():
+        flight, upstream = stockwatch.SingleFlight(), Upstream()
+        callers = [asyncio.create_task(flight.do('SPY', upstream.fetch)) for _ in range(2)]
+        await asyncio.sleep(0)
+        for caller in callers:
+            caller.cancel()
+        await asyncio.gather(*callers, return_exceptions=True)
+        await asyncio.sleep(0)
+        return upstream, flight.stats()['in_flight']
+
+    upstream, in_flight = asyncio.run(scenario())
+    assert upstream.cancelled and in_flight == 0
+
+
+def test_errors_reach_every_caller_and_are_not_cached():
+    async def scenario():
+        flight = stockwatch.SingleFlight()
+
+        async def failing():
+            await asyncio.sleep(0)
+            raise RuntimeError("upstream down")
+
+        results = await asyncio.gather(*(flight.do('SPY', failing) for _ in range(3)), return_exceptions=True)
+        return results, await flight.do('SPY', lambda: asyncio.sleep(0, result=7))
+
+    results, retried = asyncio.run(scenario())
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert retried == 7
+
+
+def test_do_many_joins_keys_already_in_flight():
+    async def scenario():
+        flight, upstream = stockwatch.SingleFlight(), Upstream()
+        batches = []
+
+        async def load(keys):
+            batches.append(keys)
+            return {key: key.lower() for key in keys}
+
+        single = asyncio.create_task(flight.do('SPY', upstream.fetch))
+        await asyncio.sleep(0)
+        many = asyncio.create_task(flight.do_many(['SPY', 'QQQ', 'DIA', 'QQQ'], load))
+        await asyncio.sleep(0)
+        upstream.release.set()
+        return await single, await many, batches
+
+    single, many, batches = asyncio.run(scenario())
+    assert single == 42
+    assert many == {'SPY': 42, 'QQQ': 'qqq', 'DIA': 'dia'}
+    assert batches == [['QQQ', 'DIA']]
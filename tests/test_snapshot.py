@@ -0,0 +1,24 @@
+import json
+
+import stockwatch
+
+
+def stock_data(symbol: str, price: float) -> dict:
+    return {'symbol': symbol, 'current_price': price}
+
+
+def test_snapshot_holds_every_workers_entries(make_bot, tmp_path):
+    cache_file, snapshot_file = str(tmp_path / 'quote_cache.db'), str(tmp_path / 'market_snapshot.json')
+    first, second = (make_bot(shared_cache_file=cache_file, snapshot_file=snapshot_file) for _ in range(2))
+    second.snapshot_writer = False
+    first.cache.set('snapshot', 'SPY', (stock_data('SPY', 1.0), 100.0))
+    second.cache.set('snapshot', 'QQQ', (stock_data('QQQ', 2.0), 200.0))
+
+    second.save_snapshot()
+    assert not (tmp_path / 'market_snapshot.json').exists()
+    first.save_snapshot()
+    with open(snapshot_file) as f:
+        snapshot = json.load(f)
+    assert snapshot == {'SPY': {'data': stock_data('SPY', 1.0), 'fetched_at': 100.0},
+                        'QQQ': {'data': stock_data('QQQ', 2.0), 'fetched_at': 200.0}}
+    assert not list(tmp_path.glob('*.tmp'))
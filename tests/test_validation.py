@@ -0,0 +1,44 @@
+import asyncio
+
+import stockwatch
+
+
+class StubClient:
+    """MarketDataClient that answers with queued Alpha Vantage replies"""
+
+    def __init__(self, *replies):
+        self.replies = list(replies)
+        self.requests = 0
+
+    async def query(self, function: str, symbol: str) -> dict:
+        self.requests += 1
+        return self.replies.pop(0)
+
+
+def alpha_vantage_bot(make_bot, *replies):
+    bot = make_bot()
+    client = StubClient(*replies)
+    quota = stockwatch.QuotaScheduler(per_minute=10 ** 6, per_day=10 ** 6)
+    bot.provider = bot.alpha_vantage = stockwatch.AlphaVantageProvider(client, quota, bulk=False)
+    return bot, client
+
+
+def test_provider_errors_are_not_remembered_as_invalid(make_bot):
+    bot, client = alpha_vantage_bot(
+        make_bot,
+        {'Information': 'Thank you for using Alpha Vantage! Our standard API rate limit is 25 requests per day.'},
+        {'Error Message': 'the parameter apikey is invalid or missing.'},
+        {'Global Quote': {'01. symbol': 'AAPL', '05. price': '190.0000'}}
+    )
+    for _ in range(2):
+        assert asyncio.run(bot.validate_symbols(['AAPL'])) == [None]
+        assert bot.cache.get('invalid', 'AAPL') is None
+    assert asyncio.run(bot.validate_symbols(['AAPL'])) != [None]
+    assert client.requests == 3
+
+
+def test_unknown_tickers_are_remembered(make_bot):
+    bot, client = alpha_vantage_bot(make_bot, {'Global Quote': {}})
+    for _ in range(2):
+        assert asyncio.run(bot.validate_symbols(['NOPE'])) == [None]
+    assert client.requests == 1
@@ -0,0 +1,60 @@
+import json
+import random
+import threading
+
+import stockwatch
+
+
+def test_index_stays_consistent_under_concurrent_writers():
+    index = stockwatch.WatchlistIndex({'0': ['SPY']})
+    universe = [f"SYM{i}" for i in range(20)]
+    expected = {}
+    stop = threading.Event()
+    snapshot_errors = []
+
+    def writer(user: int):
+        rng, watchlist = random.Random(user), {}
+        for _ in range(2000):
+            symbol = rng.choice(universe)
+            if rng.random() < 0.6:
+                assert index.add(user, symbol) == (symbol not in watchlist)
+                watchlist[symbol] = None
+            else:
+                assert index.remove(user, symbol) == (symbol in watchlist)
+                watchlist.pop(symbol, None)
+        expected[str(user)] = list(watchlist)
+
+    def reader():
+        while not stop.is_set():
+            try:
+                index.to_dict(), index.symbols(), [index.subscribers(symbol) for symbol in universe]
+            except RuntimeError as e:  # e.g. "dictionary changed size during iteration"
+                snapshot_errors.append(e)
+
+    readers = [threading.Thread(target=reader) for _ in range(2)]
+    writers = [threading.Thread(target=writer, args=(user,)) for user in range(1, 5)]
+    for thread in readers + writers:
+        thread.start()
+    for thread in writers:
+        thread.join()
+    stop.set()
+    for thread in readers:
+        thread.join()
+
+    assert not snapshot_errors
+    for user, watchlist in expected.items():
+        assert index.get(user) == watchlist
+    for symbol in universe:
+        assert index.subscribers(symbol) == {user for user, watchlist in expected.items() if symbol in watchlist}
+    assert index.subscribers('SPY') == {'0'}
+
+
+def test_a_second_migration_of_the_same_file_is_harmless(tmp_path):
+    json_file, database_file = str(tmp_path / 'user_watchlists.json'), str(tmp_path / 'stock_watchlist.db')
+    with open(json_file, 'w') as f:
+        json.dump({'1': ['SPY', 'QQQ']}, f)
+    # Two processes saw the same JSON file; the first one renames it
+    first, second = stockwatch.SqliteWatchlistStorage(database_file), stockwatch.SqliteWatchlistStorage(database_file)
+    assert stockwatch.migrate_watchlists(json_file, first) == 2
+    assert stockwatch.migrate_watchlists(json_file, second) == 0
+    assert second.load() == {'1': ['SPY', 'QQQ']}
@@ -0,0 +1,148 @@
+import asyncio
+import json
+import socket
+
+import pytest
+
+import stockwatch
+
+
+class Pipe:
+    """Dispatcher-side end of a worker pipe that keeps what it is sent"""
+
+    def __init__(self):
+        self.sent = []
+
+    def send_bytes(self, data: bytes):
+        self.sent.append(data)
+
+
+def post(data: dict, secret: str = None) -> bytes:
+    """A webhook POST of data as Telegram sends it"""
+    body = json.dumps(data).encode()
+    token = f"X-Telegram-Bot-Api-Secret-Token: {secret}\r\n" if secret is not None else ""
+    return f"POST {stockwatch.WEBHOOK_PATH} HTTP/1.1\r\nContent-Length: {len(body)}\r\n{token}\r\n".encode() + body
+
+
+async def send(port: int, request: bytes):
+    """Status code the dispatcher answers a raw request with, or None if it hangs up without one"""
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write(request)
+    line = await reader.readline()
+    writer.close()
+    return int(line.split()[1]) if line else None
+
+
+def dispatch(dispatcher: stockwatch.WebhookDispatcher, requests: list) -> list:
+    """Statuses of raw requests sent to a dispatcher serving on a free local port, one connection each"""
+    async def scenario():
+        server = await asyncio.start_server(dispatcher.handle, '127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+        async with server:
+            return [await send(port, request) for request in requests]
+    return asyncio.run(scenario())
+
+
+def message(user_id: int, chat_id: int = None) -> dict:
+    return {'update_id': 1, 'message': {'message_id': 1, 'date': 0, 'text': '/list',
+                                        'from': {'id': user_id, 'is_bot': False, 'first_name': 'A'},
+                                        'chat': {'id': chat_id or user_id, 'type': 'private'}}}
+
+
+def test_dispatcher_needs_a_secret():
+    with pytest.raises(ValueError):
+        stockwatch.WebhookDispatcher([Pipe()], None)
+
+
+def test_updates_without_the_secret_are_rejected():
+    pipe = Pipe()
+    dispatcher = stockwatch.WebhookDispatcher([pipe], 'right')
+    statuses = dispatch(dispatcher, [post(message(1)), post(message(1), 'wrong'), post(message(1), 'right')])
+    dispatcher.close()
+    assert statuses == [403, 403, 200]
+    assert len(pipe.sent) == 1
+
+
+def test_bodies_are_not_read_before_the_request_is_accepted(monkeypatch):
+    monkeypatch.setattr(stockwatch, 'WEBHOOK_READ_TIMEOUT', 0.5)
+    pipe = Pipe()
+    dispatcher = stockwatch.WebhookDispatcher([pipe], 'right')
+
+    def head(length: int, secret: str = 'right', path: str = stockwatch.WEBHOOK_PATH) -> bytes:
+        # Only the head: these requests would stall if the dispatcher waited for the body
+        return (f"POST {path} HTTP/1.1\r\nContent-Length: {length}\r\n"
+                f"X-Telegram-Bot-Api-Secret-Token: {secret}\r\n\r\n").encode()
+
+    statuses = dispatch(dispatcher, [head(10 ** 10, path='/elsewhere'), head(10 ** 10, secret='wrong'),
+                                     head(stockwatch.WEBHOOK_MAX_BODY + 1), head(100),
+                                     b"POST /telegram HTTP/1.1\r\nContent-Le"])
+    dispatcher.close()
+    assert statuses == [404, 403, 413, None, None]  # the last two time out
+    assert not pipe.sent
+
+
+def test_a_user_is_routed_to_one_worker_from_any_chat():
+    pipes = [Pipe() for _ in range(4)]
+    dispatcher = stockwatch.WebhookDispatcher(pipes, 'right')
+    button = {'update_id': 2, 'callback_query': {'id': '1', 'chat_instance': '1', 'data': 'x',
+                                                 'from': {'id': 6, 'is_bot': False, 'first_name': 'A'},
+                                                 'message': {'message_id': 1, 'date': 0,
+                                                             'chat': {'id': -100, 'type': 'group'}}}}
+    statuses = dispatch(dispatcher, [post(message(6), 'right'), post(message(6, chat_id=-101), 'right'), post(button, 'right')])
+    dispatcher.close()
+    assert statuses == [200] * 3
+    assert [len(pipe.sent) for pipe in pipes] == [0, 0, 3, 0]  # user 6 % 4 workers
+
+
+def test_webhook_mode_refuses_to_start_without_a_secret(monkeypatch):
+    monkeypatch.setattr(stockwatch, 'WEBHOOK_SECRET', None)
+    monkeypatch.setattr(stockwatch, 'WEBHOOK_URL', None)
+    monkeypatch.setattr(stockwatch, 'WEBHOOK_WORKERS', 1)
+    monkeypatch.setattr(stockwatch, 'start_workers', lambda: pytest.fail("workers started"))
+    with pytest.raises(SystemExit):
+        asyncio.run(stockwatch.serve_webhook())
+
+
+def test_watchlists_are_migrated_before_the_workers_start(monkeypatch, tmp_path):
+    json_file, database_file = str(tmp_path / 'user_watchlists.json'), str(tmp_path / 'stock_watchlist.db')
+    with open(json_file, 'w') as f:
+        json.dump({'1': ['SPY']}, f)
+    for name, value in {'WATCHLIST_BACKEND': 'sqlite', 'WATCHLIST_FILE': json_file, 'DATABASE_FILE': database_file,
+                        'WEBHOOK_SECRET': 'right', 'WEBHOOK_URL': None}.items():
+        monkeypatch.setattr(stockwatch, name, value)
+
+    def start_workers():
+        assert stockwatch.SqliteWatchlistStorage(database_file).load() == {'1': ['SPY']}
+        raise RuntimeError("stop here")
+
+    monkeypatch.setattr(stockwatch, 'start_workers', start_workers)
+    with pytest.raises(RuntimeError, match="stop here"):
+        asyncio.run(stockwatch.serve_webhook())
+    assert not (tmp_path / 'user_watchlists.json').exists()
+
+
+def test_front_process_serves_its_routing_counts(monkeypatch):
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        metrics_port = probe.getsockname()[1]
+    for name, value in {'WEBHOOK_SECRET': 'right', 'WEBHOOK_URL': None, 'WEBHOOK_LISTEN': '127.0.0.1',
+                        'WEBHOOK_PORT': 0, 'WATCHLIST_BACKEND': 'json', 'WEBHOOK_WORKERS': 1,
+                        'METRICS_HOST': '127.0.0.1', 'METRICS_PORT': metrics_port, 'metrics': stockwatch.Metrics()}.items():
+        monkeypatch.setattr(stockwatch, name, value)
+    monkeypatch.setattr(stockwatch, 'start_workers', lambda: ([], [Pipe()]))
+    monkeypatch.setattr(stockwatch, 'stop_workers', lambda processes, connections: [])
+    stockwatch.metrics.inc('webhook_updates_total', worker=0)
+
+    async def scenario():
+        front = asyncio.create_task(stockwatch.serve_webhook())
+        await asyncio.sleep(0.1)
+        reader, writer = await asyncio.open_connection('127.0.0.1', metrics_port)
+        writer.write(b"GET /metrics HTTP/1.1\r\n\r\n")
+        response = await reader.read()
+        writer.close()
+        front.cancel()
+        await asyncio.gather(front, return_exceptions=True)
+        return response.decode()
+
+    response = asyncio.run(scenario())
+    assert response.startswith("HTTP/1.1 200") and 'webhook_updates_total{worker="0"} 1' in response